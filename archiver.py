@@ -0,0 +1,82 @@
+"""
+Перенос завершённых задач в архив (таблица task_archive).
+
+Завершённые задачи не нужны ни в списке задач, ни в напоминаниях, но остаются в task и замедляют
+все запросы к ней. Архиватор периодически переносит задачи с итоговым прогрессом, которые не
+менялись дольше age секунд, в task_archive. Перенос идёт небольшими пачками по возрастанию id
+(keyset), каждая пачка — отдельная короткая транзакция, между пачками — пауза, чтобы не мешать
+обработчикам. Архив читается только командой /archive.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+class TaskArchiver:
+    """Фоновый перенос завершённых задач в архив."""
+
+    def __init__(self, pool, age: float = 30 * 86400, statuses: Sequence[str] = ("Completed",),
+                 batch_size: int = 500, interval: float = 3600, pause: float = 0.1):
+        """
+        :param pool: Пул соединений с базой данных.
+        :param age: Через сколько секунд после последнего изменения завершённая задача уходит в архив.
+        :param statuses: Значения prpgress, при которых задача считается завершённой.
+        :param batch_size: Сколько задач переносить одной транзакцией.
+        :param interval: Период запуска архивации, сек.
+        :param pause: Пауза между пачками, сек.
+        """
+        self._pool = pool
+        self.age = age
+        self.statuses = tuple(statuses)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.batches = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """
+        Переносит в архив все подходящие задачи, пачка за пачкой.
+
+        :param now: (опционально) Текущий момент; по умолчанию datetime.now().
+        :return: Число перенесённых задач.
+        """
+        before = (now or datetime.now()) - timedelta(seconds=self.age)
+        archived = 0
+        after_id: Optional[int] = 0
+        while after_id is not None:
+            moved, after_id = await crud.archive_tasks(self._pool, self.statuses, before, after_id, self.batch_size)
+            archived += moved
+            self.batches += 1
+            if after_id is not None and self.pause:
+                await asyncio.sleep(self.pause)
+        self.archived += archived
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self.run_once()
+            except Exception:
+                logger.exception("Не удалось перенести завершённые задачи в архив")
+            else:
+                if archived:
+                    logger.info("В архив перенесено задач: %d", archived)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict:
+        return {"archived": self.archived, "batches": self.batches}
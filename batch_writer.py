@@ -0,0 +1,88 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Sequence, Set
+
+
+class BatchWriter:
+    """
+    Буфер отложенной записи (write-behind).
+
+    Строки, переданные в submit(), копятся в буфере и записываются одной пачкой —
+    когда в буфере набралось max_rows строк или прошло max_delay секунд с первой строки.
+    Каждый вызывающий получает свой результат: если пачка не записалась целиком,
+    строки повторно записываются по одной, и ошибка достаётся только тому, чья строка не прошла.
+    """
+
+    def __init__(self, flush_func: Callable[[Sequence[tuple]], Awaitable[None]],
+                 max_rows: int = 100, max_delay: float = 0.05):
+        """
+        :param flush_func: Корутина, записывающая список строк одной транзакцией.
+        :param max_rows: Размер буфера, при котором запись начинается сразу.
+        :param max_delay: Максимальное время ожидания строки в буфере, сек.
+        """
+        self._flush_func = flush_func
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._buffer: List[tuple] = []  # Пары (строка, future вызывающего)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Set[asyncio.Task] = set()
+        self._closed = False
+        self.flushes = 0  # Сколько пачек записано
+        self.rows_written = 0  # Сколько строк записано
+
+    async def submit(self, row: tuple):
+        """
+        Ставит строку в очередь на запись и ждёт, пока она будет записана.
+
+        :param row: Кортеж значений для вставки.
+        :raises RuntimeError: Если буфер уже закрыт.
+        """
+        if self._closed:
+            raise RuntimeError("BatchWriter закрыт, запись невозможна.")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append((row, future))
+        if len(self._buffer) >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+        await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: List[tuple]):
+        try:
+            await self._flush_func([row for row, _ in batch])
+        except Exception:
+            # Пачка не записалась — пишем строки по одной, чтобы ошибка досталась только виновнику
+            for row, future in batch:
+                try:
+                    await self._flush_func([row])
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.rows_written += 1
+                    if not future.done():
+                        future.set_result(None)
+            return
+        self.flushes += 1
+        self.rows_written += len(batch)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        """Запрещает новые записи, сбрасывает буфер и дожидается завершения всех записей."""
+        self._closed = True
+        self._start_flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
@@ -0,0 +1,334 @@
+"""
+Нагрузочный тест обработчиков бота.
+
+Синтетические обновления (/start, /add_task, /view_task, /update_task) прогоняются через
+Dispatcher.feed_update с заглушкой вместо Telegram Bot API и с SQLite (или хранилищем в памяти) вместо MySQL.
+
+Запуск:  python benchmark.py --users 50 --rounds 20 --output bench.json
+Сравнение с прошлым результатом:  python benchmark.py --baseline bench.json
+Память и время чтения большого списка задач (словари против строк TaskRow):  python benchmark.py --rows 50000
+Время поиска по названию среди задач одного пользователя:  python benchmark.py --search 5000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Chat, Message, Update
+
+from memory_storage import MemoryStorage
+from sqlite_pool import open_sqlite_storage, query_counter
+
+# Команды в том порядке, в котором их отправляет каждый синтетический пользователь за раунд
+COMMANDS = ["start", "add_task", "view_task", "update_task"]
+
+
+class StubSession(BaseSession):
+    """Сессия Bot API, которая ничего не отправляет, а только считает вызовы."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return Message(message_id=self.requests, date=datetime.now(),
+                           chat=Chat(id=method.chat_id or 0, type="private"), text=method.text)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_update(update_id: int, user: int, text: str) -> Update:
+    """Создаёт обновление с текстовым сообщением от пользователя user."""
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user, "type": "private", "username": f"user{user}"},
+            "from": {"id": user, "is_bot": False, "first_name": f"User {user}"},
+            "text": text,
+        },
+    })
+
+
+def generate_updates(users: int, rounds: int) -> List[tuple]:
+    """
+    Генерирует обновления: в каждом раунде каждый пользователь по очереди отправляет все команды.
+
+    :return: Список пар (команда, обновление).
+    """
+    updates = []
+    update_id = 0
+    for round_no in range(rounds):
+        for user in range(1, users + 1):
+            texts = {
+                "start": "/start",
+                "add_task": f"/add_task Задача {round_no}, 12:30, 25.12.30",
+                "view_task": "/view_task",
+                "update_task": f"/update_task прогресс, Задача {round_no}, Completed",
+            }
+            for command in COMMANDS:
+                update_id += 1
+                updates.append((command, make_update(update_id, user, texts[command])))
+    return updates
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def run_benchmark(users: int = 50, rounds: int = 10, concurrency: int = 10,
+                        database: str = ":memory:", backend: str = "sqlite") -> Dict:
+    """
+    Прогоняет обновления через диспетчер и возвращает результаты в виде словаря.
+
+    :param users: Число синтетических пользователей.
+    :param rounds: Сколько раз каждый пользователь отправляет набор команд.
+    :param concurrency: Сколько пользователей обрабатываются одновременно.
+    :param database: Путь к базе SQLite.
+    :param backend: "sqlite" или "memory" (MemoryStorage, без SQL-запросов).
+    """
+    from crud import known_users, task_cache
+    from hendlers import router
+
+    # Кэши общие для процесса — сбрасываем, чтобы каждый запуск начинался в одинаковых условиях
+    known_users.clear()
+    task_cache.clear()
+    pool = MemoryStorage() if backend == "memory" else await open_sqlite_storage(database)
+    session = StubSession()
+    bot = Bot("123456:BENCHMARK", session=session)
+    dp = Dispatcher()
+    dp.include_routers(router)
+    dp["pool"] = pool
+
+    updates = generate_updates(users, rounds)
+    latencies: Dict[str, List[float]] = {command: [] for command in COMMANDS}
+    queries: Dict[str, int] = {command: 0 for command in COMMANDS}
+
+    # Обновления одного пользователя идут строго по порядку, разные пользователи — параллельно
+    by_user: Dict[int, List[tuple]] = {}
+    for command, update in updates:
+        by_user.setdefault(update.message.chat.id, []).append((command, update))
+    slots = asyncio.Semaphore(concurrency)
+
+    async def replay(user_updates: List[tuple]):
+        async with slots:
+            for command, update in user_updates:
+                counter = [0]
+                token = query_counter.set(counter)
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                finally:
+                    latencies[command].append((time.perf_counter() - started) * 1000)
+                    query_counter.reset(token)
+                queries[command] += counter[0]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(replay(user_updates) for user_updates in by_user.values()))
+    elapsed = time.perf_counter() - started
+    await pool.wait_closed()
+    # Отсоединяем общий router от временного диспетчера, чтобы бенчмарк можно было запустить повторно
+    dp.sub_routers.remove(router)
+    router._parent_router = None
+
+    handlers = {}
+    for command in COMMANDS:
+        values = latencies[command]
+        handlers[command] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "mean_ms": round(statistics.fmean(values), 3) if values else 0.0,
+            "queries_per_update": round(queries[command] / len(values), 3) if values else 0.0,
+        }
+    return {
+        "users": users,
+        "rounds": rounds,
+        "concurrency": concurrency,
+        "backend": backend,
+        "updates": len(updates),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "queries_per_update": round(sum(queries.values()) / len(updates), 3) if updates else 0.0,
+        "bot_api_calls": session.requests,
+        "handlers": handlers,
+    }
+
+
+async def run_row_benchmark(rows: int = 20000, repeat: int = 5, database: str = ":memory:") -> Dict:
+    """
+    Сравнивает чтение большого списка задач одного пользователя строками-словарями (DictCursor,
+    как crud читал задачи раньше) и строками TaskRow (crud сейчас).
+
+    :param rows: Сколько задач у пользователя.
+    :param repeat: Сколько раз повторить чтение; время берётся лучшее.
+    :param database: Путь к базе SQLite.
+    :return: Для обоих вариантов: время чтения и доступа к полям на строку (мкс) и память на строку (байт).
+    """
+    import aiomysql
+    import crud
+    from queries import TASK_COLUMNS
+
+    pool = await open_sqlite_storage(database)
+    user = "benchmark"
+    for start in range(0, rows, 1000):
+        await crud.create_tasks(pool, [(f"Задача {i}", user, "2030-12-25", "12:00:00", "Pending", None)
+                                       for i in range(start, min(start + 1000, rows))])
+
+    async def read_dicts():
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(f"SELECT {TASK_COLUMNS} FROM task WHERE users_tgteg = %s ORDER BY id", (user,))
+                return await cur.fetchall()
+
+    async def read_rows():
+        return await crud._select_tasks(pool, user, None, None, None)
+
+    def touch_dicts(items):
+        for task in items:
+            task["name"], task["date_end"], task["time_end"], task["prpgress"], task["schedulecol"]
+
+    def touch_rows(items):
+        for task in items:
+            task.name, task.date_end, task.time_end, task.prpgress, task.schedulecol
+
+    result: Dict = {"rows": rows}
+    try:
+        for label, read, touch in (("dict", read_dicts, touch_dicts), ("row", read_rows, touch_rows)):
+            read_times, touch_times = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                items = await read()
+                read_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                touch(items)
+                touch_times.append(time.perf_counter() - started)
+            del items
+            # Память, которую занимает прочитанный список вместе со значениями колонок
+            gc.collect()
+            tracemalloc.start()
+            items = await read()
+            retained = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del items
+            result[label] = {
+                "read_us_per_row": round(min(read_times) / rows * 1e6, 3),
+                "access_us_per_row": round(min(touch_times) / rows * 1e6, 3),
+                "bytes_per_row": round(retained / rows, 1),
+            }
+    finally:
+        await pool.wait_closed()
+    result["memory_saved_pct"] = round(100 * (1 - result["row"]["bytes_per_row"] / result["dict"]["bytes_per_row"]), 1)
+    result["read_speedup"] = round(result["dict"]["read_us_per_row"] / result["row"]["read_us_per_row"], 2)
+    return result
+
+
+async def run_search_benchmark(tasks: int = 5000, repeat: int = 100) -> Dict:
+    """
+    Измеряет время поиска по названию (TaskSearch.search) среди tasks задач одного пользователя.
+
+    :param tasks: Сколько задач у пользователя.
+    :param repeat: Сколько раз повторить каждый запрос.
+    :return: Среднее время запроса (мкс) для подстроки и для запроса с опечаткой.
+    """
+    import crud
+    from task_search import TaskSearch
+
+    pool = MemoryStorage()
+    user = "benchmark"
+    await crud.create_tasks(pool, [(f"Задача номер {i}", user, None, None, None, None) for i in range(tasks)]
+                            + [("Купить молоко", user, None, None, None, None)])
+    search = TaskSearch(pool, idle_ttl=None)
+    await search.search(user, "молоко")  # Построение индекса не входит в замер
+    result: Dict = {"tasks": tasks + 1}
+    for label, query in (("substring_us", "купить молок"), ("typo_us", "купить малоко")):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await search.search(user, query)
+        result[label] = round((time.perf_counter() - started) / repeat * 1e6, 1)
+    return result
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Сравнивает результат с прошлым запуском.
+
+    :param tolerance: Допустимое ухудшение в долях (0.1 — 10%).
+    :return: Список найденных регрессий.
+    """
+    regressions = []
+    if result["throughput_ups"] < baseline["throughput_ups"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput_ups']} -> {result['throughput_ups']} updates/s")
+    for command, stats in result["handlers"].items():
+        old = baseline.get("handlers", {}).get(command)
+        if not old:
+            continue
+        if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{command} p95: {old['p95_ms']} -> {stats['p95_ms']} ms")
+        if stats["queries_per_update"] > old["queries_per_update"]:
+            regressions.append(f"{command} queries/update: {old['queries_per_update']} -> {stats['queries_per_update']}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--database", default=":memory:", help="Файл SQLite (по умолчанию база в памяти)")
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite", help="Хранилище данных")
+    parser.add_argument("--output", help="Куда сохранить результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимое ухудшение, доля")
+    parser.add_argument("--rows", type=int,
+                        help="Вместо нагрузочного теста сравнить чтение стольких задач словарями и строками TaskRow")
+    parser.add_argument("--search", type=int, help="Вместо нагрузочного теста замерить поиск среди стольких задач")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.rows:
+        result = asyncio.run(run_row_benchmark(args.rows, database=args.database))
+    elif args.search:
+        result = asyncio.run(run_search_benchmark(args.search))
+    else:
+        result = asyncio.run(run_benchmark(args.users, args.rounds, args.concurrency, args.database,
+                                           args.backend))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    if args.baseline and not args.rows and not args.search:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("Регрессия:", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
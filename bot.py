@@ -1,14 +1,260 @@
+import argparse
 import asyncio
+import functools
+import logging
+from datetime import time as dtime
+from typing import Optional
+import config
+import crud
+import hendlers
+import metrics
 from aiogram import Bot, Dispatcher
 from hendlers import router
 from config import BOT_TOKEN
+from crud import known_users, task_cache, enable_task_batching, disable_task_batching
+from db_pool import close_pool
+from reminders import ReminderScheduler
+from migrations import migrate, check_schema
+from storage import open_storage
+from chat_queue import ChatQueue, ChatOrderingMiddleware
+from task_stats import TaskStats, DailyDigest
+from task_search import TaskSearch
+from archiver import TaskArchiver
+import lifecycle
+from send_queue import BULK, SendQueue
 
-async def main():
-    bot = Bot(BOT_TOKEN)
+logger = logging.getLogger(__name__)
+
+
+async def report_pool_stats(pool, interval: float, chat_queue: Optional[ChatQueue] = None):
+    """
+    Периодически пишет в лог размер пула, время ожидания соединения, статистику кэшей и очереди чатов.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("DB pool: %s", pool.stats())
+        logger.info("Known users cache: %s", known_users.stats())
+        logger.info("Task list cache: %s", task_cache.stats())
+        if chat_queue is not None:
+            logger.info("Chat queue: %s", chat_queue.stats())
+
+
+async def on_startup(dispatcher: Dispatcher, bot: Bot):
+    """
+    Готовит ресурсы бота перед приёмом обновлений: пул соединений, буфер записи, напоминания.
+    """
+    # Одно хранилище на весь процесс: создаётся при старте и передаётся во все обработчики как аргумент pool
+    backend = getattr(config, "STORAGE_BACKEND", "mysql")
+    pool = await open_storage(backend)
+    dispatcher["pool"] = pool
+    logger.info("Storage %s ready: %s", backend, pool.stats())
+    if backend == "mysql":
+        # Схему SQLite создаёт sqlite_pool, у хранилища в памяти схемы нет
+        if getattr(config, "DB_AUTO_MIGRATE", False):
+            await migrate(pool.pool)
+        if getattr(config, "DB_SCHEMA_CHECK", True):
+            # Без нужных индексов бот не запускается, чтобы не работать на полных просмотрах таблиц
+            await check_schema(pool.pool)
+    # Первые обновления после запуска (в том числе накопившиеся за время перезапуска) не ждут
+    # открытия соединений и не ходят в базу за известными пользователями
+    warm = await lifecycle.warm_up(
+        pool,
+        connections=getattr(config, "DB_WARMUP_CONNECTIONS", getattr(config, "DB_POOL_MAXSIZE", 10)),
+        users=getattr(config, "WARMUP_USERS", known_users.maxsize),
+    )
+    logger.info("Warm-up: %s", warm)
+    if getattr(config, "TASK_BATCH_ENABLED", False):
+        enable_task_batching(
+            pool,
+            max_rows=getattr(config, "TASK_BATCH_MAX_ROWS", 100),
+            max_delay=getattr(config, "TASK_BATCH_MAX_DELAY_MS", 50) / 1000,
+        )
+    send_queue = None
+    send = bot.send_message
+    if getattr(config, "SEND_QUEUE_ENABLED", True):
+        # Ответы и рассылки отправляются через очередь с ограничением частоты; ответы идут раньше рассылок
+        send_queue = SendQueue(
+            bot,
+            global_rate=getattr(config, "SEND_GLOBAL_RATE", 30),
+            chat_rate=getattr(config, "SEND_CHAT_RATE", 1),
+            chat_burst=getattr(config, "SEND_CHAT_BURST", 3),
+            max_concurrency=getattr(config, "SEND_MAX_CONCURRENCY", 10),
+            max_bulk_pending=getattr(config, "SEND_MAX_BULK_PENDING", 10000),
+            max_retries=getattr(config, "SEND_MAX_RETRIES", 5),
+        )
+        send_queue.start()
+        send = functools.partial(send_queue.send, priority=BULK)
+    dispatcher["send_queue"] = send_queue
+    reminders = None
+    if getattr(config, "REMINDERS_ENABLED", True):
+        # Напоминания о сроках задач: сроки подгружаются окнами и хранятся в куче в памяти
+        reminders = ReminderScheduler(
+            pool,
+            send=send,
+            window=getattr(config, "REMINDER_WINDOW_SECONDS", 3600),
+            lead=getattr(config, "REMINDER_LEAD_MINUTES", 0) * 60,
+            state_file=getattr(config, "REMINDER_STATE_FILE", "reminders_state.json"),
+        )
+        await reminders.start()
+    dispatcher["reminders"] = reminders
+    # Счётчики для /stats обновляются по изменениям задач и периодически сверяются с базой
+    task_stats = TaskStats(
+        pool,
+        max_users=getattr(config, "STATS_CACHE_USERS", 10000),
+        reconcile_interval=getattr(config, "STATS_RECONCILE_INTERVAL", 3600),
+    )
+    task_stats.start()
+    dispatcher["task_stats"] = task_stats
+    digest = None
+    if getattr(config, "DIGEST_ENABLED", False):
+        hour, minute = map(int, getattr(config, "DIGEST_TIME", "09:00").split(":"))
+        digest = DailyDigest(pool, task_stats, send=send, at=dtime(hour, minute))
+        digest.start()
+    dispatcher["digest"] = digest
+    # Индексы названий задач для /find строятся при первом поиске и вытесняются у неактивных пользователей
+    task_search = TaskSearch(
+        pool,
+        max_users=getattr(config, "SEARCH_CACHE_USERS", 1000),
+        idle_ttl=getattr(config, "SEARCH_IDLE_TTL", 1800),
+    )
+    task_search.start()
+    dispatcher["task_search"] = task_search
+    archiver = None
+    if getattr(config, "ARCHIVE_ENABLED", True):
+        # Завершённые задачи уходят из task в task_archive, чтобы горячая таблица оставалась маленькой
+        archiver = TaskArchiver(
+            pool,
+            age=getattr(config, "ARCHIVE_AFTER_DAYS", 30) * 86400,
+            statuses=getattr(config, "ARCHIVE_STATUSES", ("Completed",)),
+            batch_size=getattr(config, "ARCHIVE_BATCH_SIZE", 500),
+            interval=getattr(config, "ARCHIVE_INTERVAL", 3600),
+            pause=getattr(config, "ARCHIVE_BATCH_PAUSE", 0.1),
+        )
+        archiver.start()
+    dispatcher["archiver"] = archiver
+    dispatcher["metrics_server"] = None
+    if getattr(config, "METRICS_ENABLED", False):
+        # Замеры подключаются только при включённых метриках, иначе обработчики и crud не оборачиваются
+        metrics.instrument_crud(crud, hendlers)
+        metrics.instrument_router(router)
+        if hasattr(getattr(pool, "pool", None), "freesize"):
+            # Ожидание соединения считает сам пул SQL-хранилища, у MemoryStorage пула нет
+            metrics.instrument_pool(pool.pool)
+        metrics.register_cache("known_users", known_users)
+        metrics.register_cache("task_list", task_cache)
+        if dispatcher.get("chat_queue") is not None:
+            metrics.register_chat_queue(dispatcher["chat_queue"])
+        if send_queue is not None:
+            metrics.register_send_queue(send_queue)
+        metrics.register_startup(lambda: lifecycle.startup_seconds)
+        dispatcher["metrics_server"] = await metrics.start_metrics_server(
+            getattr(config, "METRICS_HOST", "127.0.0.1"), getattr(config, "METRICS_PORT", 9100)
+        )
+    dispatcher["stats_task"] = asyncio.create_task(
+        report_pool_stats(pool, getattr(config, "DB_POOL_STATS_INTERVAL", 60), dispatcher.get("chat_queue"))
+    )
+    lifecycle.mark_ready()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    Освобождает ресурсы бота: останавливает напоминания, дописывает буфер и закрывает пул.
+    Всё вместе укладывается в SHUTDOWN_TIMEOUT секунд.
+    """
+    deadline = lifecycle.Deadline(getattr(config, "SHUTDOWN_TIMEOUT", 25))
+    dispatcher["stats_task"].cancel()
+    if dispatcher.get("chat_queue") is not None:
+        # Доделываем принятые обновления, пока пул ещё открыт; часть срока оставляем на запись буфера
+        queue = dispatcher["chat_queue"]
+        await queue.drain(timeout=deadline.remaining(reserve=lifecycle.FLUSH_RESERVE))
+        if queue.pending:
+            logger.warning("Shutdown deadline reached, updates left unprocessed: %s", queue.stats())
+        # Обработчики не должны обращаться к пулу после его закрытия; необработанные обновления
+        # не подтверждаются и придут снова после перезапуска
+        await queue.cancel()
+    if dispatcher["metrics_server"] is not None:
+        await dispatcher["metrics_server"].cleanup()
+    if dispatcher["reminders"] is not None:
+        await dispatcher["reminders"].stop()
+    if dispatcher["digest"] is not None:
+        await dispatcher["digest"].stop()
+    await dispatcher["task_stats"].stop()
+    await dispatcher["task_search"].stop()
+    if dispatcher["archiver"] is not None:
+        await dispatcher["archiver"].stop()
+    if dispatcher["send_queue"] is not None:
+        # Отправляем ответы на обработанные обновления, пока сессия бота открыта
+        await dispatcher["send_queue"].stop(timeout=deadline.remaining(reserve=lifecycle.FLUSH_RESERVE))
+    try:
+        # Дописываем задачи из буфера до закрытия пула
+        await asyncio.wait_for(disable_task_batching(), timeout=max(deadline.remaining(), 1.0))
+    except asyncio.TimeoutError:
+        logger.error("Task write buffer was not flushed before the shutdown deadline")
+    pool = dispatcher["pool"]
+    logger.info("DB pool on shutdown: %s", pool.stats())
+    await close_pool(pool)
+
+
+def create_dispatcher() -> Dispatcher:
+    """
+    Создаёт диспетчер с обработчиками бота и хуками запуска и остановки.
+    Используется и в режиме polling, и в режиме webhook.
+    """
     dp = Dispatcher()
     dp.include_routers(router)
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
-    
-if __name__ == '__main__': 
-    asyncio.run(main())
\ No newline at end of file
+    dp["chat_queue"] = None
+    tracker = lifecycle.UpdateTracker(state_file=getattr(config, "UPDATES_STATE_FILE", "updates_state.json"))
+    dp["update_tracker"] = tracker
+    if getattr(config, "CHAT_QUEUE_ENABLED", True):
+        # Обновления одного чата обрабатываются по порядку, разных чатов — параллельно.
+        # Одновременно работает не больше обработчиков, чем соединений в пуле
+        queue = ChatQueue(
+            max_in_flight=getattr(config, "CHAT_QUEUE_MAX_IN_FLIGHT", getattr(config, "DB_POOL_MAXSIZE", 10)),
+            max_pending=getattr(config, "CHAT_QUEUE_MAX_PENDING", 1000),
+        )
+        dp.update.outer_middleware(ChatOrderingMiddleware(queue, tracker))
+        dp["chat_queue"] = queue
+    else:
+        dp.update.outer_middleware(lifecycle.UpdateTrackingMiddleware(tracker))
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def main():
+    lifecycle.mark_started()
+    logging.basicConfig(level=logging.INFO)
+    bot = Bot(BOT_TOKEN)
+    dp = create_dispatcher()
+    # Обновления, пришедшие за время перезапуска, по умолчанию сохраняются и обрабатываются после запуска
+    await bot.delete_webhook(drop_pending_updates=getattr(config, "DROP_PENDING_UPDATES", False))
+    # getUpdates подтверждает только обработанные обновления
+    bot.session.middleware(lifecycle.UpdateOffsetMiddleware(dp["update_tracker"]))
+    try:
+        # С очередью чатов обновления передаются в диспетчер по одному: порядок сохраняется,
+        # а когда очередь заполнена, бот не запрашивает у Telegram новые обновления.
+        # SIGTERM и SIGINT останавливают приём обновлений, после чего вызывается on_shutdown
+        await dp.start_polling(bot, handle_as_tasks=dp["chat_queue"] is None, close_bot_session=False)
+    finally:
+        await lifecycle.confirm_updates(bot, dp["update_tracker"])
+        await bot.session.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Телеграм-бот со списком задач")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling",
+                        help="Способ получения обновлений от Telegram")
+    parser.add_argument("--host", default=getattr(config, "WEBHOOK_HOST", "0.0.0.0"),
+                        help="Адрес HTTP-сервера в режиме webhook")
+    parser.add_argument("--port", type=int, default=getattr(config, "WEBHOOK_PORT", 8080),
+                        help="Порт HTTP-сервера в режиме webhook")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode == "webhook":
+        from webhook import run_webhook
+        run_webhook(create_dispatcher, host=args.host, port=args.port)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,199 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш с вытеснением давно неиспользуемых записей (LRU)
+    и необязательным временем жизни записей (TTL).
+
+    Считает попадания, промахи и вытеснения — их можно получить через stats().
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: Максимальное число записей в кэше.
+        :param ttl: (опционально) Время жизни записи в секундах. None — записи не устаревают.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # ключ -> (значение, момент устаревания)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение по ключу и отмечает запись как недавно использованную."""
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение по ключу, не меняя порядок вытеснения и счётчики попаданий."""
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING or (item[1] is not None and item[1] <= time.monotonic()):
+            return default
+        return item[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Сохраняет значение; при переполнении вытесняет самую старую запись."""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удаляет запись из кэша (инвалидация)."""
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self) -> List[Hashable]:
+        """Возвращает ключи кэша от давно использованных к недавним, не меняя порядок вытеснения."""
+        return list(self._data)
+
+    def stats(self) -> Dict:
+        """Возвращает размер кэша и счётчики попаданий, промахов и вытеснений."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class TaskListCache:
+    """
+    Кэш списков задач по пользователям с вытеснением давно неиспользуемых пользователей (LRU).
+
+    Размер ограничен суммарным числом строк, а не числом ключей, чтобы один пользователь
+    с тысячами задач не занимал неограниченно много памяти. Для каждого пользователя
+    хранится несколько результатов (например, разные страницы), которые сбрасываются вместе
+    при любой записи в его задачи.
+
+    Чтение, начатое до инвалидации, не попадает в кэш: для этого чтения оборачиваются
+    в begin()/finish().
+    """
+
+    def __init__(self, max_rows: int = 50000, enabled: bool = True):
+        """
+        :param max_rows: Максимальное суммарное число закэшированных строк.
+        :param enabled: Включён ли кэш. Выключенный кэш всегда промахивается и ничего не хранит.
+        """
+        self.max_rows = max_rows
+        self.enabled = enabled
+        self._users: "OrderedDict[Hashable, Dict[Hashable, list]]" = OrderedDict()
+        self._weights: Dict[Hashable, int] = {}
+        self._rows = 0
+        self._clock = 0  # Счётчик инвалидаций
+        self._inflight = 0  # Сколько чтений из базы сейчас выполняется
+        self._invalidated: Dict[Hashable, int] = {}  # Пользователь -> момент последней инвалидации
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user: Hashable, key: Hashable) -> Optional[list]:
+        """Возвращает закэшированный результат или None."""
+        if not self.enabled:
+            return None
+        entries = self._users.get(user)
+        if entries is not None and key in entries:
+            self._users.move_to_end(user)
+            self.hits += 1
+            return entries[key]
+        self.misses += 1
+        return None
+
+    def begin(self) -> int:
+        """Отмечает начало чтения из базы. Результат нужно передать в finish()."""
+        self._inflight += 1
+        return self._clock
+
+    def finish(self, user: Hashable, key: Hashable, rows: Optional[list], started: int):
+        """
+        Завершает чтение из базы и кладёт результат в кэш,
+        если после begin() задачи пользователя не менялись.
+
+        :param rows: Прочитанные строки или None, если чтение завершилось ошибкой.
+        :param started: Значение, которое вернул begin().
+        """
+        self._inflight -= 1
+        if self.enabled and rows is not None and self._invalidated.get(user, 0) <= started:
+            self._store(user, key, rows)
+        if self._inflight == 0:
+            self._invalidated.clear()
+
+    def _store(self, user: Hashable, key: Hashable, rows: list):
+        weight = max(len(rows), 1)
+        if weight > self.max_rows:
+            return
+        entries = self._users.setdefault(user, {})
+        old = entries.get(key)
+        if old is not None:
+            self._adjust(user, -max(len(old), 1))
+        entries[key] = rows
+        self._adjust(user, weight)
+        self._users.move_to_end(user)
+        while self._rows > self.max_rows and len(self._users) > 1:
+            evicted, _ = self._users.popitem(last=False)
+            self._rows -= self._weights.pop(evicted)
+            self.evictions += 1
+
+    def _adjust(self, user: Hashable, delta: int):
+        self._weights[user] = self._weights.get(user, 0) + delta
+        self._rows += delta
+
+    def invalidate(self, user: Hashable):
+        """Сбрасывает все закэшированные результаты пользователя."""
+        self._clock += 1
+        self.invalidations += 1
+        if self._inflight:
+            self._invalidated[user] = self._clock
+        if self._users.pop(user, None) is not None:
+            self._rows -= self._weights.pop(user)
+
+    def clear(self):
+        self._users.clear()
+        self._weights.clear()
+        self._rows = 0
+
+    def stats(self) -> Dict:
+        """Возвращает заполненность кэша, долю попаданий и число вытеснений."""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "users": len(self._users),
+            "rows": self._rows,
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
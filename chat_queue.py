@@ -0,0 +1,135 @@
+"""
+Упорядоченная обработка обновлений: последовательно внутри одного чата, параллельно между чатами.
+
+ChatOrderingMiddleware ставит каждое обновление в очередь его чата и сразу возвращает управление.
+Очередь чата разбирает одна задача asyncio, поэтому /add_task и следующий за ним /view_task
+одного пользователя не обгоняют друг друга. Число одновременно работающих обработчиков ограничено
+(по умолчанию — размером пула соединений), а число принятых, но не обработанных обновлений —
+max_pending: когда очереди заполнены, приём новых обновлений (polling или webhook) ждёт.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class ChatQueue:
+    """
+    Очереди заданий по ключу (id чата) с общим ограничением параллельности.
+    """
+
+    def __init__(self, max_in_flight: int = 10, max_pending: int = 1000):
+        """
+        :param max_in_flight: Сколько заданий могут выполняться одновременно.
+        :param max_pending: Сколько заданий могут быть приняты и ещё не выполнены; submit ждёт, пока не освободится место.
+        """
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._queues: Dict[Hashable, Deque[Callable[[], Awaitable[Any]]]] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self.in_flight = 0
+        self.pending = 0
+
+    async def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]):
+        """
+        Ставит задание в очередь ключа. Задания одного ключа выполняются строго по очереди.
+        Возвращается, как только задание принято, не дожидаясь его выполнения.
+        """
+        await self._pending.acquire()
+        self.pending += 1
+        queue = self._queues.get(key)
+        if queue is None:
+            # Очереди нет — у ключа нет и задачи-обработчика, запускаем её
+            queue = self._queues[key] = deque()
+            worker = asyncio.create_task(self._work(key, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.append(job)
+
+    async def _work(self, key: Hashable, queue: Deque[Callable[[], Awaitable[Any]]]):
+        try:
+            while queue:
+                job = queue.popleft()
+                try:
+                    async with self._slots:
+                        self.in_flight += 1
+                        try:
+                            await job()
+                        finally:
+                            self.in_flight -= 1
+                except Exception:
+                    logger.exception("Ошибка при обработке обновления чата %s", key)
+                finally:
+                    self.pending -= 1
+                    self._pending.release()
+        finally:
+            # Между проверкой пустой очереди и удалением нет await, поэтому задание не потеряется
+            del self._queues[key]
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Дожидается выполнения уже принятых заданий."""
+        if self._workers:
+            await asyncio.wait(set(self._workers), timeout=timeout)
+
+    async def cancel(self):
+        """Отменяет выполняющиеся задания и отбрасывает ещё не начатые (при остановке после drain)."""
+        dropped = sum(len(queue) for queue in self._queues.values())
+        workers = set(self._workers)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues.clear()  # Задача, отменённая до первого запуска, свою очередь не удаляет
+        self.pending -= dropped
+        for _ in range(dropped):
+            self._pending.release()
+
+    def stats(self) -> Dict:
+        return {"chats": len(self._queues), "pending": self.pending, "in_flight": self.in_flight}
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    """
+    Внешняя middleware aiogram для событий update: передаёт обработку обновления в ChatQueue.
+    Подключается через dp.update.outer_middleware(...).
+    """
+
+    def __init__(self, queue: ChatQueue, tracker=None):
+        """
+        :param queue: Очередь заданий по чатам.
+        :param tracker: (опционально) lifecycle.UpdateTracker: отмечает приём и завершение обработки обновлений.
+        """
+        self.queue = queue
+        self.tracker = tracker
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Update, data: Dict[str, Any]) -> Any:
+        # event_chat и event_from_user заполняет встроенная UserContextMiddleware, она вызывается раньше
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        if chat is not None:
+            key = chat.id
+        elif user is not None:
+            key = ("user", user.id)
+        else:
+            key = ("update", event.update_id)  # Обновления без чата ни с чем не упорядочиваются
+        if self.tracker is None:
+            await self.queue.submit(key, lambda: handler(event, data))
+            return
+        if not self.tracker.begin(event.update_id):
+            return  # Повторная доставка уже принятого обновления
+
+        async def job():
+            try:
+                await handler(event, data)
+            except asyncio.CancelledError:
+                raise  # Обработка прервана остановкой: обновление останется неподтверждённым
+            except Exception:
+                self.tracker.end(event.update_id)
+                raise
+            self.tracker.end(event.update_id)
+
+        await self.queue.submit(key, job)
@@ -1,144 +1,444 @@
-import aiomysql
-from typing import List, Dict, Optional
+import config
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List, Dict, Optional, Sequence, Tuple
 from config import DB_SETTINGS
+from db_pool import create_pool
+from cache import LRUCache, TaskListCache
+from batch_writer import BatchWriter
+from queries import DeadlineRow, TaskGroupRow, TaskRow, TaskStateRow, UserRow, update_statement
 
 # Настройки для подключения к базе данных
 
+# Пользователи, наличие которых в таблице users уже подтверждено.
+# Для них ensure_user_exists не делает ни одного запроса к базе.
+known_users = LRUCache(
+    maxsize=getattr(config, "KNOWN_USERS_CACHE_SIZE", 10000),
+    ttl=getattr(config, "KNOWN_USERS_CACHE_TTL", 3600),
+)
+
+# Кэш списков задач по пользователям. Сбрасывается для пользователя при любой записи в его задачи.
+task_cache = TaskListCache(
+    max_rows=getattr(config, "TASK_CACHE_MAX_ROWS", 50000),
+    enabled=getattr(config, "TASK_CACHE_ENABLED", True),
+)
+
+# Буфер отложенной записи задач. Если включён (enable_task_batching), create_task
+# не пишет в базу сам, а ставит строку в буфер, который сбрасывается одной транзакцией.
+task_writer: Optional[BatchWriter] = None
+
+# Подписчики на изменения задач (например, планировщик напоминаний).
+# Вызываются синхронно как listener(event, users_tgteg, name, fields), где event — "create", "update" или "delete".
+# Для "update" name — прежнее название задачи, а fields — изменённые колонки.
+# "update" с name=None: fields изменены у нескольких задач пользователя, у каких именно — неизвестно.
+# Для "delete" с name=None удалены все задачи пользователя.
+# Для "archive" fields["count"] задач с названием name и прогрессом fields["prpgress"] перенесены в task_archive.
+task_listeners: List[Callable[[str, str, Optional[str], Dict], None]] = []
+
+
+def notify_task_change(event: str, users_tgteg: str, name: Optional[str], fields: Optional[Dict] = None):
+    """
+    Сообщает об изменении задач пользователя: сбрасывает кэш и оповещает подписчиков.
+    Вызывается из каждой функции, которая пишет в таблицу task.
+    """
+    task_cache.invalidate(users_tgteg)
+    for listener in task_listeners:
+        listener(event, users_tgteg, name, fields or {})
 
 
 async def create_task(pool, name: str, users_tgteg: str, date_end: Optional[str] = None, 
                       time_end: Optional[str] = None, progress: Optional[str] = None, 
                       schedulecol: Optional[str] = None):
+    """
+    Добавляет задачу в таблицу task.
+    Если включена пакетная запись, задача попадает в буфер и записывается вместе с другими.
+    """
+    if task_writer is not None:
+        await task_writer.submit((name, users_tgteg, date_end, time_end, progress, schedulecol))
+        return
+
+    await pool.insert_tasks([(name, users_tgteg, date_end, time_end, progress, schedulecol)])
+    notify_task_change("create", users_tgteg, name,
+                       {"date_end": date_end, "time_end": time_end, "prpgress": progress, "schedulecol": schedulecol})
+
+
+async def create_tasks(pool, rows: List[tuple]):
+    """
+    Добавляет несколько задач одним многострочным INSERT в одной транзакции.
+
+    :param pool: Хранилище (storage.Storage).
+    :param rows: Кортежи (name, users_tgteg, date_end, time_end, prpgress, schedulecol).
+    """
+    if not rows:
+        return
+    await pool.insert_tasks(rows)
+    for name, users_tgteg, date_end, time_end, progress, schedulecol in rows:
+        notify_task_change("create", users_tgteg, name,
+                           {"date_end": date_end, "time_end": time_end, "prpgress": progress,
+                            "schedulecol": schedulecol})
 
-    async with pool.acquire() as conn:  # Получаем соединение из пула
-        async with conn.cursor() as cur:  # Создаем курсор для выполнения SQL-запросов
-            # Выполняем SQL-запрос для добавления записи в таблицу task
-            await cur.execute("""
-                INSERT INTO task (name, users_tgteg, date_end, time_end, prpgress, schedulecol) 
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (name, users_tgteg, date_end, time_end, progress, schedulecol))
-            await conn.commit()  # Сохраняем изменения
 
+def enable_task_batching(pool, max_rows: int = 100, max_delay: float = 0.05) -> BatchWriter:
+    """
+    Включает пакетную запись задач: create_task начинает ставить задачи в общий буфер.
 
-async def read_tasks(pool, users_tgteg: Optional[str] = None) -> List[Dict]:
+    :param pool: Хранилище (storage.Storage).
+    :param max_rows: Сколько задач набрать, чтобы записать пачку сразу.
+    :param max_delay: Сколько секунд максимум задача ждёт в буфере.
+    :return: Созданный буфер записи.
     """
-    Считывает задачи из таблицы task. Может фильтровать по идентификатору пользователя.
+    global task_writer
+    task_writer = BatchWriter(lambda rows: create_tasks(pool, rows), max_rows=max_rows, max_delay=max_delay)
+    return task_writer
+
 
-    :param pool: Пул соединений с базой данных.
+async def disable_task_batching():
+    """Выключает пакетную запись, предварительно записав всё, что осталось в буфере."""
+    global task_writer
+    writer, task_writer = task_writer, None
+    if writer is not None:
+        await writer.close()
+
+
+async def read_tasks(pool, users_tgteg: Optional[str] = None, after_id: Optional[int] = None,
+                     before_id: Optional[int] = None, limit: Optional[int] = None) -> List[TaskRow]:
+    """
+    Считывает задачи из таблицы task. Может фильтровать по идентификатору пользователя
+    и читать задачи постранично (keyset-пагинация по id).
+
+    :param pool: Хранилище (storage.Storage).
     :param users_tgteg: (опционально) Идентификатор пользователя для фильтрации задач.
-    :return: Список задач в виде словарей.
+    :param after_id: (опционально) Вернуть задачи с id больше указанного (следующая страница).
+    :param before_id: (опционально) Вернуть задачи с id меньше указанного (предыдущая страница).
+    :param limit: (опционально) Максимальное число задач.
+    :return: Список задач (TaskRow), упорядоченный по id.
+        Результат может быть взят из кэша, поэтому изменять его нельзя.
     """
-    async with pool.acquire() as conn:  # Получаем соединение из пула
-        async with conn.cursor(aiomysql.DictCursor) as cur:  # Используем DictCursor для возврата данных в виде словарей
-            query = "SELECT * FROM task"  # Базовый SQL-запрос
-            params = []  # Параметры для фильтрации
-            if users_tgteg:
-                query += " WHERE users_tgteg = %s"  # Добавляем условие фильтрации по users_tgteg
-                params.append(users_tgteg)  # Добавляем значение в параметры
-            await cur.execute(query, params)  # Выполняем запрос с параметрами
-            return await cur.fetchall()  # Возвращаем все найденные записи
+    if not users_tgteg:
+        return await _select_tasks(pool, users_tgteg, after_id, before_id, limit)
+
+    key = (after_id, before_id, limit)
+    cached = task_cache.get(users_tgteg, key)
+    if cached is not None:
+        return cached
+    started = task_cache.begin()
+    rows = None
+    try:
+        rows = await _select_tasks(pool, users_tgteg, after_id, before_id, limit)
+    finally:
+        task_cache.finish(users_tgteg, key, rows, started)
+    return rows
+
 
+async def _select_tasks(pool, users_tgteg: Optional[str], after_id: Optional[int],
+                        before_id: Optional[int], limit: Optional[int]) -> List[TaskRow]:
+    """Читает задачи для read_tasks без использования кэша."""
+    return await pool.select_tasks(users_tgteg, after_id, before_id, limit)
+
+
+async def iter_tasks(pool, users_tgteg: str, batch_size: int = 500):
+    """
+    Перебирает все задачи пользователя, читая их из базы страницами по batch_size.
+    В отличие от read_tasks не держит весь список в памяти и не использует кэш.
 
-async def update_task(pool, name: str, users_tgteg: str, updates: Dict):
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :param batch_size: Сколько задач читать за один запрос.
+    """
+    after_id = None
+    while True:
+        rows = await _select_tasks(pool, users_tgteg, after_id, None, batch_size)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1].id
+
+
+async def read_task(pool, name: str, users_tgteg: str) -> Optional[TaskRow]:
+    """
+    Считывает одну задачу пользователя по названию.
+
+    :param pool: Хранилище (storage.Storage).
+    :param name: Название задачи.
+    :param users_tgteg: Идентификатор пользователя, владельца задачи.
+    :return: Задача (TaskRow) или None, если задача не найдена.
+    """
+    return await pool.read_task(name, users_tgteg)
+
+
+async def read_task_names(pool, users_tgteg: str) -> List[str]:
+    """
+    Считывает названия всех задач пользователя (только по индексу (users_tgteg, name)).
+    Используется для построения поискового индекса (см. task_search.py).
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :return: Названия задач, по одному на каждую задачу.
+    """
+    return await pool.read_task_names(users_tgteg)
+
+
+async def read_task_states(pool, users_tgteg: str) -> List[TaskStateRow]:
+    """
+    Считывает для каждой задачи пользователя только название, прогресс, дату срока и правило повтора.
+    Используется для пересчёта статистики (см. task_stats.py).
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :return: Список строк TaskStateRow с name, prpgress, date_end и schedulecol.
+    """
+    return await pool.read_task_states(users_tgteg)
+
+
+async def read_task_groups(pool, users_tgteg: Optional[Sequence[str]] = None) -> List[TaskGroupRow]:
+    """
+    Считает задачи по группам (пользователь, прогресс, дата срока, правило повтора) одним запросом GROUP BY.
+    Из групп строятся счётчики статистики без чтения задач по одной: для ежедневной сводки по всем
+    пользователям и для сверки счётчиков загруженных пользователей (см. task_stats.py).
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: (опционально) Только эти пользователи; по умолчанию — все.
+    :return: Список строк TaskGroupRow.
+    """
+    if users_tgteg is not None and not users_tgteg:
+        return []
+    return await pool.read_task_groups(users_tgteg)
+
+
+async def read_deadlines(pool, start, end) -> List[DeadlineRow]:
+    """
+    Считывает незавершённые задачи со сроком в диапазоне [start, end) вместе с id чата владельца,
+    а также незавершённые повторяющиеся задачи, ближайшее повторение которых (next_at) раньше end:
+    само повторение в диапазоне вычисляет вызывающий код (см. recurrence.occurrences), он же сдвигает
+    next_at (set_next_occurrences), поэтому задача не попадает в следующие диапазоны до своего повторения.
+    Использует индексы по колонкам deadline и next_at (см. migrations.py).
+
+    :param pool: Хранилище (storage.Storage).
+    :param start: Начало диапазона (datetime).
+    :param end: Конец диапазона, не включительно (datetime).
+    :return: Список строк DeadlineRow с id, name, users_tgteg, date_end, time_end, schedulecol, next_at
+        и chat (users.userscol).
+    """
+    return await pool.read_deadlines(start, end)
+
+
+async def read_task_deadlines(pool, users_tgteg: str, name: str) -> List[DeadlineRow]:
+    """
+    Считывает сроки незавершённых задач пользователя с указанным названием (их может быть несколько).
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :param name: Название задачи.
+    :return: Список строк DeadlineRow, как у read_deadlines.
+    """
+    return await pool.read_task_deadlines(users_tgteg, name)
+
+
+async def set_next_occurrences(pool, rows: Sequence[Tuple[int, Optional[datetime]]]):
+    """
+    Сохраняет ближайшие повторения повторяющихся задач (колонка next_at).
+    Служебная колонка планировщика: кэш и подписчики не оповещаются.
+
+    :param pool: Хранилище (storage.Storage).
+    :param rows: Пары (id задачи, ближайшее повторение datetime или None, если повторения закончились).
+    """
+    if rows:
+        await pool.set_next_occurrences(rows)
+
+
+async def update_task(pool, name: str, users_tgteg: str, updates: Dict) -> int:
     """
     Обновляет существующую задачу в таблице task.
 
-    :param pool: Пул соединений с базой данных.
+    :param pool: Хранилище (storage.Storage).
     :param name: Название задачи, которую нужно обновить (обязательный параметр).
     :param users_tgteg: Идентификатор пользователя, владельца задачи (обязательный параметр).
     :param updates: Словарь обновляемых значений (например, {"prpgress": "Completed"}).
+    :return: Число обновлённых задач.
+    :raises ValueError: Если колонка не входит в TASK_UPDATE_COLUMNS.
+    """
+    update_statement(tuple(updates))  # Проверяет колонки до обращения к хранилищу
+    updated = await pool.update_task(name, users_tgteg, updates)
+    if updated:
+        # Задачи не нашлось — кэш и подписчики остаются как есть
+        notify_task_change("update", users_tgteg, name, updates)
+    return updated
+
+
+async def update_tasks(pool, names: List[str], users_tgteg: str, updates: Dict) -> int:
+    """
+    Обновляет несколько задач пользователя одним запросом UPDATE ... WHERE name IN (...).
+
+    :param pool: Хранилище (storage.Storage).
+    :param names: Названия задач.
+    :param users_tgteg: Идентификатор пользователя, владельца задач.
+    :param updates: Словарь обновляемых значений, одинаковых для всех задач.
+    :return: Число обновлённых задач.
+    :raises ValueError: Если колонка не входит в TASK_UPDATE_COLUMNS.
     """
-    async with pool.acquire() as conn:  # Получаем соединение из пула
-        async with conn.cursor() as cur:  # Создаем курсор
-            # Формируем часть SQL-запроса SET, где обновляем только указанные поля
-            set_clause = ", ".join(f"{key} = %s" for key in updates.keys())
-            query = f"""
-                UPDATE task
-                SET {set_clause}
-                WHERE name = %s AND users_tgteg = %s
-            """
-            params = list(updates.values()) + [name, users_tgteg]  # Параметры для SQL-запроса
-            await cur.execute(query, params)  # Выполняем запрос
-            await conn.commit()  # Сохраняем изменения
+    update_statement(tuple(updates))  # Проверяет колонки и для пустого списка названий
+    names = list(dict.fromkeys(names))  # Без повторов, порядок сохраняется
+    if not names:
+        return 0
+    updated = await pool.update_tasks(names, users_tgteg, updates)
+    if updated:
+        for name in names:
+            notify_task_change("update", users_tgteg, name, updates)
+    return updated
 
 
-async def delete_task(pool, name: str, users_tgteg: str):
+async def move_overdue_tasks(pool, users_tgteg: str, date_end: str, time_end: Optional[str], now) -> int:
+    """
+    Переносит срок всех просроченных незавершённых задач пользователя одним запросом UPDATE.
+    Условие просрочки проверяется в самом запросе, поэтому задачи с тем же названием, но не просроченные,
+    завершённые или повторяющиеся, не затрагиваются.
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :param date_end: Новая дата 'YYYY-MM-DD'.
+    :param time_end: (опционально) Новое время 'HH:MM:SS'; если не указано, время задач не меняется.
+    :param now: Текущий момент (datetime): задачи со сроком раньше него считаются просроченными.
+    :return: Число перенесённых задач.
+    """
+    updates = {"date_end": date_end}
+    if time_end is not None:
+        updates["time_end"] = time_end
+    moved = await pool.move_overdue_tasks(users_tgteg, updates, now)
+    if moved:
+        # Какие именно задачи перенесены, запрос не возвращает: подписчики перечитывают задачи пользователя
+        notify_task_change("update", users_tgteg, None, updates)
+    return moved
+
+
+async def delete_task(pool, name: str, users_tgteg: str) -> int:
     """
     Удаляет задачу из таблицы task.
 
-    :param pool: Пул соединений с базой данных.
+    :param pool: Хранилище (storage.Storage).
     :param name: Название задачи, которую нужно удалить.
     :param users_tgteg: Идентификатор пользователя, владельца задачи.
+    :return: Число удалённых задач.
+    """
+    deleted = await pool.delete_task(name, users_tgteg)
+    if deleted:
+        notify_task_change("delete", users_tgteg, name)
+    return deleted
+
+
+async def archive_tasks(pool, statuses: Sequence[str], before, after_id: int = 0,
+                        limit: int = 500) -> Tuple[int, Optional[int]]:
+    """
+    Переносит одну пачку задач из task в task_archive одной короткой транзакцией.
+    В пачку попадают до limit задач с id больше after_id (keyset по индексу (prpgress, id)),
+    прогрессом из statuses и последним изменением (updated_at) раньше before.
+
+    :param pool: Хранилище (storage.Storage).
+    :param statuses: Значения prpgress завершённых задач.
+    :param before: Момент (datetime): задачи, изменённые позже, остаются в task.
+    :param after_id: id последней задачи предыдущей пачки.
+    :param limit: Размер пачки.
+    :return: (число перенесённых задач, after_id для следующей пачки или None, если задач больше нет).
+    """
+    rows = await pool.archive_tasks(statuses, before, after_id, limit)
+    for (users_tgteg, name, progress), count in Counter(row[1:] for row in rows).items():
+        notify_task_change("archive", users_tgteg, name, {"prpgress": progress, "count": count})
+    return len(rows), (rows[-1][0] if len(rows) == limit else None)
+
+
+async def read_archived_tasks(pool, users_tgteg: str, before_id: Optional[int] = None,
+                              limit: Optional[int] = None, after_id: Optional[int] = None) -> List[TaskRow]:
     """
-    async with pool.acquire() as conn:  # Получаем соединение из пула
-        async with conn.cursor() as cur:  # Создаем курсор
-            # Выполняем SQL-запрос на удаление задачи
-            await cur.execute("""
-                DELETE FROM task 
-                WHERE name = %s AND users_tgteg = %s
-            """, (name, users_tgteg))
-            await conn.commit()  # Сохраняем изменения
-            
+    Считывает архивные задачи пользователя из task_archive, от новых к старым (по убыванию id).
+
+    :param pool: Хранилище (storage.Storage).
+    :param users_tgteg: Идентификатор пользователя.
+    :param before_id: (опционально) Вернуть задачи с id меньше указанного (следующая страница).
+    :param limit: (опционально) Максимальное число задач.
+    :param after_id: (опционально) Вернуть limit ближайших задач с id больше указанного (предыдущая страница).
+    :return: Список задач (TaskRow), как у read_tasks.
+    """
+    return await pool.select_archived_tasks(users_tgteg, before_id, limit, after_id)
+
 
 # Функция для создания пользователя
 async def create_user(pool, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None):
     """
     Добавляет нового пользователя в таблицу users.
 
-    :param pool: Пул соединений с базой данных.
+    :param pool: Хранилище (storage.Storage).
     :param tgteg: Уникальный идентификатор пользователя (обязательный параметр).
     :param name: Имя пользователя (опционально).
     :param userscol: Дополнительное описание или параметры пользователя (опционально).
     """
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
-                INSERT INTO users (tgteg, name, userscol) 
-                VALUES (%s, %s, %s)
-            """, (tgteg, name, userscol))
-            await conn.commit()
+    await pool.create_user(tgteg, name, userscol)
+
+# Функция для создания пользователя, если его ещё нет
+async def upsert_user(pool, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> bool:
+    """
+    Добавляет пользователя в таблицу users, если его там ещё нет. Выполняется одним запросом.
+
+    Опирается на уникальный ключ по tgteg: для существующего пользователя вставка превращается
+    в обновление userscol (если он передан), поэтому одновременные вызовы не создают дубликатов.
+
+    :param pool: Хранилище (storage.Storage).
+    :param tgteg: Уникальный идентификатор пользователя (обязательный параметр).
+    :param name: Имя пользователя (опционально).
+    :param userscol: Дополнительные параметры пользователя (опционально). Бот хранит здесь id чата.
+    :return: True, если пользователь был создан, False — если уже существовал.
+    """
+    created = await pool.upsert_user(tgteg, name, userscol)
+    known_users.set(tgteg, userscol or True)
+    return created
+
+# Функция для получения id чата пользователя
+async def read_user_chat(pool, tgteg: str) -> Optional[int]:
+    """
+    Возвращает id чата пользователя, сохранённый в users.userscol при /start.
+
+    :param pool: Хранилище (storage.Storage).
+    :param tgteg: Уникальный идентификатор пользователя.
+    :return: id чата или None, если он неизвестен.
+    """
+    return await pool.read_user_chat(tgteg)
 
 # Функция для чтения пользователей
-async def read_users(pool, tgteg: Optional[str] = None) -> List[Dict]:
+async def read_users(pool, tgteg: Optional[str] = None, limit: Optional[int] = None,
+                     after: Optional[str] = None) -> List[UserRow]:
     """
-    Извлекает список пользователей. Может фильтровать по tgteg.
+    Извлекает список пользователей по возрастанию tgteg. Может фильтровать по tgteg
+    и читать пользователей пачками (keyset-пагинация по первичному ключу).
 
-    :param pool: Пул соединений с базой данных.
+    :param pool: Хранилище (storage.Storage).
     :param tgteg: (опционально) Уникальный идентификатор пользователя для фильтрации.
-    :return: Список пользователей в виде словарей.
-    """
-    async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            query = "SELECT * FROM users"  # Базовый SQL-запрос
-            params = []
-            if tgteg:
-                query += " WHERE tgteg = %s"  # Условие фильтрации
-                params.append(tgteg)
-            await cur.execute(query, params)
-            return await cur.fetchall()
+    :param limit: (опционально) Не больше limit пользователей (LIMIT в запросе).
+    :param after: (опционально) Вернуть пользователей с tgteg больше указанного (следующая пачка).
+    :return: Список пользователей (UserRow с tgteg, name и userscol).
+    """
+    return await pool.read_users(tgteg, limit, after)
 
 # Функция для удаления пользователя
 async def delete_user(pool, tgteg: str):
     """
-    Удаляет пользователя из таблицы users.
+    Удаляет пользователя из таблицы users вместе с его задачами.
 
-    :param pool: Пул соединений с базой данных.
+    :param pool: Хранилище (storage.Storage).
     :param tgteg: Уникальный идентификатор пользователя, которого нужно удалить.
     """
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
-                DELETE FROM users 
-                WHERE tgteg = %s
-            """, (tgteg,))
-            await conn.commit()
+    await pool.delete_user(tgteg)
+    known_users.pop(tgteg)
+    notify_task_change("delete", tgteg, None)
 
 async def connect_to_db():
     """
     Создает пул соединений для работы с базой данных.
 
+    Размер пула настраивается через DB_POOL_MINSIZE и DB_POOL_MAXSIZE в config.
+    Пул создаётся один раз при старте бота; storage.open_storage оборачивает его в SQLStorage,
+    которое передаётся в обработчики.
+
     :return: Пул соединений aiomysql.
     """
-    return await aiomysql.create_pool(**DB_SETTINGS)  # Создаем и возвращаем пул соединений
-
-
+    minsize = getattr(config, "DB_POOL_MINSIZE", 2)
+    maxsize = getattr(config, "DB_POOL_MAXSIZE", 10)
+    return await create_pool(DB_SETTINGS, minsize=minsize, maxsize=maxsize)  # Создаем и возвращаем пул соединений
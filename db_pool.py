@@ -0,0 +1,96 @@
+import time
+from typing import Dict
+
+import aiomysql
+
+
+class TimedPool:
+    """
+    Обёртка над пулом aiomysql, которая считает время ожидания свободного соединения.
+
+    Все остальные атрибуты (size, freesize, close, wait_closed и т.д.) проксируются в исходный пул,
+    поэтому обёртку можно передавать в функции crud вместо обычного пула.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.acquire_count = 0  # Сколько раз брали соединение
+        self.wait_total = 0.0  # Суммарное время ожидания соединения, сек
+        self.wait_max = 0.0  # Максимальное время ожидания соединения, сек
+        self.on_wait = None  # (опционально) Функция, получающая время каждого ожидания (см. metrics.py)
+
+    def acquire(self):
+        """Возвращает контекстный менеджер, выдающий соединение из пула."""
+        return _TimedAcquire(self)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def _record_wait(self, waited: float):
+        self.acquire_count += 1
+        self.wait_total += waited
+        if waited > self.wait_max:
+            self.wait_max = waited
+        if self.on_wait is not None:
+            self.on_wait(waited)
+
+    def stats(self) -> Dict:
+        """
+        Возвращает текущее состояние пула.
+
+        :return: Словарь с размером пула, числом свободных и занятых соединений и временем ожидания.
+        """
+        size = self._pool.size
+        free = self._pool.freesize
+        return {
+            "size": size,
+            "free": free,
+            "used": size - free,
+            "minsize": self._pool.minsize,
+            "maxsize": self._pool.maxsize,
+            "acquire_count": self.acquire_count,
+            "wait_avg_ms": (self.wait_total / self.acquire_count * 1000) if self.acquire_count else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+class _TimedAcquire:
+    __slots__ = ("_owner", "_conn")
+
+    def __init__(self, owner: TimedPool):
+        self._owner = owner
+        self._conn = None
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        self._conn = await self._owner._pool.acquire()
+        self._owner._record_wait(time.perf_counter() - started)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._owner._pool.release(self._conn)
+        finally:
+            self._conn = None
+
+
+async def create_pool(settings: Dict, minsize: int = 1, maxsize: int = 10) -> TimedPool:
+    """
+    Создаёт пул соединений и сразу открывает minsize соединений (прогрев).
+
+    :param settings: Параметры подключения к MySQL (host, user, password, db, ...).
+    :param minsize: Минимальное число соединений, открываемых при старте.
+    :param maxsize: Максимальное число соединений в пуле.
+    :return: Пул соединений с учётом времени ожидания.
+    """
+    params = dict(settings)
+    params.setdefault("minsize", minsize)
+    params.setdefault("maxsize", maxsize)
+    pool = await aiomysql.create_pool(**params)
+    return TimedPool(pool)
+
+
+async def close_pool(pool):
+    """Закрывает пул и дожидается закрытия всех соединений."""
+    pool.close()
+    await pool.wait_closed()
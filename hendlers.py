@@ -1,108 +1,281 @@
-from aiogram import Router
+import asyncio
+import config
+import os
+import shutil
+import tempfile
+from aiogram import Bot, Router
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, FSInputFile, InputFile
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from crud import *
-from datetime import datetime
-from typing import Optional, List, Dict
+from task_stats import UserStats, format_stats
+from task_search import UserIndex
+from send_queue import TELEGRAM_MESSAGE_LIMIT, split_text
+from recurrence import describe_rule, next_occurrence, parse_repeat, parse_rule
+from reminders import deadline_of
+from task_format import (IncompleteImport, parse_date, parse_progress, parse_task_fields, parse_task_name, parse_time,
+                         import_tasks, export_tasks)
+from datetime import date, datetime
+from typing import Awaitable, Callable, Optional, List, Tuple, Type
 
 router = Router()
 
-async def update_task_field(pool, task_name: str, user_tgteg: str, field_name: str, new_value: str) -> str:
-    """
-    Обновляет указанное поле задачи по пользовательскому названию поля.
+
+
+class TaskPage(CallbackData, prefix="tasks"):
+    """Данные кнопок листания списка задач."""
+    direction: str  # "next" — задачи после cursor, "prev" — задачи до cursor
+    cursor: int  # id задачи, от которой листаем
+
+
+class ArchivePage(CallbackData, prefix="archive"):
+    """Данные кнопок листания архива (задачи показываются по убыванию id)."""
+    direction: str  # "next" — более старые задачи (id меньше cursor), "prev" — более новые
+    cursor: int
+
+# Сопоставление пользовательских названий полей с колонками базы данных
+FIELD_MAPPING = {
+    "задача": "name",
+    "название": "name",
+    "время": "time_end",
+    "дата": "date_end",
+    "прогресс": "prpgress",
+    "повтор": "schedulecol"
+}
+
+
+def parse_field_value(field_name: str, new_value: str) -> Tuple[str, Optional[str]]:
     """
-    # Сопоставление пользовательских названий полей с колонками базы данных
-    field_mapping = {
-        "задача":"name",
-        "название": "name",
-        "время": "time_end",
-        "дата": "date_end",
-        "прогресс": "prpgress"
-    }
+    Преобразует пользовательское название поля и значение в колонку и значение для базы.
 
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
     # Приведение названия поля к нижнему регистру и проверка его допустимости
-    field = field_mapping.get(field_name.lower())  # Приводим к нижнему регистру
+    field = FIELD_MAPPING.get(field_name.lower())
     if not field:
-        return f"Ошибка: Поле '{field_name}' не поддерживается для обновления."
+        raise ValueError(f"Ошибка: Поле '{field_name}' не поддерживается для обновления.")
 
     # Преобразование значения для даты или времени
     if field == "date_end":
         try:
-            date_obj = datetime.strptime(new_value, "%d.%m.%y")
-            new_value = date_obj.strftime("%Y-%m-%d")  # Формат YYYY-MM-DD
+            new_value = parse_date(new_value)  # Формат YYYY-MM-DD
         except ValueError:
-            return "Ошибка: Неверный формат даты. Ожидается 'ДД.ММ.ГГ'."
+            raise ValueError("Ошибка: Неверный формат даты. Ожидается 'ДД.ММ.ГГ'.") from None
     elif field == "time_end":
         try:
-            time_obj = datetime.strptime(new_value, "%H:%M")
-            new_value = time_obj.strftime("%H:%M:%S")  # Формат HH:MM:SS
+            new_value = parse_time(new_value)  # Формат HH:MM:SS
         except ValueError:
-            return "Ошибка: Неверный формат времени. Ожидается 'ЧЧ:ММ'."
+            raise ValueError("Ошибка: Неверный формат времени. Ожидается 'ЧЧ:ММ'.") from None
+    elif field == "schedulecol":
+        new_value = parse_repeat(new_value)  # Правило повтора или None ('нет')
+    elif field == "prpgress":
+        new_value = parse_progress(new_value)  # Одно из PROGRESS_VALUES, как при импорте
+    elif field == "name":
+        new_value = parse_task_name(new_value)
+    return field, new_value
 
-    # Выполнение обновления в базе данных
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            try:
-                # Обновляем указанное поле
-                query = f"UPDATE task SET {field} = %s WHERE name = %s AND users_tgteg = %s"
-                await cur.execute(query, (new_value, task_name, user_tgteg))
-                await conn.commit()
-                
-                # Проверяем, была ли обновлена хотя бы одна запись
-                if cur.rowcount == 0:
-                    return f"Ошибка: Задача '{task_name}' не найдена для пользователя '{user_tgteg}'."
-                return f"Поле '{field_name}' успешно обновлено для задачи '{task_name}'. Новое значение: {new_value}."
-            except Exception as e:
-                return f"Ошибка: Не удалось обновить задачу: {str(e)}"
 
+async def resolve_task_names(task_search, task_names: List[str], user_tgteg: str) -> Tuple[List[str], str]:
+    """
+    Исправляет опечатки в названиях задач по поисковому индексу (см. task_search.py).
+
+    :return: (исправленные названия, текст ошибки). Если какое-то название не удалось определить
+             однозначно, текст ошибки содержит похожие названия, иначе он пустой.
+    """
+    resolved = []
+    for task_name in task_names:
+        name, suggestions = await task_search.resolve(user_tgteg, task_name)
+        if name is None:
+            error = f"Ошибка: Задача '{task_name}' не найдена для пользователя '{user_tgteg}'."
+            if suggestions:
+                error += " Возможно, вы имели в виду: " + ", ".join(f"'{item}'" for item in suggestions)
+            return [], error
+        resolved.append(name)
+    return resolved, ""
 
 
+async def update_task_field(pool, task_name: str, user_tgteg: str, field_name: str, new_value: str,
+                            task_search=None) -> str:
+    """
+    Обновляет указанное поле задачи по пользовательскому названию поля.
+    Если передан task_search, название задачи можно ввести с опечаткой или в другом регистре.
+    """
+    try:
+        field, new_value = parse_field_value(field_name, new_value)
+    except ValueError as e:
+        return str(e)
+
+    if task_search is not None:
+        resolved, error = await resolve_task_names(task_search, [task_name], user_tgteg)
+        if error:
+            return error
+        task_name = resolved[0]
+
+    # Выполнение обновления в хранилище
+    try:
+        # Обновляем указанное поле
+        updated = await update_task(pool, task_name, user_tgteg, {field: new_value})
+    except Exception as e:
+        return f"Ошибка: Не удалось обновить задачу: {str(e)}"
+
+    # Проверяем, была ли обновлена хотя бы одна запись
+    if updated == 0:
+        return f"Ошибка: Задача '{task_name}' не найдена для пользователя '{user_tgteg}'."
+    return f"Поле '{field_name}' успешно обновлено для задачи '{task_name}'. Новое значение: {new_value}."
+
+
+async def update_task_fields(pool, task_names: List[str], user_tgteg: str,
+                             assignments: List[Tuple[str, str]], task_search=None) -> str:
+    """
+    Обновляет несколько полей одной или нескольких задач одним запросом UPDATE.
+
+    :param task_names: Названия задач.
+    :param assignments: Пары (пользовательское название поля, новое значение).
+    :param task_search: (опционально) Поисковый индекс для исправления опечаток в названиях.
+    """
+    updates = {}
+    try:
+        for field_name, new_value in assignments:
+            field, value = parse_field_value(field_name, new_value)
+            updates[field] = value
+    except ValueError as e:
+        return str(e)
+    if not updates:
+        return "Ошибка: Не указаны поля для обновления."
+    if "name" in updates and len(task_names) > 1:
+        return "Ошибка: Название можно изменить только у одной задачи."
+    corrected = []
+    if task_search is not None:
+        resolved, error = await resolve_task_names(task_search, task_names, user_tgteg)
+        if error:
+            return error
+        corrected = [(old, new) for old, new in zip(task_names, resolved) if old != new]
+        task_names = resolved
+
+    try:
+        if len(task_names) == 1:
+            updated = await update_task(pool, task_names[0], user_tgteg, updates)
+        else:
+            updated = await update_tasks(pool, task_names, user_tgteg, updates)
+    except Exception as e:
+        return f"Ошибка: Не удалось обновить задачу: {str(e)}"
+
+    if updated == 0:
+        return f"Ошибка: Задачи {', '.join(task_names)} не найдены для пользователя '{user_tgteg}'."
+    result = f"Обновлено задач: {updated}. Поля: {', '.join(name for name, _ in assignments)}."
+    if corrected:
+        result += " Названия исправлены: " + ", ".join(f"'{old}' -> '{new}'" for old, new in corrected) + "."
+    return result
+
 
 async def parse_and_add_task(pool, command: str, user_tgteg: str) -> str:
     """
-    Парсит команду и добавляет задачу.
+    Парсит команду и добавляет задачи: по одной на строку в формате 'Название, Время, Дата[, Повтор]'.
+    Все правильные задачи записываются одним запросом, по остальным возвращается список ошибок.
     """
     try:
-        # Удаляем "/add_task" и разбиваем строку на части
-        if not command.startswith("/add_task "):
+        # Удаляем "/add_task" и разбиваем текст на строки
+        if not command.startswith("/add_task"):
             return "Ошибка: Команда должна начинаться с '/add_task'."
-        
-        # Извлекаем параметры задачи
-        parts = command[len("/add_task "):].split(",")
-        if len(parts) < 3:
+        lines = [(number, line) for number, line in enumerate(command[len("/add_task"):].split("\n"), start=1)
+                 if line.strip()]
+        if not lines:
             return "Ошибка: Недостаточно параметров. Ожидается: 'Название, Время, Дата'."
-        
-        # Чистим пробелы вокруг параметров
-        task_name = parts[0].strip()
-        time_raw = parts[1].strip()
-        date_raw = parts[2].strip()
+        if len(lines) == 1:
+            return await _add_single_task(pool, lines[0][1], user_tgteg)
 
-        # Преобразуем дату и время в нужный формат
-        try:
-            date_obj = datetime.strptime(date_raw, "%d.%m.%y")  # Парсим дату
-            time_obj = datetime.strptime(time_raw, "%H:%M")  # Парсим время
+        # Проверяем каждую строку и преобразуем дату и время в формат базы (YYYY-MM-DD и HH:MM:SS)
+        rows = []
+        errors = []
+        for number, line in lines:
+            if len(line.split(",")) < 3:
+                errors.append(f"Строка {number}: ожидается 'Название, Время, Дата'.")
+                continue
+            try:
+                task_name, date_end, time_end, schedulecol = parse_task_line(line)
+            except ValueError as e:
+                errors.append(f"Строка {number}: {e}")
+                continue
+            rows.append((task_name, user_tgteg, date_end, time_end, "Pending", schedulecol))
+
+        if rows:
+            await ensure_user_exists(pool, user_tgteg)
+            await create_tasks(pool, rows)  # Один многострочный INSERT и одна транзакция
+        result = f"Добавлено задач: {len(rows)} из {len(lines)}."
+        if errors:
+            result += "\n" + "\n".join(errors[:20])
+            if len(errors) > 20:
+                result += f"\n... и ещё {len(errors) - 20}"
+        return result[:TELEGRAM_MESSAGE_LIMIT]
 
-            # Преобразуем их в строковый формат ISO 8601
-            date_end = date_obj.strftime("%Y-%m-%d")  # Формат YYYY-MM-DD
-            time_end = time_obj.strftime("%H:%M:%S")  # Формат HH:MM:SS
-        except ValueError:
-            return "Ошибка: Неверный формат даты или времени. Ожидается 'ДД.ММ.ГГ' и 'ЧЧ:ММ'."
-
-        # Вызываем функцию создания задачи
-        await create_task_with_check(
-            pool=pool,
-            task_name=task_name,
-            user_tgteg=user_tgteg,
-            date_end=date_end,
-            time_end=time_end,
-            progress="Pending"
-        )
-        return f"Задача '{task_name}' успешно добавлена для пользователя '{user_tgteg}' с датой {date_end} и временем {time_end}."
-    
     except Exception as e:
         return f"Ошибка: Не удалось создать задачу: {str(e)}"
 
 
+def parse_task_line(line: str) -> Tuple[str, str, str, Optional[str]]:
+    """
+    Разбирает строку 'Название, Время, Дата[, Повтор]'.
+    Повтор — например 'ежедневно' или 'пн,чт' (см. recurrence.parse_repeat).
+
+    :return: Кортеж (название, дата, время, правило повтора или None).
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
+    parts = line.split(",")
+    # Проверяем параметры и преобразуем дату и время в формат базы (YYYY-MM-DD и HH:MM:SS)
+    task_name, date_end, time_end = parse_task_fields(parts[0], parts[1], parts[2])
+    schedulecol = parse_repeat(",".join(parts[3:])) if len(parts) > 3 else None
+    return task_name, date_end, time_end, schedulecol
+
+
+async def _add_single_task(pool, line: str, user_tgteg: str) -> str:
+    """
+    Добавляет одну задачу из строки 'Название, Время, Дата[, Повтор]' (команда /add_task с одной задачей).
+    """
+    # Извлекаем параметры задачи
+    if len(line.split(",")) < 3:
+        return "Ошибка: Недостаточно параметров. Ожидается: 'Название, Время, Дата'."
+
+    try:
+        task_name, date_end, time_end, schedulecol = parse_task_line(line)
+    except ValueError as e:
+        return str(e)
+
+    # Вызываем функцию создания задачи
+    await create_task_with_check(
+        pool=pool,
+        task_name=task_name,
+        user_tgteg=user_tgteg,
+        date_end=date_end,
+        time_end=time_end,
+        progress="Pending",
+        schedulecol=schedulecol,
+    )
+    result = f"Задача '{task_name}' успешно добавлена для пользователя '{user_tgteg}' с датой {date_end} и временем {time_end}."
+    if schedulecol:
+        result += f" Повтор: {describe_rule(parse_rule(schedulecol))}."
+    return result
+
+
+def format_task(task: TaskRow) -> str:
+    """
+    Форматирует одну задачу для вывода пользователю.
+    Для повторяющейся задачи показывает правило и ближайшее повторение.
+    """
+    text = f"Задача: {task.name}, Дата: {task.date_end}, Время: {task.time_end}, Прогресс: {task.prpgress}"
+    if task.schedulecol:
+        try:
+            rule = parse_rule(task.schedulecol)
+        except ValueError:
+            return text
+        text += f", Повтор: {describe_rule(rule)}"
+        anchor = deadline_of(task.date_end, task.time_end)
+        upcoming = next_occurrence(rule, anchor, datetime.now()) if anchor else None
+        if upcoming:
+            text += f", Ближайший срок: {upcoming:%d.%m.%y %H:%M}"
+    return text
+
+
 async def view_tasks(pool, user_tgteg: Optional[str] = None) -> str:
     """
     Возвращает задачи пользователя или всех пользователей.
@@ -112,22 +285,100 @@ async def view_tasks(pool, user_tgteg: Optional[str] = None) -> str:
         return "Задачи не найдены."
     
     # Форматируем задачи для вывода
-    formatted_tasks = "\n".join(
-        f"Задача: {task['name']}, Дата: {task['date_end']}, Время: {task['time_end']}, Прогресс: {task['prpgress']}"
-        for task in tasks
-    )
+    formatted_tasks = "\n".join(format_task(task) for task in tasks)
     return formatted_tasks
 
 
+# Загрузка страницы для render_task_page: (direction, cursor, limit) -> задачи в порядке показа
+PageFetch = Callable[[Optional[str], Optional[int], int], Awaitable[List[TaskRow]]]
+
+
+async def render_task_page(fetch: PageFetch, page_class: Type[CallbackData], empty_text: str,
+                           direction: Optional[str] = None,
+                           cursor: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Собирает одну страницу задач с keyset-пагинацией и клавиатуру для перехода между страницами.
+    Из базы читается только нужная страница; текст не превышает лимит сообщения Telegram.
+
+    :param fetch: Корутина fetch(direction, cursor, limit): до limit задач после cursor ("next")
+                  или до него ("prev", последние limit задач) в порядке показа; без cursor — с начала списка.
+    :param page_class: Данные кнопок листания (CallbackData с полями direction и cursor).
+    :param empty_text: Текст для пустой страницы.
+    :param direction: "next" или "prev" — в какую сторону листаем; None — первая страница.
+    :param cursor: id задачи, от которой листаем.
+    """
+    page_size = getattr(config, "TASKS_PAGE_SIZE", 20)
+    # Читаем на одну задачу больше, чтобы понять, есть ли ещё страница в эту сторону
+    tasks = await fetch(direction, cursor, page_size + 1)
+    if direction == "prev":
+        has_prev = len(tasks) > page_size
+        has_next = True
+        tasks = tasks[-page_size:]
+    else:
+        has_prev = direction == "next"
+        has_next = len(tasks) > page_size
+        tasks = tasks[:page_size]
+    if not tasks:
+        return empty_text, None
+
+    # Собираем текст, пока он помещается в одно сообщение
+    lines = []
+    length = 0
+    for task in tasks:
+        line = format_task(task)
+        if lines and length + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT:
+            has_next = True
+            break
+        lines.append(line[:TELEGRAM_MESSAGE_LIMIT])
+        length += len(line) + 1
+    shown = tasks[:len(lines)]
+
+    builder = InlineKeyboardBuilder()
+    if has_prev:
+        builder.button(text="« Назад", callback_data=page_class(direction="prev", cursor=shown[0].id))
+    if has_next:
+        builder.button(text="Вперёд »", callback_data=page_class(direction="next", cursor=shown[-1].id))
+    keyboard = builder.as_markup() if has_prev or has_next else None
+    return "\n".join(lines), keyboard
+
+
+async def view_tasks_page(pool, user_tgteg: str, direction: Optional[str] = None,
+                          cursor: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Возвращает одну страницу задач пользователя (по возрастанию id) и клавиатуру для перехода между страницами.
+    """
+    async def fetch(direction, cursor, limit):
+        return await read_tasks(pool, user_tgteg, after_id=cursor if direction == "next" else None,
+                                before_id=cursor if direction == "prev" else None, limit=limit)
+
+    return await render_task_page(fetch, TaskPage, "Задачи не найдены.", direction, cursor)
+
+
+async def view_archive_page(pool, user_tgteg: str, direction: Optional[str] = None,
+                            cursor: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Возвращает одну страницу архивных задач пользователя, от недавно созданных к старым.
+    Таблица task_archive читается только здесь, по индексу (users_tgteg, id).
+    """
+    async def fetch(direction, cursor, limit):
+        # Архив показывается по убыванию id: следующая страница — задачи с меньшими id
+        return await read_archived_tasks(pool, user_tgteg, before_id=cursor if direction == "next" else None,
+                                         limit=limit, after_id=cursor if direction == "prev" else None)
+
+    return await render_task_page(fetch, ArchivePage, "Архив пуст.", direction, cursor)
+
+
 async def ensure_user_exists(pool, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> str:
     """
     Проверяет, существует ли пользователь, если нет — создаёт.
+    Уже подтверждённые пользователи берутся из кэша known_users без обращения к базе.
     """
-    # Проверяем, существует ли пользователь
-    existing_users = await read_users(pool, tgteg)
-    if not existing_users:
-        # Если пользователь не найден, создаём его
-        await create_user(pool, tgteg, name, userscol)
+    cached = known_users.get(tgteg)
+    if cached and (userscol is None or cached == userscol):
+        return f"Пользователь {tgteg} уже существует."
+
+    # Создаём пользователя одним запросом; если он уже есть, вставка игнорируется
+    if await upsert_user(pool, tgteg, name, userscol):
         return f"Пользователь {tgteg} создан."
     return f"Пользователь {tgteg} уже существует."
 
@@ -146,55 +397,264 @@ async def create_task_with_check(pool, task_name: str, user_tgteg: str, date_end
     return f"Задача '{task_name}' для пользователя '{user_tgteg}' успешно создана."
 
 
+async def reply(send_queue, message: Message, text: str, **kwargs):
+    """
+    Отвечает в чат сообщения. С очередью отправки (см. send_queue.py) ответ только ставится
+    в очередь, и обработчик не ждёт Telegram. Длинный текст отправляется несколькими сообщениями.
+    """
+    if send_queue is not None:
+        await send_queue.send(message.chat.id, text, **kwargs)
+        return
+    parts = split_text(text)
+    for part in parts[:-1]:
+        await message.answer(part)
+    await message.answer(parts[-1], **kwargs)
+
+
+async def reply_document(send_queue, message: Message, document: InputFile, **kwargs) -> Optional[asyncio.Future]:
+    """
+    Отправляет файл в чат сообщения. С очередью отправки файл только ставится в очередь:
+    возвращается Future отправки, без очереди — None после отправки.
+    """
+    if send_queue is not None:
+        return await send_queue.send_document(message.chat.id, document, **kwargs)
+    await message.answer_document(document, **kwargs)
+    return None
+
+
 @router.message(Command("start"))
-async def start(message: Message):
-    pool = await connect_to_db()
-    result = await ensure_user_exists(pool, message.chat.username)
-    await message.answer(result)
+async def start(message: Message, pool, send_queue=None):
+    # Сохраняем id чата, чтобы бот мог присылать напоминания
+    result = await ensure_user_exists(pool, message.chat.username, userscol=str(message.chat.id))
+    await reply(send_queue, message, result)
 
 
 @router.message(Command("add_task"))
-async def add_task(message: Message):
-    pool = await connect_to_db()
+async def add_task(message: Message, pool, send_queue=None):
     result = await parse_and_add_task(pool, message.text, message.chat.username)
-    await message.answer(result)
+    await reply(send_queue, message, result)
 
 
 @router.message(Command("view_task"))
-async def view_task(message: Message):
-    pool = await connect_to_db()
-    result = await view_tasks(pool, message.chat.username)
-    await message.answer(result)
+async def view_task(message: Message, pool, send_queue=None):
+    text, keyboard = await view_tasks_page(pool, message.chat.username)
+    await reply(send_queue, message, text, reply_markup=keyboard)
+
+
+@router.callback_query(TaskPage.filter())
+async def view_task_page(callback: CallbackQuery, callback_data: TaskPage, pool):
+    """
+    Обработчик кнопок листания списка задач: показывает следующую или предыдущую страницу.
+    """
+    text, keyboard = await view_tasks_page(pool, callback.message.chat.username, callback_data.direction,
+                                           callback_data.cursor)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+@router.message(Command("archive"))
+async def archive_handler(message: Message, pool, send_queue=None):
+    """
+    Обработчик команды /archive: показывает завершённые задачи, перенесённые в архив.
+    """
+    text, keyboard = await view_archive_page(pool, message.chat.username)
+    await reply(send_queue, message, text, reply_markup=keyboard)
+
+
+@router.callback_query(ArchivePage.filter())
+async def view_archive_page_handler(callback: CallbackQuery, callback_data: ArchivePage, pool):
+    """
+    Обработчик кнопок листания архива: показывает следующую или предыдущую страницу.
+    """
+    text, keyboard = await view_archive_page(pool, callback.message.chat.username, callback_data.direction,
+                                             callback_data.cursor)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.message(Command("find"))
+async def find_handler(message: Message, pool, task_search=None, send_queue=None):
+    """
+    Обработчик команды /find: ищет задачи по части названия, с точностью до регистра и опечаток.
+    Пример: /find уроки
+    """
+    query = message.text[len("/find"):].strip()
+    if not query:
+        await reply(send_queue, message, "Ошибка: Укажите текст для поиска. Пример: /find уроки")
+        return
+    if task_search is None:
+        # Индекс не ведётся (например, в бенчмарке) — строим его по задачам пользователя
+        names = [name for name, _ in UserIndex(await read_task_names(pool, message.chat.username)).search(query)]
+    else:
+        names = await task_search.search(message.chat.username, query)
+    if not names:
+        await reply(send_queue, message, f"Задачи по запросу '{query}' не найдены.")
+        return
+    await reply(send_queue, message, "Найденные задачи:\n" + "\n".join(names))
+
 
 @router.message(Command("update_task"))
-async def update_task_handler(message: Message):
+async def update_task_handler(message: Message, pool, task_search=None, send_queue=None):
     """
     Обработчик команды /update_task для изменения задачи.
     Формат команды: /update_task <поле>, <название задачи>, <новое значение>
     Пример: /update_task прогресс, Сделать уроки, Completed
+    Несколько полей и задач сразу: /update_task <название>[, <название>...]; <поле>=<значение>; ...
+    Пример: /update_task Сделать уроки; прогресс=In Progress; дата=25.12.24; время=18:00
     """
-    pool = await connect_to_db()
+    # Извлекаем текст команды
+    command = message.text[len("/update_task "):].strip()
+
+    if ";" in command:
+        # Все поля всех задач обновляются одним запросом
+        names_part, *assignment_parts = command.split(";")
+        task_names = [name.strip() for name in names_part.split(",") if name.strip()]
+        assignments = [tuple(part.strip() for part in item.split("=", 1))
+                       for item in assignment_parts if item.strip()]
+        if not task_names or not assignments or any(len(item) != 2 for item in assignments):
+            await reply(
+                send_queue, message,
+                "Ошибка: Неверный формат команды. Ожидается: <название>; <поле>=<значение>; ...\n"
+                "Пример: /update_task Сделать уроки; прогресс=Completed; дата=25.12.24"
+            )
+            return
+        result = await update_task_fields(pool, task_names, message.chat.username, assignments,
+                                          task_search=task_search)
+        await reply(send_queue, message, result)
+        return
+
+    # Разделяем строку по запятым
+    parts = [part.strip() for part in command.split(",")]
+    if len(parts) < 3:
+        await reply(
+            send_queue, message,
+            "Ошибка: Неверный формат команды. Ожидается: <поле>, <название задачи>, <новое значение>.\n"
+            "Пример: /update_task прогресс, Сделать уроки, Completed"
+        )
+        return
+    
+    # Извлекаем поле, название задачи и новое значение
+    field_name = parts[0]
+    task_name = parts[1]
+    new_value = parts[2]
+
+    # Вызываем функцию обновления задачи
+    result = await update_task_field(pool, task_name, message.chat.username, field_name, new_value,
+                                     task_search=task_search)
+    await reply(send_queue, message, result)
+
+
+@router.message(Command("done"))
+async def done_handler(message: Message, pool, task_search=None, send_queue=None):
+    """
+    Обработчик команды /done: отмечает выполненными несколько задач одним запросом.
+    Пример: /done Сделать уроки, Купить хлеб
+    """
+    task_names = [name.strip() for name in message.text[len("/done"):].split(",") if name.strip()]
+    if not task_names:
+        await reply(send_queue, message,
+                    "Ошибка: Укажите названия задач через запятую. Пример: /done Сделать уроки, Купить хлеб")
+        return
+    result = await update_task_fields(pool, task_names, message.chat.username, [("прогресс", "Completed")],
+                                      task_search=task_search)
+    await reply(send_queue, message, result)
+
+
+@router.message(Command("move_overdue"))
+async def move_overdue_handler(message: Message, pool, send_queue=None):
+    """
+    Обработчик команды /move_overdue: переносит все просроченные незавершённые задачи на новую дату.
+    Пример: /move_overdue 25.12.24, 18:00 (время можно не указывать)
+    """
+    parts = [part.strip() for part in message.text[len("/move_overdue"):].split(",")]
     try:
-        # Извлекаем текст команды
-        command = message.text[len("/update_task "):].strip()
-        
-        # Разделяем строку по запятым
-        parts = [part.strip() for part in command.split(",")]
-        if len(parts) < 3:
-            await message.answer(
-                "Ошибка: Неверный формат команды. Ожидается: <поле>, <название задачи>, <новое значение>.\n"
-                "Пример: /update_task прогресс, Сделать уроки, Completed"
+        date_end = parse_date(parts[0])
+        time_end = parse_time(parts[1]) if len(parts) > 1 and parts[1] else None
+    except ValueError:
+        await reply(send_queue, message, "Ошибка: Ожидается: /move_overdue ДД.ММ.ГГ[, ЧЧ:ММ]")
+        return
+    moved = await move_overdue_tasks(pool, message.chat.username, date_end, time_end, datetime.now())
+    await reply(send_queue, message, f"Перенесено просроченных задач: {moved}.")
+
+
+@router.message(Command("stats"))
+async def stats_handler(message: Message, pool, task_stats=None, send_queue=None):
+    """
+    Обработчик команды /stats: число задач по прогрессу, просроченные и задачи со сроком сегодня.
+    """
+    if task_stats is not None:
+        stats = await task_stats.get(message.chat.username)
+    else:
+        # Счётчики не ведутся (например, в бенчмарке) — считаем по задачам пользователя
+        stats = UserStats(await read_task_states(pool, message.chat.username), date.today()).snapshot(date.today())
+    await reply(send_queue, message, format_stats(stats))
+
+
+@router.message(Command("import_tasks"))
+async def import_tasks_handler(message: Message, bot: Bot, pool, send_queue=None):
+    """
+    Обработчик команды /import_tasks: добавляет задачи из CSV- или JSON-файла.
+    Файл отправляется с подписью /import_tasks или команда отправляется ответом на сообщение с файлом.
+    CSV: name, time, date[, progress[, repeat]] — например: Сделать уроки, 18:00, 25.12.24, Pending, weekly:mon
+    JSON: [{"name": "Сделать уроки", "time": "18:00", "date": "25.12.24", "repeat": "weekly:mon"}, ...]
+    """
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if not document:
+        await reply(send_queue, message, "Ошибка: Прикрепите CSV- или JSON-файл с подписью /import_tasks.")
+        return
+    if document.file_size and document.file_size > getattr(config, "IMPORT_MAX_BYTES", 5 * 1024 * 1024):
+        await reply(send_queue, message, "Ошибка: Файл слишком большой.")
+        return
+    file_name = (document.file_name or "").lower()
+    file_format = "json" if file_name.endswith((".json", ".jsonl")) else "csv"
+
+    await ensure_user_exists(pool, message.chat.username)
+    # Файл скачивается на диск и читается построчно, а не целиком в память
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "import")
+        try:
+            await bot.download(document, destination=path)
+        except Exception as e:
+            await reply(send_queue, message, f"Ошибка: Не удалось скачать файл: {e}")
+            return
+        incomplete = None
+        try:
+            accepted, rejected, errors = await import_tasks(
+                pool, path, message.chat.username, file_format,
+                chunk_size=getattr(config, "IMPORT_CHUNK_SIZE", 500),
             )
+        except IncompleteImport as e:
+            # Прочитанная часть файла уже записана — сообщаем и о ней
+            accepted, rejected, errors, incomplete = e.accepted, e.rejected, e.errors, e
+
+    result = f"Импорт завершён. Добавлено задач: {accepted}. Отклонено строк: {rejected}."
+    if incomplete is not None:
+        result = (f"Импорт прерван: файл прочитан не полностью ({incomplete}). "
+                  f"Добавлено задач: {accepted}. Отклонено строк: {rejected}.")
+    if errors:
+        result += "\n" + "\n".join(errors)
+        if rejected > len(errors):
+            result += f"\n... и ещё {rejected - len(errors)}"
+    await reply(send_queue, message, result)
+
+
+@router.message(Command("export_tasks"))
+async def export_tasks_handler(message: Message, pool, send_queue=None):
+    """
+    Обработчик команды /export_tasks: присылает все задачи пользователя CSV-файлом.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    sending = None
+    try:
+        path = os.path.join(tmp_dir, "tasks.csv")
+        count = await export_tasks(pool, message.chat.username, path)
+        if not count:
+            await reply(send_queue, message, "Задачи не найдены.")
             return
-        
-        # Извлекаем поле, название задачи и новое значение
-        field_name = parts[0]
-        task_name = parts[1]
-        new_value = parts[2]
-
-        # Вызываем функцию обновления задачи
-        result = await update_task_field(pool, task_name, message.chat.username, field_name, new_value)
-        await message.answer(result)
+        sending = await reply_document(send_queue, message, FSInputFile(path, filename="tasks.csv"),
+                                       caption=f"Задач: {count}")
     finally:
-        pool.close()
-        await pool.wait_closed()
+        if sending is None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            # Очередь читает файл при отправке: удаляем его, когда отправка завершится
+            sending.add_done_callback(lambda _: shutil.rmtree(tmp_dir, ignore_errors=True))
@@ -0,0 +1,275 @@
+"""
+Жизненный цикл процесса бота: прогрев перед приёмом обновлений и корректная остановка.
+
+Запуск: хранилище открывается, соединения пула открываются заранее, кэш известных пользователей
+заполняется, и только потом бот начинает принимать обновления. Время от запуска процесса до
+готовности пишется в лог и публикуется в метриках (bot_startup_seconds).
+
+Обновления, пришедшие, пока бот был остановлен, не сбрасываются: Telegram хранит их и отдаёт
+пачками (до 100 за запрос getUpdates) сразу после запуска.
+
+Подтверждение при polling: Telegram считает обновление полученным, как только getUpdates вызван
+с offset больше его id. UpdateOffsetMiddleware отправляет в каждом getUpdates offset первого ещё
+не обработанного обновления (UpdateTracker.offset), а не следующего за последним полученным,
+поэтому принятые в очередь чатов, но не обработанные обновления остаются у Telegram. Обработанные
+обновления после первого необработанного запоминаются и при повторной доставке пропускаются.
+Пока самое старое обновление не обработано, Telegram отдаёт не больше 100 обновлений после него,
+и новые обновления не запрашиваются, пока обработка не продвинется.
+
+Остановка (SIGTERM или SIGINT): приём обновлений прекращается, уже принятые обрабатываются до
+SHUTDOWN_TIMEOUT секунд, необработанные к этому сроку отменяются, буфер записи дописывается в базу.
+Перед выходом обработанные обновления подтверждаются отдельным запросом, а обработанные после
+первого необработанного сохраняются в файл: после перезапуска Telegram пришлёт снова только
+необработанные обновления и эти, а эти будут пропущены.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+from aiogram.types import Update
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд из срока остановки оставить на запись буфера и закрытие пула
+FLUSH_RESERVE = 3.0
+
+_started = time.monotonic()
+startup_seconds: Optional[float] = None  # Время от запуска процесса до готовности, сек
+
+
+def mark_started():
+    """Отмечает момент запуска процесса (по умолчанию — момент импорта модуля)."""
+    global _started
+    _started = time.monotonic()
+
+
+def mark_ready() -> float:
+    """Отмечает готовность к приёму обновлений и пишет в лог время запуска."""
+    global startup_seconds
+    startup_seconds = time.monotonic() - _started
+    logger.info("Бот готов к приёму обновлений через %.3f с после запуска", startup_seconds)
+    return startup_seconds
+
+
+class Deadline:
+    """Срок, отсчитываемый от момента создания."""
+
+    def __init__(self, seconds: float):
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self, reserve: float = 0.0) -> float:
+        """Сколько секунд осталось до срока за вычетом reserve (не меньше нуля)."""
+        return max(self._expires_at - time.monotonic() - reserve, 0.0)
+
+
+async def warm_up(pool, connections: int = 0, users: int = 0) -> Dict:
+    """
+    Прогревает хранилище перед приёмом обновлений.
+
+    :param pool: Хранилище (storage.Storage).
+    :param connections: Сколько соединений пула открыть и проверить (не больше размера пула).
+    :param users: Сколько пользователей загрузить в кэш known_users.
+    :return: Число открытых соединений, загруженных пользователей и время прогрева.
+    """
+    started = time.perf_counter()
+    connections = min(connections, getattr(pool, "maxsize", 0))
+    if connections > 0:
+        # Соединения удерживаются, пока не откроются все, — иначе пул выдавал бы одно и то же
+        opened = 0
+        all_open = asyncio.Event()
+
+        async def ping():
+            nonlocal opened
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+                opened += 1
+                if opened == connections:
+                    all_open.set()
+                await all_open.wait()
+
+        pings = [asyncio.create_task(ping()) for _ in range(connections)]
+        # Если одно соединение не открылось, all_open не наступит: остальные отменяются, ошибка пробрасывается
+        done, pending = await asyncio.wait(pings, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+    loaded = 0
+    if users > 0:
+        # ensure_user_exists не будет обращаться к базе для уже известных пользователей
+        for user in await crud.read_users(pool, limit=users):
+            crud.known_users.set(user["tgteg"], user["userscol"] or True)
+            loaded += 1
+    return {"connections": connections, "users": loaded, "seconds": time.perf_counter() - started}
+
+
+class UpdateTracker:
+    """
+    Отслеживает принятые и обработанные обновления, чтобы подтверждать в Telegram только обработанные
+    (все обновления с id не больше offset() - 1), и пропускает обновления, которые Telegram присылает
+    повторно, потому что они ещё не подтверждены.
+    """
+
+    def __init__(self, state_file: Optional[str] = None):
+        """
+        :param state_file: (опционально) Файл, в котором обработанные, но не подтверждённые обновления
+            сохраняются между перезапусками.
+        """
+        self._unfinished: Set[int] = set()
+        self._done: Set[int] = set()  # Обработанные обновления, которые Telegram ещё может прислать снова
+        self._floor = 0  # Обновления с меньшим id Telegram уже не пришлёт (offset последнего getUpdates)
+        self._progress = asyncio.Event()
+        self.last_update_id: Optional[int] = None
+        self.stalled = False  # В последнем ответе getUpdates были только уже принятые обновления
+        self.stopping = False  # Бот останавливается: getUpdates отправляется без ожидания
+        self.state_file = state_file
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                state = json.load(f)
+            self._floor = int(state["offset"])
+            self._done = {int(update_id) for update_id in state["done"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning("Не удалось прочитать состояние обновлений из %s", self.state_file)
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self._floor, "done": sorted(self._done)}, f)
+        os.replace(tmp, self.state_file)
+
+    def seen(self, update_id: int) -> bool:
+        """Принято ли обновление раньше (в обработке, обработано или уже подтверждено)."""
+        return update_id < self._floor or update_id in self._unfinished or update_id in self._done
+
+    def begin(self, update_id: int) -> bool:
+        """
+        Отмечает приём обновления.
+
+        :return: False, если обновление уже принято раньше (повторная доставка) и обрабатывать его не нужно.
+        """
+        if self.seen(update_id):
+            return False
+        self._unfinished.add(update_id)
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        return True
+
+    def end(self, update_id: int):
+        """Отмечает, что обновление обработано (в том числе с ошибкой в обработчике)."""
+        self._unfinished.discard(update_id)
+        self._done.add(update_id)
+        self._progress.set()
+
+    def confirmed(self, offset: int):
+        """Отмечает, что getUpdates отправлен с offset: обновления с меньшим id Telegram больше не пришлёт."""
+        if offset > self._floor:
+            self._floor = offset
+            self._done = {update_id for update_id in self._done if update_id >= offset}
+
+    async def wait_for_progress(self, timeout: float):
+        """Ждёт, пока обработается какое-нибудь обновление, но не дольше timeout секунд."""
+        self._progress.clear()
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def unfinished(self) -> int:
+        return len(self._unfinished)
+
+    def offset(self) -> Optional[int]:
+        """offset для getUpdates: первое не обработанное обновление или следующее за последним."""
+        if self._unfinished:
+            return min(self._unfinished)
+        if self.last_update_id is not None:
+            return self.last_update_id + 1
+        return self._floor or None
+
+
+class UpdateOffsetMiddleware(BaseRequestMiddleware):
+    """
+    Middleware запросов бота (bot.session.middleware(...)) для режима polling: подставляет в getUpdates
+    offset из UpdateTracker, чтобы Telegram не считал полученными ещё не обработанные обновления.
+    """
+
+    def __init__(self, tracker: UpdateTracker):
+        self.tracker = tracker
+
+    async def __call__(self, make_request, bot: Bot, method):
+        if not isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        tracker = self.tracker
+        if tracker.stalled and tracker.unfinished and not tracker.stopping:
+            # Telegram вернул бы те же необработанные обновления: ждём, пока обработка продвинется
+            await tracker.wait_for_progress(method.timeout or 1)
+        offset = tracker.offset()
+        if offset is not None and (method.offset is None or offset < method.offset):
+            method = method.model_copy(update={"offset": offset})
+        updates = await make_request(bot, method)
+        if method.offset is not None:
+            tracker.confirmed(method.offset)
+        tracker.stalled = bool(updates) and all(tracker.seen(update.update_id) for update in updates)
+        return updates
+
+
+class UpdateTrackingMiddleware(BaseMiddleware):
+    """
+    Внешняя middleware для событий update: отмечает начало и конец обработки обновления.
+    Нужна, когда обновления обрабатываются без ChatQueue (ChatOrderingMiddleware отмечает их сама).
+    """
+
+    def __init__(self, tracker: UpdateTracker):
+        self.tracker = tracker
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Update, data: Dict[str, Any]) -> Any:
+        if not self.tracker.begin(event.update_id):
+            return None  # Повторная доставка уже принятого обновления
+        try:
+            result = await handler(event, data)
+        except asyncio.CancelledError:
+            raise  # Обработка прервана остановкой: обновление останется неподтверждённым
+        except Exception:
+            self.tracker.end(event.update_id)
+            raise
+        self.tracker.end(event.update_id)
+        return result
+
+
+async def confirm_updates(bot: Bot, tracker: UpdateTracker):
+    """
+    Подтверждает в Telegram обработанные обновления (режим polling) и сохраняет обработанные
+    после первого необработанного, чтобы пропустить их, когда Telegram пришлёт их снова.
+    """
+    offset = tracker.offset()
+    if offset is None:
+        return
+    if tracker.unfinished:
+        logger.warning("Не обработано обновлений: %d, они придут снова после перезапуска", tracker.unfinished)
+    tracker.stopping = True
+    try:
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+        tracker.confirmed(offset)
+    except Exception:
+        logger.exception("Не удалось подтвердить обработанные обновления")
+    try:
+        tracker.save_state()
+    except OSError:
+        logger.exception("Не удалось сохранить состояние обновлений в %s", tracker.state_file)
@@ -0,0 +1,309 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from datetime import datetime
+from itertools import count
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from queries import NEXT_AT_COLUMNS, DeadlineRow, TaskGroupRow, TaskRow, TaskStateRow, UserRow, initial_next_at, task_row
+
+
+class MemoryStorage:
+    """
+    Хранилище задач и пользователей в памяти процесса, без базы данных.
+
+    Реализует storage.Storage без SQL: функции crud вызывают те же методы, что и у SQLStorage.
+    Подходит для тестов, CI и небольших установок, где не нужно хранить данные между перезапусками.
+
+    Индексы: задачи по id, отсортированные id всех задач и задач каждого пользователя (для постраничного
+    чтения и архивации), id задач по паре (пользователь, название) — для обновления и удаления,
+    и отсортированные сроки незавершённых задач (deadline, а у повторяющихся — next_at) — для read_deadlines.
+    Архив завершённых задач (task_archive) хранится отдельно, по пользователям.
+    """
+
+    def __init__(self):
+        self._ids = count(1)
+        self._tasks: Dict[int, Dict] = {}
+        self._task_ids: List[int] = []  # id всех задач по возрастанию (для keyset без пользователя и архивации)
+        self._user_tasks: Dict[str, List[int]] = {}  # Пользователь -> id его задач по возрастанию
+        self._by_name: Dict[Tuple[str, str], Set[int]] = {}  # (пользователь, название) -> id задач
+        self._deadlines: List[Tuple[str, int]] = []  # (срок, id) незавершённых неповторяющихся задач по возрастанию
+        self._next_ats: List[Tuple[str, int]] = []  # (next_at, id) незавершённых повторяющихся задач по возрастанию
+        self._users: Dict[str, Dict] = {}
+        self._user_ids: List[str] = []  # tgteg всех пользователей по возрастанию (для keyset по пользователям)
+        self._updated: Dict[int, datetime] = {}  # id задачи -> момент последнего изменения (task.updated_at)
+        self._archive: Dict[str, List[Dict]] = {}  # Пользователь -> архивные задачи по возрастанию id
+        self._archive_ids: Dict[str, List[int]] = {}  # Пользователь -> id его архивных задач по возрастанию
+
+    # --- Задачи ---
+
+    async def insert_tasks(self, rows: Sequence[tuple]):
+        """Добавляет задачи: кортежи (name, users_tgteg, date_end, time_end, prpgress, schedulecol)."""
+        for name, users_tgteg, date_end, time_end, progress, schedulecol in rows:
+            task_id = next(self._ids)
+            self._tasks[task_id] = {
+                "id": task_id, "name": name, "users_tgteg": users_tgteg, "date_end": date_end,
+                "time_end": time_end, "prpgress": progress or "Pending", "schedulecol": schedulecol,
+                "next_at": initial_next_at(progress, schedulecol),
+            }
+            self._task_ids.append(task_id)
+            self._user_tasks.setdefault(users_tgteg, []).append(task_id)
+            self._updated[task_id] = datetime.now()
+            self._by_name.setdefault((users_tgteg, name), set()).add(task_id)
+            self._index_deadline(self._tasks[task_id])
+
+    async def select_tasks(self, users_tgteg: Optional[str] = None, after_id: Optional[int] = None,
+                           before_id: Optional[int] = None, limit: Optional[int] = None) -> List[TaskRow]:
+        """Возвращает задачи, упорядоченные по id, с keyset-пагинацией как в crud.read_tasks."""
+        ids = self._user_tasks.get(users_tgteg, []) if users_tgteg else self._task_ids
+        low = bisect_right(ids, after_id) if after_id is not None else 0
+        high = bisect_left(ids, before_id) if before_id is not None else len(ids)
+        if limit is not None:
+            if before_id is not None:
+                low = max(low, high - limit)
+            else:
+                high = min(high, low + limit)
+        return [task_row(self._tasks[task_id]) for task_id in ids[low:high]]
+
+    async def read_task(self, name: str, users_tgteg: str) -> Optional[TaskRow]:
+        ids = self._by_name.get((users_tgteg, name))
+        return task_row(self._tasks[min(ids)]) if ids else None
+
+    async def read_task_names(self, users_tgteg: str) -> List[str]:
+        return [self._tasks[task_id]["name"] for task_id in self._user_tasks.get(users_tgteg, [])]
+
+    async def read_task_states(self, users_tgteg: str) -> List[TaskStateRow]:
+        tasks = (self._tasks[task_id] for task_id in self._user_tasks.get(users_tgteg, []))
+        return [TaskStateRow(task["name"], task["prpgress"], task["date_end"], task["schedulecol"]) for task in tasks]
+
+    async def read_task_groups(self, users_tgteg: Optional[Sequence[str]] = None) -> List[TaskGroupRow]:
+        """Число задач по группам (пользователь, прогресс, дата срока, правило повтора), как GROUP BY."""
+        if users_tgteg is None:
+            tasks = self._tasks.values()
+        else:
+            tasks = [self._tasks[task_id] for user in users_tgteg for task_id in self._user_tasks.get(user, [])]
+        groups = Counter((task["users_tgteg"], task["prpgress"], task["date_end"], task["schedulecol"])
+                         for task in tasks)
+        return [TaskGroupRow(*key, count) for key, count in groups.items()]
+
+    @staticmethod
+    def _deadline(task: Dict) -> Optional[str]:
+        """Срок задачи строкой 'YYYY-MM-DD HH:MM:SS', как колонка deadline в базе."""
+        from task_format import as_date, as_time  # task_format импортирует crud, а crud — этот модуль
+
+        day = as_date(task["date_end"])
+        if day is None:
+            return None
+        moment = as_time(task["time_end"])
+        return day.isoformat() + " " + (moment.isoformat() if moment else "00:00:00")
+
+    def _deadline_entry(self, task: Dict) -> Tuple[Optional[List[Tuple[str, int]]], Optional[str]]:
+        """Индекс сроков, в котором должна быть задача, и её ключ в нём (None, None — ни в каком)."""
+        if task["prpgress"] == "Completed":
+            return None, None
+        if task["schedulecol"]:
+            return self._next_ats, task["next_at"]
+        return self._deadlines, self._deadline(task)
+
+    def _index_deadline(self, task: Dict):
+        index, key = self._deadline_entry(task)
+        if key is not None:
+            insort(index, (key, task["id"]))
+
+    def _unindex_deadline(self, task: Dict):
+        """Убирает задачу из индекса сроков; вызывается до изменения полей, от которых зависит ключ."""
+        index, key = self._deadline_entry(task)
+        if key is not None:
+            del index[bisect_left(index, (key, task["id"]))]
+
+    def _deadline_row(self, task: Dict) -> DeadlineRow:
+        user = self._users.get(task["users_tgteg"])
+        return DeadlineRow(task["id"], task["name"], task["users_tgteg"], task["date_end"], task["time_end"],
+                           task["schedulecol"], task["next_at"], user["userscol"] if user else None)
+
+    async def read_deadlines(self, start, end) -> List[DeadlineRow]:
+        """
+        Незавершённые неповторяющиеся задачи со сроком в [start, end) и повторяющиеся задачи
+        с ближайшим повторением (next_at) раньше end. Диапазоны ищутся бинарным поиском
+        по индексам сроков, как по индексам deadline и next_at в базе.
+        """
+        low, high = start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+        one_off = self._deadlines[bisect_left(self._deadlines, (low,)):bisect_left(self._deadlines, (high,))]
+        recurring = self._next_ats[:bisect_left(self._next_ats, (high,))]
+        return [self._deadline_row(self._tasks[task_id]) for _, task_id in one_off + recurring]
+
+    async def read_task_deadlines(self, users_tgteg: str, name: str) -> List[DeadlineRow]:
+        tasks = (self._tasks[task_id] for task_id in sorted(self._by_name.get((users_tgteg, name), ())))
+        return [self._deadline_row(task) for task in tasks if task["prpgress"] != "Completed"]
+
+    async def set_next_occurrences(self, rows: Sequence[Tuple[int, Optional[datetime]]]):
+        for task_id, next_at in rows:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                self._unindex_deadline(task)
+                task["next_at"] = next_at.strftime("%Y-%m-%d %H:%M:%S") if next_at else None
+                self._index_deadline(task)
+
+    async def update_task(self, name: str, users_tgteg: str, updates: Dict) -> int:
+        """Обновляет задачи с указанным названием. Возвращает число обновлённых задач."""
+        return await self.update_tasks([name], users_tgteg, updates)
+
+    async def update_tasks(self, names: Sequence[str], users_tgteg: str, updates: Dict) -> int:
+        """Обновляет задачи с указанными названиями. Возвращает число обновлённых задач."""
+        updated = 0
+        for name in names:
+            ids = self._by_name.get((users_tgteg, name), set())
+            for task_id in ids:
+                task = self._tasks[task_id]
+                self._unindex_deadline(task)
+                task.update(updates)
+                if NEXT_AT_COLUMNS & updates.keys():
+                    task["next_at"] = initial_next_at(task["prpgress"], task["schedulecol"])
+                self._index_deadline(task)
+                self._updated[task_id] = datetime.now()
+            if ids and "name" in updates and updates["name"] != name:
+                del self._by_name[(users_tgteg, name)]
+                self._by_name.setdefault((users_tgteg, updates["name"]), set()).update(ids)
+            updated += len(ids)
+        return updated
+
+    async def move_overdue_tasks(self, users_tgteg: str, updates: Dict, now) -> int:
+        """Изменяет поля незавершённых неповторяющихся задач пользователя со сроком раньше now."""
+        limit = now.strftime("%Y-%m-%d %H:%M:%S")
+        moved = 0
+        for task_id in self._user_tasks.get(users_tgteg, []):
+            task = self._tasks[task_id]
+            if task["prpgress"] == "Completed" or task["schedulecol"]:
+                continue
+            deadline = self._deadline(task)
+            if deadline is not None and deadline < limit:
+                self._unindex_deadline(task)
+                task.update(updates)
+                self._index_deadline(task)
+                self._updated[task_id] = datetime.now()
+                moved += 1
+        return moved
+
+    async def delete_task(self, name: str, users_tgteg: str) -> int:
+        """Удаляет задачи с указанным названием. Возвращает число удалённых задач."""
+        ids = self._by_name.pop((users_tgteg, name), set())
+        user_ids = self._user_tasks.get(users_tgteg, [])
+        for task_id in ids:
+            self._unindex_deadline(self._tasks.pop(task_id))
+            del self._updated[task_id]
+            del user_ids[bisect_left(user_ids, task_id)]
+            del self._task_ids[bisect_left(self._task_ids, task_id)]
+        return len(ids)
+
+    async def archive_tasks(self, statuses: Sequence[str], before: datetime, after_id: int, limit: int) -> List[tuple]:
+        """
+        Переносит в архив до limit задач с id больше after_id, прогрессом из statuses
+        и последним изменением раньше before. Просмотр начинается сразу после after_id (бинарный поиск
+        по _task_ids), поэтому каждая пачка просматривает только задачи после предыдущей.
+
+        :return: Кортежи (id, users_tgteg, name, prpgress) перенесённых задач.
+        """
+        moved = []
+        for position in range(bisect_right(self._task_ids, after_id), len(self._task_ids)):
+            if len(moved) == limit:
+                break
+            task_id = self._task_ids[position]
+            task = self._tasks[task_id]
+            if task["prpgress"] in statuses and self._updated[task_id] < before:
+                moved.append((task_id, task["users_tgteg"], task["name"], task["prpgress"]))
+        for task_id, users_tgteg, name, _ in moved:
+            task = self._tasks.pop(task_id)
+            self._unindex_deadline(task)
+            self._updated.pop(task_id)
+            del self._task_ids[bisect_left(self._task_ids, task_id)]
+            user_ids = self._user_tasks[users_tgteg]
+            del user_ids[bisect_left(user_ids, task_id)]
+            ids = self._by_name[(users_tgteg, name)]
+            ids.discard(task_id)
+            if not ids:
+                del self._by_name[(users_tgteg, name)]
+            archive_ids = self._archive_ids.setdefault(users_tgteg, [])
+            position = bisect_left(archive_ids, task_id)
+            archive_ids.insert(position, task_id)
+            self._archive.setdefault(users_tgteg, []).insert(position, task)
+        return moved
+
+    async def select_archived_tasks(self, users_tgteg: str, before_id: Optional[int] = None,
+                                    limit: Optional[int] = None, after_id: Optional[int] = None) -> List[TaskRow]:
+        """
+        Архивные задачи пользователя от новых к старым (по убыванию id), с id меньше before_id
+        или ближайшие limit задач с id больше after_id.
+        """
+        archive = self._archive.get(users_tgteg, [])
+        ids = self._archive_ids.get(users_tgteg, [])
+        low = bisect_right(ids, after_id) if after_id is not None else 0
+        high = bisect_left(ids, before_id) if before_id is not None else len(archive)
+        if limit is not None:
+            if after_id is not None:
+                high = min(high, low + limit)
+            else:
+                low = max(low, high - limit)
+        return [task_row(item) for item in reversed(archive[low:high])]
+
+    # --- Пользователи ---
+
+    def _add_user(self, tgteg: str, name: Optional[str], userscol: Optional[str]):
+        self._users[tgteg] = {"tgteg": tgteg, "name": name, "userscol": userscol}
+        insort(self._user_ids, tgteg)
+
+    async def create_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None):
+        if tgteg in self._users:
+            raise ValueError(f"Пользователь {tgteg} уже существует.")
+        self._add_user(tgteg, name, userscol)
+
+    async def upsert_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> bool:
+        user = self._users.get(tgteg)
+        if user is None:
+            self._add_user(tgteg, name, userscol)
+            return True
+        if userscol is not None:
+            user["userscol"] = userscol
+        return False
+
+    async def read_user_chat(self, tgteg: str) -> Optional[int]:
+        user = self._users.get(tgteg)
+        if not user or not user["userscol"]:
+            return None
+        try:
+            return int(user["userscol"])
+        except ValueError:
+            return None
+
+    async def read_users(self, tgteg: Optional[str] = None, limit: Optional[int] = None,
+                         after: Optional[str] = None) -> List[UserRow]:
+        if tgteg:
+            ids = [tgteg] if tgteg in self._users else []
+        else:
+            low = bisect_right(self._user_ids, after) if after is not None else 0
+            high = len(self._user_ids) if limit is None else min(low + limit, len(self._user_ids))
+            ids = self._user_ids[low:high]
+        users = (self._users[user_id] for user_id in ids)
+        return [UserRow(user["tgteg"], user["name"], user["userscol"]) for user in users]
+
+    async def delete_user(self, tgteg: str):
+        """Удаляет пользователя вместе с его задачами."""
+        if self._users.pop(tgteg, None) is not None:
+            del self._user_ids[bisect_left(self._user_ids, tgteg)]
+        removed = self._user_tasks.pop(tgteg, [])
+        for task_id in removed:
+            task = self._tasks.pop(task_id)
+            self._unindex_deadline(task)
+            self._updated.pop(task_id, None)
+            self._by_name.pop((tgteg, task["name"]), None)
+        if removed:
+            self._task_ids = [task_id for task_id in self._task_ids if task_id in self._tasks]
+
+    # --- Состояние и закрытие ---
+
+    def stats(self) -> Dict:
+        return {"backend": "memory", "users": len(self._users), "tasks": len(self._tasks)}
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
@@ -0,0 +1,205 @@
+"""
+Метрики бота в формате Prometheus: время обработчиков, время и объём запросов crud, состояние пула.
+
+Включаются параметром METRICS_ENABLED в config. Пока метрики выключены, ни обработчики,
+ни функции crud не оборачиваются, поэтому накладных расходов нет.
+"""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware, Router
+from aiohttp import web
+
+# Границы корзин гистограмм времени, сек
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Границы корзин гистограммы числа строк
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 1000)
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами и метками.
+    Наблюдение — это двоичный поиск корзины и пара сложений.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 label: str = "name"):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series: Dict[str, List] = {}  # значение метки -> [счётчики корзин, сумма, количество]
+
+    def observe(self, label_value: str, value: float):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total, count) in sorted(self._series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик: гистограммы и показатели (gauge), значения которых считываются при запросе."""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Any]]] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  label: str = "name") -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help_text, buckets, label)
+        return self.histograms[name]
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Any]):
+        """Регистрирует показатель; read() вызывается при каждом запросе /metrics."""
+        self._gauges[name] = (help_text, read)
+
+    def render(self) -> str:
+        lines = []
+        for name, (help_text, read) in self._gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        for histogram in self.histograms.values():
+            lines += histogram.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+handler_latency = registry.histogram("bot_handler_seconds", "Время работы обработчиков", label="handler")
+query_latency = registry.histogram("bot_query_seconds", "Время выполнения функций crud", label="query")
+query_rows = registry.histogram("bot_query_rows", "Число строк, возвращённых функциями crud",
+                                ROW_BUCKETS, label="query")
+pool_wait = registry.histogram("bot_db_pool_wait_seconds", "Время ожидания соединения из пула", label="pool")
+
+
+# Выполняется ли сейчас замеряемая функция crud: вложенные вызовы (update_tasks внутри
+# другой функции crud) не записываются, иначе время и число вызовов учитывались бы дважды
+_in_query: ContextVar[bool] = ContextVar("in_query", default=False)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Middleware aiogram, измеряющая время каждого обработчика."""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_latency.observe(name, time.perf_counter() - started)
+
+
+def _timed(name: str, func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _in_query.get():
+            return await func(*args, **kwargs)
+        token = _in_query.set(True)
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        finally:
+            query_latency.observe(name, time.perf_counter() - started)
+            _in_query.reset(token)
+        if isinstance(result, dict) or hasattr(result, "_fields"):
+            query_rows.observe(name, 1)  # Одна строка: словарь или TaskRow (именованный кортеж)
+        elif isinstance(result, (list, tuple)):
+            query_rows.observe(name, len(result))
+        return result
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def instrument_crud(crud_module, *importers):
+    """
+    Оборачивает публичные асинхронные функции crud в замер времени и числа строк.
+    Внутренние функции (с именем на "_") не оборачиваются: их время входит в замер вызвавшей функции.
+
+    :param crud_module: Модуль crud.
+    :param importers: Модули, которые импортировали функции crud через from crud import *
+        (в них заменяются те же функции).
+    """
+    for name, func in list(vars(crud_module).items()):
+        if not inspect.iscoroutinefunction(func) or getattr(func, "__module__", None) != crud_module.__name__:
+            continue
+        if name.startswith("_") or getattr(func, "__wrapped_by_metrics__", False) or name == "connect_to_db":
+            continue
+        wrapped = _timed(name, func)
+        setattr(crud_module, name, wrapped)
+        for module in importers:
+            if getattr(module, name, None) is func:
+                setattr(module, name, wrapped)
+
+
+def instrument_router(router: Router):
+    """Подключает замер времени ко всем обработчикам сообщений и нажатий кнопок."""
+    router.message.middleware(HandlerTimingMiddleware())
+    router.callback_query.middleware(HandlerTimingMiddleware())
+
+
+def instrument_pool(pool, name: str = "main"):
+    """Подключает гистограмму ожидания соединения и показатели заполненности пула."""
+    pool.on_wait = lambda waited: pool_wait.observe(name, waited)
+    registry.gauge("bot_db_pool_size", "Открытых соединений в пуле", lambda: pool.size)
+    registry.gauge("bot_db_pool_free", "Свободных соединений в пуле", lambda: pool.freesize)
+    registry.gauge("bot_db_pool_acquired", "Занятых соединений в пуле", lambda: pool.size - pool.freesize)
+
+
+def register_cache(name: str, cache):
+    """Публикует счётчики кэша (попадания, промахи, вытеснения) как показатели."""
+    for key in ("hits", "misses", "evictions"):
+        registry.gauge(f"bot_{name}_cache_{key}", f"Кэш {name}: {key}",
+                       lambda key=key: cache.stats()[key])
+
+
+def register_chat_queue(queue):
+    """Публикует заполненность очереди чатов (см. chat_queue.py)."""
+    registry.gauge("bot_updates_pending", "Принятых и ещё не обработанных обновлений", lambda: queue.pending)
+    registry.gauge("bot_updates_in_flight", "Обновлений в обработке", lambda: queue.in_flight)
+
+
+def register_send_queue(queue):
+    """Публикует состояние очереди исходящих сообщений (см. send_queue.py)."""
+    for key in ("queued", "sent", "retries", "failed"):
+        registry.gauge(f"bot_send_{key}", f"Очередь отправки: {key}", lambda key=key: queue.stats()[key])
+
+
+def register_startup(read_seconds: Callable[[], Optional[float]]):
+    """Публикует время от запуска процесса до готовности к приёму обновлений (см. lifecycle.py)."""
+    registry.gauge("bot_startup_seconds", "Время запуска бота до готовности, сек", lambda: read_seconds() or 0)
+
+
+async def start_metrics_server(host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер с единственным адресом /metrics.
+
+    :return: AppRunner; для остановки сервера вызовите await runner.cleanup().
+    """
+    async def handle(_request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,277 @@
+"""
+Схема базы данных и её версионные миграции.
+
+Применить миграции: python migrations.py
+Каждая миграция выполняется один раз; номер применённой версии хранится в таблице schema_migrations.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from queries import NEXT_AT_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(RuntimeError):
+    """Схема базы не соответствует ожидаемой (например, нет нужных индексов)."""
+
+
+# Индексы, без которых запросы бота превращаются в полный просмотр таблиц:
+# (таблица, колонки индекса по порядку, должен ли индекс быть уникальным)
+EXPECTED_INDEXES: List[Tuple[str, Tuple[str, ...], bool]] = [
+    ("users", ("tgteg",), True),  # ensure_user_exists / upsert_user
+    ("task", ("users_tgteg", "name"), False),  # read_tasks, update_task, delete_task, update_task_field
+    ("task", ("deadline",), False),  # read_deadlines (напоминания)
+    ("task", ("next_at",), False),  # read_deadlines: повторяющиеся задачи (см. recurrence.py)
+    ("task", ("prpgress", "id"), False),  # archive_tasks: завершённые задачи пачками по id (см. archiver.py)
+    ("task_archive", ("users_tgteg", "id"), False),  # read_archived_tasks (/archive)
+]
+
+
+async def _has_column(cur, table: str, column: str) -> bool:
+    await cur.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return await cur.fetchone() is not None
+
+
+async def _has_index(cur, table: str, index: str) -> bool:
+    await cur.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return await cur.fetchone() is not None
+
+
+async def _read_indexes(cur, tables: Sequence[str]) -> Dict[Tuple[str, str], Tuple[List[str], bool]]:
+    """Читает индексы таблиц: (таблица, индекс) -> (колонки по порядку, уникальный ли)."""
+    marks = ", ".join(["%s"] * len(tables))
+    await cur.execute(f"""
+        SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({marks})
+        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+    """, tuple(tables))
+    indexes: Dict[Tuple[str, str], Tuple[List[str], bool]] = {}
+    for table, index, non_unique, column in await cur.fetchall():
+        columns, _ = indexes.setdefault((table, index), ([], not non_unique))
+        columns.append(column)
+    return indexes
+
+
+def _matching_indexes(indexes: Dict[Tuple[str, str], Tuple[List[str], bool]], table: str,
+                      columns: Tuple[str, ...], unique: bool) -> List[str]:
+    """
+    Имена индексов таблицы, которые обслуживают запросы по columns: колонки индекса начинаются с columns.
+    Уникальный индекс должен состоять ровно из columns.
+    """
+    return [
+        index for (index_table, index), (index_columns, is_unique) in indexes.items()
+        if index_table == table
+        and tuple(index_columns[:len(columns)]) == columns
+        and (is_unique or not unique)
+        and (not unique or len(index_columns) == len(columns))
+    ]
+
+
+async def _migration_1_create_tables(cur):
+    # IF NOT EXISTS — чтобы миграция подходила и для баз, где таблицы уже созданы вручную
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            tgteg VARCHAR(64) NOT NULL PRIMARY KEY,
+            name VARCHAR(255) NULL,
+            userscol VARCHAR(255) NULL
+        )
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS task (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            users_tgteg VARCHAR(64) NOT NULL,
+            date_end DATE NULL,
+            time_end TIME NULL,
+            prpgress VARCHAR(45) NULL,
+            schedulecol VARCHAR(255) NULL
+        )
+    """)
+
+
+async def _migration_2_access_path_indexes(cur):
+    # Обычно tgteg уже первичный ключ (миграция 1); индекс нужен только таблицам, созданным без него
+    if not _matching_indexes(await _read_indexes(cur, ("users",)), "users", ("tgteg",), True):
+        await cur.execute("ALTER TABLE users ADD UNIQUE INDEX uq_users_tgteg (tgteg)")
+    if not await _has_index(cur, "task", "idx_task_user_name"):
+        await cur.execute("ALTER TABLE task ADD INDEX idx_task_user_name (users_tgteg, name)")
+
+
+async def _migration_3_deadline(cur):
+    # Срок задачи одной колонкой, чтобы напоминания читали диапазон по индексу
+    if not await _has_column(cur, "task", "deadline"):
+        await cur.execute("""
+            ALTER TABLE task
+            ADD COLUMN deadline DATETIME AS (TIMESTAMP(date_end, COALESCE(time_end, '00:00:00'))) STORED
+        """)
+    if not await _has_index(cur, "task", "idx_task_deadline"):
+        await cur.execute("ALTER TABLE task ADD INDEX idx_task_deadline (deadline)")
+
+
+async def _migration_4_progress(cur):
+    # Колонка prpgress остаётся (на неё опирается весь код), но получает значение по умолчанию,
+    # а под правильным именем progress доступна как вычисляемая колонка
+    await cur.execute("UPDATE task SET prpgress = 'Pending' WHERE prpgress IS NULL")
+    await cur.execute("ALTER TABLE task MODIFY prpgress VARCHAR(45) NOT NULL DEFAULT 'Pending'")
+    if not await _has_column(cur, "task", "progress"):
+        await cur.execute("ALTER TABLE task ADD COLUMN progress VARCHAR(45) AS (prpgress) VIRTUAL")
+
+
+async def _migration_5_schedule_index(cur):
+    # Повторяющиеся задачи (schedulecol IS NOT NULL) читаются при каждой загрузке окна напоминаний
+    if not await _has_index(cur, "task", "idx_task_schedule"):
+        await cur.execute("ALTER TABLE task ADD INDEX idx_task_schedule (schedulecol)")
+
+
+async def _migration_6_archive(cur):
+    # Момент последнего изменения задачи: завершённые задачи переносятся в архив через заданное время после него
+    if not await _has_column(cur, "task", "updated_at"):
+        await cur.execute("""
+            ALTER TABLE task
+            ADD COLUMN updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        """)
+    if not await _has_index(cur, "task", "idx_task_progress"):
+        await cur.execute("ALTER TABLE task ADD INDEX idx_task_progress (prpgress, id)")
+    # id задачи сохраняется, поэтому в архиве он не автоинкрементный
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS task_archive (
+            id INT NOT NULL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            users_tgteg VARCHAR(64) NOT NULL,
+            date_end DATE NULL,
+            time_end TIME NULL,
+            prpgress VARCHAR(45) NOT NULL,
+            schedulecol VARCHAR(255) NULL,
+            updated_at TIMESTAMP NULL,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_archive_user (users_tgteg, id)
+        )
+    """)
+
+
+async def _migration_7_drop_duplicate_user_index(cur):
+    # Раньше миграция 2 добавляла uq_users_tgteg и при первичном ключе по tgteg — лишняя работа на каждую вставку
+    indexes = await _read_indexes(cur, ("users",))
+    unique = _matching_indexes(indexes, "users", ("tgteg",), True)
+    if "uq_users_tgteg" in unique and len(unique) > 1:
+        await cur.execute("ALTER TABLE users DROP INDEX uq_users_tgteg")
+
+
+async def _migration_8_next_occurrence(cur):
+    # Ближайшее повторение повторяющейся задачи: окно напоминаний читает по индексу только задачи,
+    # повторение которых наступает в окне, а не все повторяющиеся задачи (см. reminders.py)
+    if not await _has_column(cur, "task", "next_at"):
+        await cur.execute("ALTER TABLE task ADD COLUMN next_at DATETIME NULL")
+    await cur.execute("""
+        UPDATE task SET next_at = %s
+        WHERE schedulecol IS NOT NULL AND prpgress <> 'Completed' AND next_at IS NULL
+    """, (NEXT_AT_PENDING,))
+    if not await _has_index(cur, "task", "idx_task_next"):
+        await cur.execute("ALTER TABLE task ADD INDEX idx_task_next (next_at)")
+    # Индекс по schedulecol был нужен только прежнему запросу повторяющихся задач
+    if await _has_index(cur, "task", "idx_task_schedule"):
+        await cur.execute("ALTER TABLE task DROP INDEX idx_task_schedule")
+
+
+# Миграции по порядку: (версия, описание, функция)
+MIGRATIONS: List[Tuple[int, str, Callable[..., Awaitable[None]]]] = [
+    (1, "Таблицы users и task", _migration_1_create_tables),
+    (2, "Уникальный tgteg и индекс (users_tgteg, name)", _migration_2_access_path_indexes),
+    (3, "Колонка deadline и индекс по ней", _migration_3_deadline),
+    (4, "Значение по умолчанию для prpgress и колонка progress", _migration_4_progress),
+    (5, "Индекс по правилу повтора schedulecol", _migration_5_schedule_index),
+    (6, "Колонка updated_at, индекс по prpgress и таблица task_archive", _migration_6_archive),
+    (7, "Удаление лишнего уникального индекса по users.tgteg", _migration_7_drop_duplicate_user_index),
+    (8, "Колонка next_at и индекс по ней вместо индекса по schedulecol", _migration_8_next_occurrence),
+]
+
+
+async def current_version(pool) -> int:
+    """
+    Возвращает номер последней применённой миграции (0, если миграций ещё не было).
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT NOT NULL PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            await cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            (version,) = await cur.fetchone()
+            await conn.commit()
+            return version
+
+
+async def migrate(pool) -> int:
+    """
+    Применяет все ещё не применённые миграции по порядку.
+
+    :param pool: Пул соединений с базой данных.
+    :return: Номер версии схемы после применения миграций.
+    """
+    version = await current_version(pool)
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Применяется миграция %s: %s", number, description)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await apply(cur)
+                await cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (number, description),
+                )
+                await conn.commit()
+        version = number
+    return version
+
+
+async def check_schema(pool):
+    """
+    Проверяет, что в базе есть все индексы из EXPECTED_INDEXES.
+
+    :param pool: Пул соединений с базой данных.
+    :raises SchemaError: Если каких-то индексов не хватает.
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            indexes = await _read_indexes(cur, ("users", "task", "task_archive"))
+
+    missing = []
+    for table, columns, unique in EXPECTED_INDEXES:
+        if not _matching_indexes(indexes, table, columns, unique):
+            missing.append(f"{table}({', '.join(columns)}){' UNIQUE' if unique else ''}")
+    if missing:
+        raise SchemaError(
+            "В базе нет индексов: " + "; ".join(missing) + ". Примените миграции: python migrations.py"
+        )
+
+
+async def main():
+    from crud import connect_to_db
+    from db_pool import close_pool
+
+    logging.basicConfig(level=logging.INFO)
+    pool = await connect_to_db()
+    try:
+        version = await migrate(pool)
+        await check_schema(pool)
+        logger.info("Схема базы в актуальном состоянии, версия %s", version)
+    finally:
+        await close_pool(pool)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+"""
+Строки результатов и тексты SQL-запросов для crud.
+
+Чтения выбирают только нужные колонки и возвращают компактные строки — именованные кортежи
+без __dict__ вместо словарей (DictCursor). По замеру benchmark.py --rows (20 000 строк задач)
+строка вместе со значениями занимает примерно на 25% меньше памяти, чем словарь, чтение почти
+не отличается по времени, а доступ к полю по атрибуту (row.name) медленнее, чем dict["name"]
+(около 0.14 против 0.10 мкс). Выигрыш строк — в памяти, а не в скорости доступа. Для совместимости
+строки поддерживают и доступ как у словаря: row["name"], row.get("schedulecol"), dict(row).
+
+Тексты запросов, которые зависят от набора колонок или фильтров, собираются один раз
+для каждого сочетания и дальше берутся из кэша (functools.lru_cache).
+"""
+from collections import namedtuple
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Колонки задачи, которые читаются из базы (вместо SELECT *)
+TASK_FIELDS = ("id", "name", "users_tgteg", "date_end", "time_end", "prpgress", "schedulecol")
+TASK_COLUMNS = ", ".join(TASK_FIELDS)
+
+# Колонки задачи, которые разрешено изменять через update_task и update_tasks.
+# Имена колонок подставляются в текст запроса, поэтому принимаются только из этого списка
+TASK_UPDATE_COLUMNS = frozenset({"name", "date_end", "time_end", "prpgress", "schedulecol"})
+
+# Таблицы, из которых читаются строки задач (см. select_tasks_statement)
+TASK_TABLES = frozenset({"task", "task_archive"})
+
+# Колонки, которые переносятся из task в task_archive
+ARCHIVE_COLUMNS = "id, name, users_tgteg, date_end, time_end, prpgress, schedulecol, updated_at"
+
+# task.next_at — ближайшее неотправленное повторение повторяющейся задачи (см. reminders.py).
+# При создании задачи и изменении её срока, правила или прогресса повторение ещё не вычислено:
+# next_at получает NEXT_AT_PENDING (раньше любого окна напоминаний), и планировщик вычисляет его
+# при загрузке ближайшего окна. У неповторяющихся и завершённых задач next_at — NULL
+NEXT_AT_PENDING = "1970-01-01 00:00:00"
+# Колонки, от которых зависит next_at
+NEXT_AT_COLUMNS = frozenset({"date_end", "time_end", "prpgress", "schedulecol"})
+
+
+class _MappingRow:
+    """Доступ к полям именованного кортежа по имени колонки, как у строки DictCursor."""
+
+    __slots__ = ()
+    _index: Dict[str, int] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {field: i for i, field in enumerate(cls._fields)}
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+
+class TaskRow(_MappingRow, namedtuple("TaskRow", TASK_FIELDS)):
+    """Задача из read_tasks, read_task и read_archived_tasks."""
+
+    __slots__ = ()
+
+
+class TaskStateRow(_MappingRow, namedtuple("TaskStateRow", ("name", "prpgress", "date_end", "schedulecol"))):
+    """Задача для статистики (read_task_states)."""
+
+    __slots__ = ()
+
+
+class DeadlineRow(_MappingRow, namedtuple(
+        "DeadlineRow", ("id", "name", "users_tgteg", "date_end", "time_end", "schedulecol", "next_at", "chat"))):
+    """Срок задачи с id чата владельца (read_deadlines, read_task_deadlines)."""
+
+    __slots__ = ()
+
+
+class TaskGroupRow(_MappingRow, namedtuple(
+        "TaskGroupRow", ("users_tgteg", "prpgress", "date_end", "schedulecol", "tasks"))):
+    """Число задач (tasks) пользователя с одинаковыми прогрессом, датой срока и правилом (read_task_groups)."""
+
+    __slots__ = ()
+
+
+class UserRow(_MappingRow, namedtuple("UserRow", ("tgteg", "name", "userscol"))):
+    """Пользователь (read_users)."""
+
+    __slots__ = ()
+
+
+def make_rows(row_class, rows: Iterable[tuple]) -> List:
+    """Превращает кортежи курсора (колонки в порядке row_class._fields) в строки row_class."""
+    return list(map(row_class._make, rows))
+
+
+# Значения колонок задачи из словаря MemoryStorage в порядке TaskRow._fields
+task_values = itemgetter(*TASK_FIELDS)
+
+
+def task_row(task: Mapping) -> TaskRow:
+    """Строка задачи из словаря MemoryStorage."""
+    return TaskRow._make(task_values(task))
+
+
+@lru_cache(maxsize=None)
+def select_tasks_statement(table: str, by_user: bool, after: bool, before: bool, limited: bool,
+                           descending: bool) -> str:
+    """
+    Текст запроса строк задач с фильтрами по пользователю и keyset-пагинацией по id.
+    Параметры запроса передаются в порядке: users_tgteg, after_id, before_id, limit.
+
+    :param table: "task" или "task_archive".
+    :param by_user: Фильтр users_tgteg = %s.
+    :param after: Фильтр id > %s.
+    :param before: Фильтр id < %s.
+    :param limited: LIMIT %s.
+    :param descending: Строки по убыванию id.
+    """
+    if table not in TASK_TABLES:
+        raise ValueError(f"Недопустимая таблица: {table}")
+    conditions = []
+    if by_user:
+        conditions.append("users_tgteg = %s")
+    if after:
+        conditions.append("id > %s")
+    if before:
+        conditions.append("id < %s")
+    query = f"SELECT {TASK_COLUMNS} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id DESC" if descending else " ORDER BY id"
+    if limited:
+        query += " LIMIT %s"
+    return query
+
+
+def initial_next_at(progress, schedulecol) -> Optional[str]:
+    """Значение next_at новой задачи или задачи после изменения (см. NEXT_AT_PENDING)."""
+    return NEXT_AT_PENDING if schedulecol and progress != "Completed" else None
+
+
+def next_at_expression(updates: Mapping) -> Optional[str]:
+    """
+    SQL-выражение нового next_at для изменения updates или None, если next_at не меняется.
+    Выражение ссылается только на колонки, которых нет в updates: в SQLite правая часть SET
+    видит прежние значения строки, а в MySQL — уже изменённые, и для таких колонок они совпадают.
+    """
+    if not NEXT_AT_COLUMNS & updates.keys():
+        return None
+    if ("schedulecol" in updates and not updates["schedulecol"]) or updates.get("prpgress") == "Completed":
+        return "NULL"
+    conditions = []
+    if "schedulecol" not in updates:
+        conditions.append("schedulecol IS NOT NULL")
+    if "prpgress" not in updates:
+        conditions.append("prpgress <> 'Completed'")
+    if not conditions:
+        return f"'{NEXT_AT_PENDING}'"
+    return f"CASE WHEN {' AND '.join(conditions)} THEN '{NEXT_AT_PENDING}' END"
+
+
+@lru_cache(maxsize=1024)
+def update_statement(columns: Tuple[str, ...], names: int = 0, next_at: Optional[str] = None) -> str:
+    """
+    Текст запроса UPDATE task для набора изменяемых колонок, проверенных по TASK_UPDATE_COLUMNS.
+    Параметры запроса: значения колонок в порядке columns, затем название и пользователь
+    (names=0) или пользователь и names названий (UPDATE ... WHERE name IN (...)).
+
+    :param columns: Изменяемые колонки, в порядке значений.
+    :param names: Сколько названий в списке IN; 0 — одно название, условие name = %s.
+    :param next_at: (опционально) Выражение для колонки next_at (см. next_at_expression).
+    :raises ValueError: Если колонок нет или колонка не входит в TASK_UPDATE_COLUMNS.
+    """
+    if not columns:
+        raise ValueError("Не указаны поля для обновления.")
+    unknown = set(columns) - TASK_UPDATE_COLUMNS
+    if unknown:
+        raise ValueError(f"Недопустимые колонки: {', '.join(sorted(unknown))}")
+    set_clause = ", ".join(f"{column} = %s" for column in columns)
+    if next_at is not None:
+        set_clause += f", next_at = {next_at}"
+    if not names:
+        return f"UPDATE task SET {set_clause} WHERE name = %s AND users_tgteg = %s"
+    placeholders = ", ".join(["%s"] * names)
+    return f"UPDATE task SET {set_clause} WHERE users_tgteg = %s AND name IN ({placeholders})"
+
+
+@lru_cache(maxsize=256)
+def move_overdue_statement(columns: Tuple[str, ...]) -> str:
+    """
+    Текст запроса, изменяющего просроченные незавершённые неповторяющиеся задачи пользователя.
+    Параметры запроса: значения колонок в порядке columns, пользователь, текущий момент.
+
+    :raises ValueError: Если колонок нет или колонка не входит в TASK_UPDATE_COLUMNS.
+    """
+    if not columns:
+        raise ValueError("Не указаны поля для обновления.")
+    unknown = set(columns) - TASK_UPDATE_COLUMNS
+    if unknown:
+        raise ValueError(f"Недопустимые колонки: {', '.join(sorted(unknown))}")
+    set_clause = ", ".join(f"{column} = %s" for column in columns)
+    return (f"UPDATE task SET {set_clause} "
+            "WHERE users_tgteg = %s AND deadline < %s AND prpgress <> 'Completed' AND schedulecol IS NULL")
+
+
+@lru_cache(maxsize=256)
+def task_groups_statement(users: Optional[int]) -> str:
+    """
+    Текст запроса числа задач по группам (пользователь, прогресс, дата срока, правило повтора).
+
+    :param users: Сколько пользователей в списке IN; None — задачи всех пользователей.
+    """
+    query = "SELECT users_tgteg, prpgress, date_end, schedulecol, COUNT(*) FROM task"
+    if users is not None:
+        query += f" WHERE users_tgteg IN ({', '.join(['%s'] * users)})"
+    return query + " GROUP BY users_tgteg, prpgress, date_end, schedulecol"
+
+
+@lru_cache(maxsize=64)
+def archive_select_statement(statuses: int, lock: str = "") -> str:
+    """
+    Текст запроса пачки задач для архивации. Параметры запроса: statuses прогрессов, after_id, before, limit.
+
+    :param statuses: Сколько прогрессов в списке IN.
+    :param lock: Блокировка выбранных строк (" FOR UPDATE") или пустая строка, если её нет в диалекте.
+    """
+    return (f"SELECT id, users_tgteg, name, prpgress FROM task "
+            f"WHERE prpgress IN ({', '.join(['%s'] * statuses)}) AND id > %s AND updated_at < %s "
+            f"ORDER BY id LIMIT %s{lock}")
+
+
+@lru_cache(maxsize=256)
+def archive_move_statements(ids: int) -> Tuple[str, str]:
+    """
+    Тексты запросов, переносящих ids задач из task в task_archive: копирование и удаление.
+    Параметры каждого запроса — id задач.
+    """
+    placeholders = ", ".join(["%s"] * ids)
+    return (f"INSERT INTO task_archive ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM task WHERE id IN ({placeholders})",
+            f"DELETE FROM task WHERE id IN ({placeholders})")
+
@@ -0,0 +1,192 @@
+"""
+Повторяющиеся задачи.
+
+Правило повтора хранится в колонке task.schedulecol короткой строкой:
+
+    <частота>[/<интервал>][:<дни недели>][;until=YYYY-MM-DD]
+
+- daily, daily/2            — каждый день, через день;
+- weekly, weekly:mon,thu    — каждую неделю (в день недели date_end или в указанные дни);
+- weekly/2:fri              — каждую вторую пятницу;
+- monthly                   — каждый месяц в число из date_end (в коротких месяцах — последний день).
+
+Первое повторение — date_end и time_end задачи, время у всех повторений одно и то же.
+Повторения не хранятся в базе (кроме ближайшего неотправленного — task.next_at, см. reminders.py):
+occurrences() вычисляет их на лету в заданном окне, сразу переходя к его началу, поэтому стоимость
+зависит только от числа повторений в окне, а не от возраста задачи.
+"""
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+WEEKDAYS_RU = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+# Сколько вперёд искать ближайшее повторение
+NEXT_OCCURRENCE_HORIZON = timedelta(days=400)
+
+
+class Rule(NamedTuple):
+    freq: str  # "daily", "weekly" или "monthly"
+    interval: int  # Каждый interval-й день, неделю или месяц
+    weekdays: Tuple[int, ...]  # Для weekly: дни недели (0 — понедельник); пусто — день недели date_end
+    until: Optional[date]  # Последний день повторений включительно
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(text: str) -> Rule:
+    """
+    Разбирает правило из schedulecol. Результаты кэшируются: одинаковых правил обычно немного.
+
+    :raises ValueError: Если правило записано неверно.
+    """
+    body, _, options = text.strip().lower().partition(";")
+    head, _, days = body.partition(":")
+    freq, _, interval = head.partition("/")
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Неизвестная частота повтора: {freq!r}")
+    interval = int(interval) if interval else 1
+    if interval < 1:
+        raise ValueError("Интервал повтора должен быть положительным")
+    weekdays: Tuple[int, ...] = ()
+    if days:
+        if freq != "weekly":
+            raise ValueError("Дни недели указываются только для weekly")
+        weekdays = tuple(sorted({WEEKDAYS.index(day.strip()) for day in days.split(",")}))
+    until = None
+    if options:
+        key, _, value = options.partition("=")
+        if key.strip() != "until":
+            raise ValueError(f"Неизвестный параметр повтора: {key!r}")
+        until = date.fromisoformat(value.strip())
+    return Rule(freq, interval, weekdays, until)
+
+
+def format_rule(rule: Rule) -> str:
+    """Записывает правило в виде для schedulecol (обратное к parse_rule)."""
+    text = rule.freq
+    if rule.interval != 1:
+        text += f"/{rule.interval}"
+    if rule.weekdays:
+        text += ":" + ",".join(WEEKDAYS[day] for day in rule.weekdays)
+    if rule.until:
+        text += f";until={rule.until.isoformat()}"
+    return text
+
+
+def parse_repeat(raw: str) -> Optional[str]:
+    """
+    Преобразует повтор, введённый пользователем, в правило для schedulecol.
+    Понимает 'ежедневно', 'еженедельно', 'ежемесячно', дни недели ('пн,чт'), 'нет'
+    и правила в формате schedulecol ('daily/2', 'weekly:mon,thu').
+
+    :return: Правило или None, если повтор не нужен.
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
+    text = raw.strip().lower()
+    if text in ("", "нет", "-"):
+        return None
+    aliases = {"ежедневно": "daily", "каждый день": "daily", "еженедельно": "weekly",
+               "ежемесячно": "monthly", "через день": "daily/2"}
+    if text in aliases:
+        return aliases[text]
+    days = [day for day in text.replace(",", " ").split() if day]
+    if days and all(day in WEEKDAYS_RU for day in days):
+        return format_rule(Rule("weekly", 1, tuple(sorted({WEEKDAYS_RU.index(day) for day in days})), None))
+    try:
+        return format_rule(parse_rule(text))
+    except ValueError:
+        raise ValueError("Ошибка: Неверный повтор. Ожидается 'ежедневно', 'еженедельно', 'ежемесячно' "
+                         "или дни недели, например 'пн,чт'.") from None
+
+
+def describe_rule(rule: Rule) -> str:
+    """Описывает правило для пользователя."""
+    if rule.freq == "daily":
+        text = "ежедневно" if rule.interval == 1 else f"каждые {rule.interval} дн."
+    elif rule.freq == "weekly":
+        text = "еженедельно" if rule.interval == 1 else f"каждые {rule.interval} нед."
+        if rule.weekdays:
+            text += " (" + ", ".join(WEEKDAYS_RU[day] for day in rule.weekdays) + ")"
+    else:
+        text = "ежемесячно" if rule.interval == 1 else f"каждые {rule.interval} мес."
+    if rule.until:
+        text += f" до {rule.until:%d.%m.%y}"
+    return text
+
+
+def _add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    month += 1
+    last = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
+    return date(year, month, min(day.day, last))
+
+
+def ends_before(rule: Rule, moment: datetime) -> bool:
+    """Все повторения по правилу раньше moment: правило с until исчерпано."""
+    return rule.until is not None and datetime.combine(rule.until + timedelta(days=1), dtime()) <= moment
+
+
+def occurrences(rule: Rule, anchor: datetime, start: datetime, end: datetime) -> Iterator[datetime]:
+    """
+    Перебирает повторения задачи в окне [start, end) по возрастанию.
+
+    :param rule: Правило повтора.
+    :param anchor: Первое повторение (date_end и time_end задачи).
+    :param start: Начало окна.
+    :param end: Конец окна, не включительно.
+    """
+    lower = max(start, anchor)
+    if rule.until is not None:
+        end = min(end, datetime.combine(rule.until + timedelta(days=1), dtime()))
+    if lower >= end:
+        return
+    moment = anchor.time()
+
+    if rule.freq == "daily":
+        step = timedelta(days=rule.interval)
+        current = anchor + -((anchor - lower) // step) * step  # Первое повторение не раньше lower
+        while current < end:
+            yield current
+            current += step
+
+    elif rule.freq == "weekly":
+        weekdays = rule.weekdays or (anchor.weekday(),)
+        first_monday = anchor.date() - timedelta(days=anchor.weekday())
+        week = (lower.date() - first_monday).days // 7
+        week -= week % rule.interval
+        while True:
+            monday = first_monday + timedelta(weeks=week)
+            for weekday in weekdays:
+                current = datetime.combine(monday + timedelta(days=weekday), moment)
+                if current < lower:
+                    continue
+                if current >= end:
+                    return
+                yield current
+            week += rule.interval
+
+    else:
+        months = (lower.year - anchor.year) * 12 + lower.month - anchor.month
+        step = max(months, 0) // rule.interval
+        while True:
+            current = datetime.combine(_add_months(anchor.date(), step * rule.interval), moment)
+            if current >= end:
+                return
+            if current >= lower:
+                yield current
+            step += 1
+
+
+def next_occurrence(rule: Rule, anchor: datetime, after: datetime) -> Optional[datetime]:
+    """Возвращает ближайшее повторение не раньше after (в пределах NEXT_OCCURRENCE_HORIZON) или None."""
+    return next(occurrences(rule, anchor, after, after + NEXT_OCCURRENCE_HORIZON), None)
+
+
+def occurs_on(rule: Rule, anchor: date, day: date) -> bool:
+    """Есть ли у задачи повторение в указанный день."""
+    start = datetime.combine(day, dtime())
+    return next(occurrences(rule, datetime.combine(anchor, dtime()), start, start + timedelta(days=1)), None) is not None
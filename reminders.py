@@ -0,0 +1,383 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from datetime import time as dtime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import crud
+from recurrence import NEXT_OCCURRENCE_HORIZON, Rule, ends_before, next_occurrence, occurrences, parse_rule
+from task_format import as_date, as_datetime, as_time
+
+logger = logging.getLogger(__name__)
+
+
+def deadline_of(date_end, time_end) -> Optional[datetime]:
+    """
+    Собирает срок задачи из даты и времени в том виде, в котором их возвращает база или парсер.
+
+    :param date_end: date, datetime или строка 'YYYY-MM-DD'.
+    :param time_end: time, timedelta (так MySQL отдаёт TIME), строка 'HH:MM:SS' или None (полночь).
+    :return: Срок задачи или None, если дата не задана или не разбирается.
+    """
+    try:
+        day = as_date(date_end)
+        moment = as_time(time_end) or dtime()
+    except ValueError:
+        return None
+    if day is None:
+        return None
+    return datetime.combine(day, moment)
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний о сроках задач.
+
+    Сроки подгружаются из базы окнами по времени (window секунд вперёд) и хранятся в куче
+    (момент напоминания, id задачи). Таблица task целиком не сканируется: при каждой
+    загрузке читается только диапазон очередного окна по индексам task.deadline и task.next_at.
+    Изменения задач приходят через crud.task_listeners и сразу обновляют расписание.
+
+    У повторяющейся задачи (см. recurrence.py) в куче лежит только ближайшее повторение, а в базе —
+    его момент (task.next_at). После отправки напоминания next_at сдвигается на следующее повторение,
+    поэтому окно читает только задачи, повторение которых в нём наступает. Правило задачи хранится
+    в памяти, пока её повторение в загруженном окне; задачи с одинаковым названием различаются по id.
+
+    Момент, до которого напоминания уже отправлены, сохраняется в файл, поэтому после перезапуска
+    планировщик продолжает с того же места и досылает напоминания, пропущенные за время простоя.
+    """
+
+    def __init__(self, pool, send: Callable[[int, str], Awaitable[None]], window: float = 3600,
+                 lead: float = 0, state_file: Optional[str] = "reminders_state.json",
+                 max_catch_up: float = 86400):
+        """
+        :param pool: Пул соединений с базой данных.
+        :param send: Корутина отправки сообщения: send(chat_id, text).
+        :param window: Размер окна загрузки сроков, сек.
+        :param lead: За сколько секунд до срока напоминать.
+        :param state_file: (опционально) Файл для сохранения состояния между перезапусками.
+        :param max_catch_up: Насколько далеко в прошлое досылать пропущенные напоминания, сек.
+        """
+        self._pool = pool
+        self._send = send
+        self.window = window
+        self.lead = lead
+        self.state_file = state_file
+        self.max_catch_up = max_catch_up
+        self._heap: List[Tuple[float, int]] = []  # (момент напоминания, id задачи)
+        self._due: Dict[int, float] = {}  # Актуальный момент напоминания по id задачи
+        self._tasks: Dict[int, Tuple[str, str]] = {}  # id задачи из _due или _rules -> (пользователь, название)
+        self._ids: Dict[Tuple[str, str], Set[int]] = {}  # (пользователь, название) -> id задач из _tasks
+        self._chats: Dict[str, int] = {}  # id чатов пользователей, у которых есть напоминания
+        self._rules: Dict[int, Tuple[Rule, datetime]] = {}  # Повторяющиеся задачи в окне: правило и первый срок
+        self._fired_until = time.time()  # До этого момента напоминания уже отправлены
+        self._loaded_until = self._fired_until  # До этого момента сроки загружены в кучу
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._pending: set = set()
+        self.fired = 0  # Сколько напоминаний отправлено
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    async def start(self):
+        """Восстанавливает состояние, подписывается на изменения задач и запускает цикл напоминаний."""
+        now = time.time()
+        self._fired_until = max(self._load_state() or now, now - self.max_catch_up)
+        self._loaded_until = self._fired_until
+        crud.task_listeners.append(self.on_task_change)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает цикл напоминаний и сохраняет состояние."""
+        if self.on_task_change in crud.task_listeners:
+            crud.task_listeners.remove(self.on_task_change)
+        tasks = [task for task in [self._task, *self._pending] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._save_state()
+
+    def _load_state(self) -> Optional[float]:
+        if not self.state_file or not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                return float(json.load(f)["fired_until"])
+        except (OSError, ValueError, KeyError):
+            logger.warning("Не удалось прочитать состояние напоминаний из %s", self.state_file)
+            return None
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fired_until": self._fired_until}, f)
+        os.replace(tmp, self.state_file)
+
+    def _track(self, task_id: int, users_tgteg: str, name: str):
+        self._tasks[task_id] = (users_tgteg, name)
+        self._ids.setdefault((users_tgteg, name), set()).add(task_id)
+
+    def _forget(self, task_id: int):
+        """Убирает задачу из индексов, если её нет ни в куче, ни среди правил."""
+        if task_id in self._due or task_id in self._rules or task_id not in self._tasks:
+            return
+        key = self._tasks.pop(task_id)
+        ids = self._ids[key]
+        ids.discard(task_id)
+        if not ids:
+            del self._ids[key]
+
+    def schedule(self, task_id: int, users_tgteg: str, name: str, deadline: Optional[datetime],
+                 chat: Optional[int] = None):
+        """
+        Ставит (или переносит) напоминание о задаче. Задачи вне загруженного окна
+        не хранятся в памяти — они будут прочитаны при загрузке своего окна.
+        """
+        self._due.pop(task_id, None)
+        remind_at = deadline.timestamp() - self.lead if deadline is not None else None
+        if remind_at is None or remind_at < self._fired_until or remind_at >= self._loaded_until:
+            self._forget(task_id)
+            return
+        self._track(task_id, users_tgteg, name)
+        self._due[task_id] = remind_at
+        heapq.heappush(self._heap, (remind_at, task_id))
+        if chat is not None:
+            self._chats[users_tgteg] = chat
+        if self._heap[0][0] == remind_at:
+            self._wakeup.set()
+
+    def unschedule(self, users_tgteg: str, name: Optional[str] = None):
+        """Отменяет напоминания о задачах с названием name (или обо всех задачах пользователя, если name=None)."""
+        if name is not None:
+            ids = list(self._ids.get((users_tgteg, name), ()))
+        else:
+            ids = [task_id for task_id, (user, _) in self._tasks.items() if user == users_tgteg]
+            self._chats.pop(users_tgteg, None)
+        for task_id in ids:
+            self._due.pop(task_id, None)
+            self._rules.pop(task_id, None)
+            self._forget(task_id)
+
+    @staticmethod
+    def _next_at(rule: Rule, anchor: datetime, after: datetime) -> Optional[datetime]:
+        """Значение task.next_at: ближайшее повторение не раньше after или None, если повторения закончились."""
+        occurrence = next_occurrence(rule, anchor, after)
+        if occurrence is None and not ends_before(rule, after + NEXT_OCCURRENCE_HORIZON):
+            return after + NEXT_OCCURRENCE_HORIZON  # Повторение дальше горизонта поиска: проверим, когда дойдём
+        return occurrence
+
+    def schedule_task(self, task_id: int, users_tgteg: str, name: str, date_end, time_end,
+                      schedulecol: Optional[str], chat: Optional[int] = None) -> Optional[datetime]:
+        """
+        Ставит напоминание о задаче по её полям; для повторяющейся задачи — о ближайшем повторении.
+
+        :return: Ближайшее неотправленное повторение повторяющейся задачи (значение для task.next_at);
+            None для неповторяющейся задачи и для задачи, повторения которой закончились.
+        """
+        deadline = deadline_of(date_end, time_end)
+        if not schedulecol or deadline is None:
+            self.schedule(task_id, users_tgteg, name, deadline, chat)
+            return None
+        try:
+            rule = parse_rule(schedulecol)
+        except ValueError:
+            logger.warning("Неверное правило повтора задачи '%s': %r", name, schedulecol)
+            self.schedule(task_id, users_tgteg, name, deadline, chat)
+            return None
+        next_at = self._next_at(rule, deadline, datetime.fromtimestamp(self._fired_until + self.lead))
+        if next_at is not None and next_at.timestamp() - self.lead < self._loaded_until:
+            self._rules[task_id] = (rule, deadline)
+            self.schedule(task_id, users_tgteg, name, next_at, chat)
+        else:
+            # Повторения в загруженном окне нет: задачу прочитает загрузка окна, в котором наступит next_at
+            self._rules.pop(task_id, None)
+            self.schedule(task_id, users_tgteg, name, None)
+        return next_at
+
+    def _in_window(self, date_end, time_end, schedulecol: Optional[str]) -> bool:
+        """Может ли срок задачи с такими полями попасть в загруженное окно."""
+        deadline = deadline_of(date_end, time_end)
+        if deadline is None:
+            return False
+        start = datetime.fromtimestamp(self._fired_until + self.lead)
+        end = datetime.fromtimestamp(self._loaded_until + self.lead)
+        if schedulecol:
+            try:
+                return next(occurrences(parse_rule(schedulecol), deadline, start, end), None) is not None
+            except ValueError:
+                pass
+        return start <= deadline < end
+
+    def on_task_change(self, event: str, users_tgteg: str, name: Optional[str], fields: Dict):
+        """Подписчик crud.task_listeners: обновляет расписание при изменении задач."""
+        if event == "delete":
+            self.unschedule(users_tgteg, name)
+        elif event == "create":
+            # id новой задачи событие не сообщает; задачу со сроком позже окна прочитает загрузка её окна
+            if fields.get("prpgress") != "Completed" and self._in_window(
+                    fields.get("date_end"), fields.get("time_end"), fields.get("schedulecol")):
+                self._spawn(self._refresh(users_tgteg, name))
+        elif event == "archive" and fields["prpgress"] != "Completed":
+            # В архив ушли задачи с другим итоговым прогрессом; незавершённые задачи с тем же названием остаются
+            self.unschedule(users_tgteg, name)
+            self._spawn(self._refresh(users_tgteg, name))
+        elif event == "update" and name is None:
+            self._spawn(self._refresh_moved(users_tgteg, fields))
+        elif event == "update" and fields.keys() & {"name", "date_end", "time_end", "prpgress", "schedulecol"}:
+            # Изменение могло затронуть только дату или только время — перечитываем задачи целиком
+            self.unschedule(users_tgteg, name)
+            self._spawn(self._refresh(users_tgteg, fields.get("name", name)))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _refresh(self, users_tgteg: str, name: str):
+        """Перечитывает все незавершённые задачи пользователя с этим названием и ставит напоминания о них."""
+        try:
+            rows = await crud.read_task_deadlines(self._pool, users_tgteg, name)
+        except Exception:
+            logger.exception("Не удалось перечитать задачу '%s' для напоминания", name)
+            return
+        for row in rows:
+            self.schedule_task(row.id, users_tgteg, name, row.date_end, row.time_end, row.schedulecol)
+
+    async def _refresh_moved(self, users_tgteg: str, fields: Dict):
+        """Ставит напоминания о задачах, срок которых перенесён одним запросом (crud.move_overdue_tasks)."""
+        try:
+            tasks = await crud.read_tasks(self._pool, users_tgteg)
+        except Exception:
+            logger.exception("Не удалось перечитать задачи пользователя %s для напоминаний", users_tgteg)
+            return
+        moved_to = as_date(fields.get("date_end"))
+        for task in tasks:
+            if task.prpgress != "Completed" and not task.schedulecol and as_date(task.date_end) == moved_to:
+                self.schedule_task(task.id, users_tgteg, task.name, task.date_end, task.time_end, None)
+
+    async def _save_next_occurrences(self, rows: List[Tuple[int, Optional[datetime]]]):
+        try:
+            await crud.set_next_occurrences(self._pool, rows)
+        except Exception:
+            # next_at остался прежним: задачи вернутся при загрузке окна и будут пересчитаны от _fired_until
+            logger.exception("Не удалось сохранить ближайшие повторения %d задач", len(rows))
+
+    async def _load_next_window(self):
+        """Загружает в кучу сроки следующего окна [loaded_until, loaded_until + window)."""
+        start = self._loaded_until
+        end = start + self.window
+        # Окно считается загруженным сразу, чтобы задачи, созданные во время запроса, тоже попали в кучу
+        self._loaded_until = end
+        try:
+            rows = await crud.read_deadlines(self._pool, datetime.fromtimestamp(start + self.lead),
+                                             datetime.fromtimestamp(end + self.lead))
+        except Exception:
+            self._loaded_until = start
+            raise
+        advanced = []
+        for row in rows:
+            chat = int(row.chat) if row.chat and str(row.chat).isdigit() else None
+            if row.schedulecol:
+                # Повторяющаяся задача: если ближайшее повторение ещё не отправлено, оно уже в куче
+                if row.id not in self._due:
+                    next_at = self.schedule_task(row.id, row.users_tgteg, row.name, row.date_end, row.time_end,
+                                                 row.schedulecol, chat)
+                    if next_at != as_datetime(row.next_at):
+                        advanced.append((row.id, next_at))
+                continue
+            deadline = deadline_of(row.date_end, row.time_end)
+            if deadline is None:
+                continue
+            remind_at = deadline.timestamp() - self.lead
+            if start <= remind_at < end:
+                self.schedule(row.id, row.users_tgteg, row.name, deadline, chat)
+        if advanced:
+            await self._save_next_occurrences(advanced)
+
+    async def _fire(self, users_tgteg: str, name: str, remind_at: float):
+        chat = self._chats.get(users_tgteg)
+        if chat is None:
+            chat = await crud.read_user_chat(self._pool, users_tgteg)
+            if chat is None:
+                logger.info("Нет id чата для %s, напоминание о '%s' пропущено", users_tgteg, name)
+                return
+            self._chats[users_tgteg] = chat
+        deadline = datetime.fromtimestamp(remind_at + self.lead)
+        await self._send(chat, f"Напоминание: срок задачи '{name}' — {deadline:%d.%m.%y %H:%M}.")
+        self.fired += 1
+
+    def _schedule_next(self, task_id: int, users_tgteg: str, name: str, recurring: Tuple[Rule, datetime],
+                       fired_at: float) -> Optional[datetime]:
+        """Ставит следующее повторение, если оно в загруженном окне. Возвращает новое значение next_at."""
+        rule, anchor = recurring
+        after = datetime.fromtimestamp(fired_at + self.lead) + timedelta(seconds=1)
+        next_at = self._next_at(rule, anchor, after)
+        if next_at is not None and next_at.timestamp() - self.lead < self._loaded_until:
+            self.schedule(task_id, users_tgteg, name, next_at)
+        else:
+            # Это было последнее повторение или следующее за пределами окна — его поставит загрузка окна
+            self._rules.pop(task_id, None)
+            self._forget(task_id)
+        return next_at
+
+    async def _fire_due(self, now: float) -> bool:
+        """Отправляет напоминания, срок которых наступил к now, и сдвигает next_at повторяющихся задач."""
+        fired_any = False
+        advanced = []
+        while self._heap and self._heap[0][0] <= now:
+            remind_at, task_id = heapq.heappop(self._heap)
+            if self._due.get(task_id) != remind_at:
+                continue  # Напоминание отменено или перенесено
+            del self._due[task_id]
+            users_tgteg, name = self._tasks[task_id]
+            try:
+                await self._fire(users_tgteg, name, remind_at)
+            except Exception:
+                logger.exception("Не удалось отправить напоминание о '%s'", name)
+            fired_any = True
+            recurring = self._rules.get(task_id)
+            if recurring is not None and task_id not in self._due:  # Иначе задачу уже перепланировало её изменение
+                advanced.append((task_id, self._schedule_next(task_id, users_tgteg, name, recurring, remind_at)))
+            else:
+                self._forget(task_id)
+        if advanced:
+            await self._save_next_occurrences(advanced)
+        return fired_any
+
+    def _compact(self):
+        # Отменённые записи остаются в куче до извлечения; если их слишком много — пересобираем кучу
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, task_id) for task_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            if self._loaded_until < now + self.window / 2:
+                try:
+                    await self._load_next_window()
+                except Exception:
+                    logger.exception("Не удалось загрузить сроки задач")
+                    await asyncio.sleep(5)
+                continue
+
+            fired_any = await self._fire_due(now)
+            self._fired_until = now
+            if fired_any:
+                self._save_state()
+            self._compact()
+
+            next_load = self._loaded_until - self.window / 2
+            next_due = self._heap[0][0] if self._heap else next_load
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(min(next_due, next_load) - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
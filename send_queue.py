@@ -0,0 +1,332 @@
+"""
+Очередь исходящих сообщений с ограничением частоты отправки.
+
+Обработчики и рассылки (напоминания, сводки) не вызывают Telegram сами, а ставят сообщение
+в очередь и сразу продолжают работу. Очередь отправляет сообщения с учётом ограничений Telegram:
+
+- не больше global_rate сообщений в секунду на весь бот и chat_rate — в один чат (token bucket,
+  кратковременно допускается chat_burst сообщений подряд);
+- ответы пользователям (INTERACTIVE) отправляются раньше рассылок (BULK);
+- сообщения одного чата отправляются по порядку, по одному;
+- при ответе 429 чат ставится на паузу на retry_after секунд, и сообщение отправляется повторно;
+  при сетевых ошибках и ошибках сервера Telegram — повтор с растущей паузой;
+- текст длиннее 4096 символов делится на части по строкам;
+- файлы (send_document) идут в ту же очередь чата и отправляются по тем же правилам.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import InputFile
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Приоритеты: меньшее значение отправляется раньше
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = (INTERACTIVE, BULK)
+
+# При скольких чатах с состоянием ограничений чистить его, не дожидаясь, пока очередь опустеет
+PRUNE_THRESHOLD = 10000
+
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Делит текст на части не длиннее limit, по возможности по границам строк."""
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            # Строка не помещается в одно сообщение — режем её по limit
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        parts.append(current)
+    return parts
+
+
+class TokenBucket:
+    """Ограничение частоты: rate событий в секунду, не больше capacity подряд."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд можно будет отправить следующее сообщение (0 — сейчас)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Outgoing:
+    """Часть сообщения или файл в очереди."""
+
+    __slots__ = ("text", "kwargs", "future", "last", "attempts", "document")
+
+    def __init__(self, text: Optional[str], kwargs: Dict, future: asyncio.Future, last: bool,
+                 document: Optional[InputFile] = None):
+        self.text = text
+        self.kwargs = kwargs
+        self.future = future  # Общий для всех частей сообщения
+        self.last = last
+        self.attempts = 0
+        self.document = document  # Если задан, отправляется send_document, а text не используется
+
+
+class SendQueue:
+    """
+    Очередь исходящих сообщений бота.
+
+    Один планировщик выбирает следующее сообщение: сначала по приоритету, внутри приоритета —
+    по кругу между чатами, пропуская чаты, которым ещё рано отправлять. Отправки выполняются
+    параллельно (не больше max_concurrency), но в каждый чат — не больше одной одновременно.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_concurrency: int = 10, max_bulk_pending: int = 10000, max_retries: int = 5):
+        """
+        :param bot: Экземпляр бота.
+        :param global_rate: Сообщений в секунду на весь бот.
+        :param chat_rate: Сообщений в секунду в один чат.
+        :param chat_burst: Сколько сообщений подряд можно отправить в чат без паузы.
+        :param max_concurrency: Сколько запросов к Telegram могут выполняться одновременно.
+        :param max_bulk_pending: Сколько рассылочных сообщений может ждать в очереди; send с BULK ждёт места.
+        :param max_retries: Сколько раз повторять отправку при 429, сетевых ошибках и ошибках сервера.
+        """
+        self._bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # Приоритет -> чат -> части сообщений по порядку; порядок чатов — очередь обхода по кругу
+        self._lanes: Dict[int, "OrderedDict[int, Deque[_Outgoing]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._busy: Set[int] = set()  # Чаты, в которые сейчас идёт отправка
+        self._paused: Dict[int, float] = {}  # Чат -> момент, до которого Telegram просил не отправлять
+        self._bulk_space = asyncio.Semaphore(max_bulk_pending)
+        self._wakeup = asyncio.Event()
+        self._sending: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.queued = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Дожидается отправки сообщений из очереди (не дольше timeout) и останавливает планировщик."""
+        started = time.monotonic()
+        while self.queued or self._sending:
+            if timeout is not None and time.monotonic() - started >= timeout:
+                logger.warning("Не отправлено сообщений при остановке: %d", self.queued)
+                break
+            await asyncio.sleep(0.05)
+        tasks = [task for task in (self._task, *self._sending) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for lane in self._lanes.values():
+            for items in lane.values():
+                for item in items:
+                    if not item.future.done():
+                        item.future.cancel()
+            lane.clear()
+        self.queued = 0
+
+    async def send(self, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь и возвращается, не дожидаясь отправки.
+
+        :param chat_id: Чат получателя.
+        :param text: Текст; длинный текст отправляется несколькими сообщениями.
+        :param priority: INTERACTIVE для ответов пользователю, BULK для рассылок.
+        :param kwargs: Параметры send_message; reply_markup прикрепляется к последней части.
+        :return: Future, который завершается отправленным Message последней части или ошибкой отправки.
+        """
+        future = await self._new_future(priority)
+        parts = split_text(text)
+        markup = kwargs.pop("reply_markup", None)
+        items = self._lanes[priority].setdefault(chat_id, deque())
+        for index, part in enumerate(parts):
+            last = index == len(parts) - 1
+            items.append(_Outgoing(part, dict(kwargs, reply_markup=markup) if last else kwargs, future, last))
+        self.queued += len(parts)
+        self._wakeup.set()
+        return future
+
+    async def send_document(self, chat_id: int, document: InputFile, priority: int = INTERACTIVE,
+                            **kwargs) -> asyncio.Future:
+        """
+        Ставит файл в очередь и возвращается, не дожидаясь отправки.
+
+        :param chat_id: Чат получателя.
+        :param document: Файл; при повторной отправке читается снова, поэтому должен существовать до завершения Future.
+        :param priority: INTERACTIVE для ответов пользователю, BULK для рассылок.
+        :param kwargs: Параметры send_document (caption и т. п.).
+        :return: Future, который завершается отправленным Message или ошибкой отправки.
+        """
+        future = await self._new_future(priority)
+        self._lanes[priority].setdefault(chat_id, deque()).append(_Outgoing(None, kwargs, future, True, document))
+        self.queued += 1
+        self._wakeup.set()
+        return future
+
+    async def _new_future(self, priority: int) -> asyncio.Future:
+        """Future отправки; для рассылок сначала ждёт места в очереди."""
+        future = asyncio.get_running_loop().create_future()
+        if priority == BULK:
+            await self._bulk_space.acquire()
+            future.add_done_callback(lambda _: self._bulk_space.release())
+        return future
+
+    def _pick(self, now: float) -> Tuple[Optional[Tuple[int, int]], Optional[float]]:
+        """
+        Выбирает (приоритет, чат) для следующей отправки.
+
+        :return: ((приоритет, чат) или None, через сколько секунд проверить снова или None — ждать событий).
+        """
+        if len(self._sending) >= self.max_concurrency:
+            return None, None
+        wait = self._global.wait_time(now)
+        if wait:
+            return None, wait
+        soonest = None
+        for priority in PRIORITIES:
+            for chat in self._lanes[priority]:
+                if chat in self._busy:
+                    continue
+                paused = self._paused.get(chat, 0) - now
+                bucket = self._chat_buckets.get(chat)
+                delay = max(paused, bucket.wait_time(now) if bucket else 0.0)
+                if delay <= 0:
+                    return (priority, chat), None
+                soonest = delay if soonest is None else min(soonest, delay)
+        return None, soonest
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            picked, wait = self._pick(now)
+            if picked is None:
+                if not self.queued and not self._sending or len(self._chat_buckets) > PRUNE_THRESHOLD:
+                    self._prune(now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            priority, chat = picked
+            lane = self._lanes[priority]
+            items = lane[chat]
+            item = items.popleft()
+            if items:
+                lane.move_to_end(chat)  # Следующим в этом приоритете будет другой чат
+            else:
+                del lane[chat]
+            self.queued -= 1
+            self._global.take(now)
+            bucket = self._chat_buckets.get(chat)
+            if bucket is None:
+                bucket = self._chat_buckets[chat] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            bucket.take(now)
+            self._busy.add(chat)
+            task = asyncio.create_task(self._send(priority, chat, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, priority: int, chat: int, item: _Outgoing):
+        try:
+            if item.future.done():
+                return  # Предыдущая часть сообщения не отправилась
+            try:
+                if item.document is not None:
+                    message = await self._bot.send_document(chat, item.document, **item.kwargs)
+                else:
+                    message = await self._bot.send_message(chat, item.text, **item.kwargs)
+            except (TelegramRetryAfter, TelegramNetworkError, TelegramServerError) as e:
+                item.attempts += 1
+                if item.attempts > self.max_retries:
+                    self._fail(item, e)
+                    return
+                self.retries += 1
+                if isinstance(e, TelegramRetryAfter):
+                    delay = e.retry_after
+                else:
+                    delay = min(2 ** item.attempts, 30)
+                self._paused[chat] = time.monotonic() + delay
+                # Возвращаем часть в начало очереди чата, чтобы не нарушить порядок
+                lane = self._lanes[priority]
+                if chat not in lane:
+                    lane[chat] = deque()
+                    lane.move_to_end(chat, last=False)
+                lane[chat].appendleft(item)
+                self.queued += 1
+                return
+            except Exception as e:
+                self._fail(item, e)
+                return
+            self.sent += 1
+            if item.last and not item.future.done():
+                item.future.set_result(message)
+        finally:
+            self._busy.discard(chat)
+            # Освобождаем место до пробуждения планировщика (done-callback задачи вызывается позже)
+            self._sending.discard(asyncio.current_task())
+            self._wakeup.set()
+
+    def _fail(self, item: _Outgoing, error: Exception):
+        self.failed += 1
+        logger.warning("Не удалось отправить сообщение: %s", error)
+        if not item.future.done():
+            item.future.set_exception(error)
+            item.future.exception()  # Ошибка уже записана в лог, не ждём, что её кто-то прочитает
+
+    def _prune(self, now: float):
+        """Удаляет состояние чатов, для которых ограничения уже не действуют (после рассылки их много)."""
+        for chat in [chat for chat, until in self._paused.items() if until <= now]:
+            del self._paused[chat]
+        for chat in [chat for chat, bucket in self._chat_buckets.items()
+                     if bucket.full(now) and chat not in self._busy]:
+            del self._chat_buckets[chat]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued, "sending": len(self._sending), "sent": self.sent,
+            "retries": self.retries, "failed": self.failed,
+        }
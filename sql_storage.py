@@ -0,0 +1,242 @@
+"""
+Хранилище на SQL (storage.Storage) поверх пула с интерфейсом aiomysql: пул MySQL (db_pool.TimedPool)
+или SQLitePool. Запросы написаны на диалекте MySQL; SQLiteStorage (см. sqlite_pool.py) заменяет
+только те из них, которых нет в SQLite.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from queries import (TASK_COLUMNS, DeadlineRow, TaskGroupRow, TaskRow, TaskStateRow, UserRow, archive_move_statements,
+                     archive_select_statement, initial_next_at, make_rows, move_overdue_statement, next_at_expression,
+                     select_tasks_statement, task_groups_statement, update_statement)
+
+# Колонки строки DeadlineRow: задача и id чата владельца
+DEADLINE_COLUMNS = ("t.id, t.name, t.users_tgteg, t.date_end, t.time_end, t.schedulecol, t.next_at, u.userscol AS chat "
+                    "FROM task t LEFT JOIN users u ON u.tgteg = t.users_tgteg")
+
+
+class SQLStorage:
+    """
+    Хранилище задач и пользователей в таблицах users, task и task_archive (см. migrations.py).
+
+    Атрибуты пула (acquire, size, freesize, maxsize и т.д.) проксируются в исходный пул,
+    поэтому хранилище можно передавать и туда, где нужен сам пул (прогрев, миграции).
+    """
+
+    # Блокировка строк пачки при архивации (SELECT ... FOR UPDATE)
+    LOCK_ROWS = " FOR UPDATE"
+
+    def __init__(self, pool):
+        """
+        :param pool: Пул соединений с интерфейсом пула aiomysql.
+        """
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    async def _fetch_rows(self, row_class, query: str, params) -> list:
+        """Выполняет запрос и возвращает строки row_class (колонки запроса — в порядке row_class._fields)."""
+        async with self.pool.acquire() as conn:  # Получаем соединение из пула
+            async with conn.cursor() as cur:  # Обычный курсор: кортежи превращаются в строки без промежуточных словарей
+                await cur.execute(query, params)  # Выполняем запрос с параметрами
+                return make_rows(row_class, await cur.fetchall())
+
+    async def _write(self, query: str, params) -> int:
+        """Выполняет запрос на изменение в отдельной транзакции и возвращает число затронутых строк."""
+        async with self.pool.acquire() as conn:  # Получаем соединение из пула
+            async with conn.cursor() as cur:  # Создаем курсор
+                await cur.execute(query, params)  # Выполняем запрос
+                await conn.commit()  # Сохраняем изменения
+                return cur.rowcount
+
+    # --- Задачи ---
+
+    async def insert_tasks(self, rows: Sequence[tuple]):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    # executemany в aiomysql склеивает строки в один INSERT ... VALUES (...), (...)
+                    await cur.executemany("""
+                        INSERT INTO task (name, users_tgteg, date_end, time_end, prpgress, schedulecol, next_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, [(*row, initial_next_at(row[4], row[5])) for row in rows])
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    async def select_tasks(self, users_tgteg: Optional[str] = None, after_id: Optional[int] = None,
+                           before_id: Optional[int] = None, limit: Optional[int] = None) -> List[TaskRow]:
+        # Текст запроса берётся из кэша по набору фильтров; параметры идут в том же порядке.
+        # Для предыдущей страницы идём от before_id назад, затем разворачиваем результат
+        query = select_tasks_statement("task", bool(users_tgteg), after_id is not None, before_id is not None,
+                                       limit is not None, before_id is not None)
+        params = [value for value in (users_tgteg or None, after_id, before_id, limit) if value is not None]
+        rows = await self._fetch_rows(TaskRow, query, params)
+        if before_id is not None:
+            rows.reverse()
+        return rows
+
+    async def read_task(self, name: str, users_tgteg: str) -> Optional[TaskRow]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"SELECT {TASK_COLUMNS} FROM task WHERE name = %s AND users_tgteg = %s ORDER BY id LIMIT 1",
+                    (name, users_tgteg),
+                )
+                row = await cur.fetchone()
+        return TaskRow._make(row) if row else None
+
+    async def read_task_names(self, users_tgteg: str) -> List[str]:
+        # Читается только индекс (users_tgteg, name)
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT name FROM task WHERE users_tgteg = %s", (users_tgteg,))
+                return [row[0] for row in await cur.fetchall()]
+
+    async def read_task_states(self, users_tgteg: str) -> List[TaskStateRow]:
+        return await self._fetch_rows(TaskStateRow,
+                                      "SELECT name, prpgress, date_end, schedulecol FROM task WHERE users_tgteg = %s",
+                                      (users_tgteg,))
+
+    async def read_task_groups(self, users_tgteg: Optional[Sequence[str]] = None) -> List[TaskGroupRow]:
+        if users_tgteg is None:
+            return await self._fetch_rows(TaskGroupRow, task_groups_statement(None), [])
+        return await self._fetch_rows(TaskGroupRow, task_groups_statement(len(users_tgteg)), list(users_tgteg))
+
+    async def read_deadlines(self, start: datetime, end: datetime) -> List[DeadlineRow]:
+        # Два запроса вместо одного с OR, чтобы каждый шёл по своему индексу: deadline и next_at
+        return await self._fetch_rows(DeadlineRow, f"""
+            SELECT {DEADLINE_COLUMNS}
+            WHERE t.deadline >= %s AND t.deadline < %s AND t.schedulecol IS NULL
+              AND t.prpgress <> 'Completed'
+            UNION ALL
+            SELECT {DEADLINE_COLUMNS}
+            WHERE t.next_at < %s AND t.prpgress <> 'Completed'
+        """, (start, end, end))
+
+    async def read_task_deadlines(self, users_tgteg: str, name: str) -> List[DeadlineRow]:
+        return await self._fetch_rows(DeadlineRow, f"""
+            SELECT {DEADLINE_COLUMNS}
+            WHERE t.users_tgteg = %s AND t.name = %s AND t.prpgress <> 'Completed'
+        """, (users_tgteg, name))
+
+    async def set_next_occurrences(self, rows: Sequence[Tuple[int, Optional[datetime]]]):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany("UPDATE task SET next_at = %s WHERE id = %s",
+                                      [(next_at, task_id) for task_id, next_at in rows])
+                await conn.commit()
+
+    async def update_task(self, name: str, users_tgteg: str, updates: Dict) -> int:
+        # Текст запроса с SET только для указанных полей собирается один раз для каждого набора колонок
+        return await self._write(update_statement(tuple(updates), 0, next_at_expression(updates)),
+                                 [*updates.values(), name, users_tgteg])
+
+    async def update_tasks(self, names: Sequence[str], users_tgteg: str, updates: Dict) -> int:
+        return await self._write(update_statement(tuple(updates), len(names), next_at_expression(updates)),
+                                 [*updates.values(), users_tgteg, *names])
+
+    async def move_overdue_tasks(self, users_tgteg: str, updates: Dict, now: datetime) -> int:
+        return await self._write(move_overdue_statement(tuple(updates)), [*updates.values(), users_tgteg, now])
+
+    async def delete_task(self, name: str, users_tgteg: str) -> int:
+        return await self._write("""
+            DELETE FROM task
+            WHERE name = %s AND users_tgteg = %s
+        """, (name, users_tgteg))
+
+    async def archive_tasks(self, statuses: Sequence[str], before: datetime, after_id: int,
+                            limit: int) -> List[tuple]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                # Блокируются только строки пачки, и только до конца этой транзакции
+                await cur.execute(archive_select_statement(len(statuses), self.LOCK_ROWS),
+                                  (*statuses, after_id, before, limit))
+                rows = await cur.fetchall()
+                if rows:
+                    ids = [row[0] for row in rows]
+                    copy, delete = archive_move_statements(len(ids))
+                    await cur.execute(copy, ids)
+                    await cur.execute(delete, ids)
+                await conn.commit()
+        return list(rows)
+
+    async def select_archived_tasks(self, users_tgteg: str, before_id: Optional[int] = None,
+                                    limit: Optional[int] = None, after_id: Optional[int] = None) -> List[TaskRow]:
+        # Ближайшие к after_id задачи читаются по возрастанию id и переворачиваются
+        descending = after_id is None
+        query = select_tasks_statement("task_archive", True, after_id is not None, before_id is not None,
+                                       limit is not None, descending)
+        params = [value for value in (users_tgteg, after_id, before_id, limit) if value is not None]
+        rows = await self._fetch_rows(TaskRow, query, params)
+        return rows if descending else rows[::-1]
+
+    # --- Пользователи ---
+
+    async def create_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None):
+        await self._write("""
+            INSERT INTO users (tgteg, name, userscol)
+            VALUES (%s, %s, %s)
+        """, (tgteg, name, userscol))
+
+    async def upsert_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> bool:
+        # Опирается на уникальный ключ по tgteg: одновременные вызовы не создают дубликатов
+        updated = await self._write("""
+            INSERT INTO users (tgteg, name, userscol)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE userscol = COALESCE(VALUES(userscol), userscol)
+        """, (tgteg, name, userscol))
+        return updated == 1  # 1 — вставка, 2 — обновление, 0 — без изменений
+
+    async def read_user_chat(self, tgteg: str) -> Optional[int]:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT userscol FROM users WHERE tgteg = %s", (tgteg,))
+                row = await cur.fetchone()
+        if not row or not row[0]:
+            return None
+        try:
+            return int(row[0])
+        except ValueError:
+            return None
+
+    async def read_users(self, tgteg: Optional[str] = None, limit: Optional[int] = None,
+                         after: Optional[str] = None) -> List[UserRow]:
+        query = "SELECT tgteg, name, userscol FROM users"  # Базовый SQL-запрос
+        params = []
+        if tgteg:
+            query += " WHERE tgteg = %s"  # Условие фильтрации
+            params.append(tgteg)
+        elif after is not None:
+            query += " WHERE tgteg > %s"  # Следующая пачка по первичному ключу
+            params.append(after)
+        query += " ORDER BY tgteg"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        return await self._fetch_rows(UserRow, query, params)
+
+    async def delete_user(self, tgteg: str):
+        # Пользователь и его задачи удаляются одной транзакцией
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    await cur.execute("DELETE FROM task WHERE users_tgteg = %s", (tgteg,))
+                    await cur.execute("DELETE FROM users WHERE tgteg = %s", (tgteg,))
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+    # --- Состояние и закрытие ---
+
+    def stats(self) -> Dict:
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+    async def wait_closed(self):
+        await self.pool.wait_closed()
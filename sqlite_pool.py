@@ -0,0 +1,267 @@
+import asyncio
+from contextvars import ContextVar
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import aiomysql
+import aiosqlite
+
+from queries import NEXT_AT_PENDING
+from sql_storage import SQLStorage
+
+# Схема, повторяющая MySQL-схему из migrations.py (колонки и индексы)
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        tgteg TEXT NOT NULL PRIMARY KEY,
+        name TEXT NULL,
+        userscol TEXT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS task (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        users_tgteg TEXT NOT NULL,
+        date_end TEXT NULL,
+        time_end TEXT NULL,
+        prpgress TEXT NOT NULL DEFAULT 'Pending',
+        schedulecol TEXT NULL,
+        deadline TEXT GENERATED ALWAYS AS (date_end || ' ' || COALESCE(time_end, '00:00:00')) STORED,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+        next_at TEXT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_task_user_name ON task (users_tgteg, name)",
+    "CREATE INDEX IF NOT EXISTS idx_task_deadline ON task (deadline)",
+    "CREATE INDEX IF NOT EXISTS idx_task_next ON task (next_at)",
+    "CREATE INDEX IF NOT EXISTS idx_task_progress ON task (prpgress, id)",
+    # Аналог ON UPDATE CURRENT_TIMESTAMP из MySQL
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_task_updated_at AFTER UPDATE ON task
+    FOR EACH ROW WHEN NEW.updated_at = OLD.updated_at
+    BEGIN
+        UPDATE task SET updated_at = datetime('now', 'localtime') WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS task_archive (
+        id INTEGER NOT NULL PRIMARY KEY,
+        name TEXT NOT NULL,
+        users_tgteg TEXT NOT NULL,
+        date_end TEXT NULL,
+        time_end TEXT NULL,
+        prpgress TEXT NOT NULL,
+        schedulecol TEXT NULL,
+        updated_at TEXT NULL,
+        archived_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_archive_user ON task_archive (users_tgteg, id)",
+]
+
+# Счётчик запросов текущей задачи asyncio: позволяет посчитать запросы одного обновления,
+# даже когда параллельно обрабатываются другие. Значение — список из одного числа или None.
+query_counter: ContextVar[Optional[list]] = ContextVar("query_counter", default=None)
+
+def translate(query: str) -> str:
+    """
+    Переводит параметры запроса из формата aiomysql (%s) в формат SQLite (?).
+    Запросы на диалекте MySQL, которых нет в SQLite, SQLiteStorage выполняет по-своему.
+    """
+    return query.replace("%s", "?")
+
+
+def _adapt(value):
+    # SQLite хранит даты и время строками в том же формате, что отдаёт MySQL
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return (datetime.min + value).time().isoformat()
+    return value
+
+
+def _adapt_params(params: Optional[Sequence]) -> tuple:
+    return tuple(_adapt(value) for value in params or ())
+
+
+class SQLiteCursor:
+    """Курсор с интерфейсом курсора aiomysql поверх aiosqlite."""
+
+    def __init__(self, owner: "SQLitePool", conn: aiosqlite.Connection, as_dict: bool):
+        self._owner = owner
+        self._conn = conn
+        self._as_dict = as_dict
+        self._cursor: Optional[aiosqlite.Cursor] = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _count(self):
+        self._owner.queries += 1
+        counter = query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async def execute(self, query: str, params: Optional[Sequence] = None):
+        self._count()
+        self._cursor = await self._conn.execute(translate(query), _adapt_params(params))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        return self.rowcount
+
+    async def executemany(self, query: str, rows: Sequence[Sequence]):
+        self._count()
+        self._cursor = await self._conn.executemany(translate(query), [_adapt_params(row) for row in rows])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _convert(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return dict(zip((column[0] for column in self._cursor.description), row))
+
+    async def fetchone(self):
+        return self._convert(await self._cursor.fetchone())
+
+    async def fetchall(self) -> List:
+        return [self._convert(row) for row in await self._cursor.fetchall()]
+
+    async def close(self):
+        if self._cursor is not None:
+            await self._cursor.close()
+
+
+class SQLiteConnection:
+    """Соединение с интерфейсом соединения aiomysql."""
+
+    def __init__(self, owner: "SQLitePool", conn: aiosqlite.Connection):
+        self._owner = owner
+        self._conn = conn
+
+    def cursor(self, cursor_class=None):
+        return _CursorContext(SQLiteCursor(self._owner, self._conn, cursor_class is aiomysql.DictCursor))
+
+    async def commit(self):
+        await self._conn.commit()
+
+    async def rollback(self):
+        await self._conn.rollback()
+
+
+class _CursorContext:
+    def __init__(self, cursor: SQLiteCursor):
+        self._cursor = cursor
+
+    async def __aenter__(self) -> SQLiteCursor:
+        return self._cursor
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._cursor.close()
+
+
+class SQLitePool:
+    """
+    Пул с интерфейсом пула aiomysql поверх одного соединения aiosqlite.
+
+    Запросы SQLStorage выполняются на нём без изменений, кроме формата параметров (см. translate).
+    Соединение одно, поэтому выдаётся по очереди — так транзакции разных обработчиков не смешиваются.
+    Считает число выполненных запросов (queries).
+    """
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = SQLiteConnection(self, conn)
+        self._raw = conn
+        self._lock = asyncio.Lock()
+        self.queries = 0
+        self.minsize = self.maxsize = 1
+
+    def acquire(self):
+        return _AcquireContext(self)
+
+    @property
+    def size(self) -> int:
+        return 1
+
+    @property
+    def freesize(self) -> int:
+        return 0 if self._lock.locked() else 1
+
+    def stats(self) -> Dict:
+        return {"size": 1, "free": self.freesize, "used": 1 - self.freesize, "queries": self.queries}
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        await self._raw.close()
+
+
+class _AcquireContext:
+    def __init__(self, pool: SQLitePool):
+        self._pool = pool
+
+    async def __aenter__(self) -> SQLiteConnection:
+        await self._pool._lock.acquire()
+        return self._pool._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._pool._lock.release()
+
+
+async def _upgrade_task_table(conn: aiosqlite.Connection):
+    """Добавляет колонку next_at в таблицу task базы, созданной до её появления (как миграция 8 в MySQL)."""
+    columns = [row[1] for row in await conn.execute_fetchall("PRAGMA table_info(task)")]
+    if columns and "next_at" not in columns:
+        await conn.execute("ALTER TABLE task ADD COLUMN next_at TEXT NULL")
+        await conn.execute("UPDATE task SET next_at = ? WHERE schedulecol IS NOT NULL AND prpgress <> 'Completed'",
+                           (NEXT_AT_PENDING,))
+        await conn.execute("DROP INDEX IF EXISTS idx_task_schedule")
+
+
+async def create_sqlite_pool(path: str = ":memory:") -> SQLitePool:
+    """
+    Открывает базу SQLite и создаёт в ней таблицы бота.
+
+    :param path: Путь к файлу базы или ":memory:" для базы в памяти.
+    :return: Пул с интерфейсом пула aiomysql.
+    """
+    conn = await aiosqlite.connect(path)
+    await _upgrade_task_table(conn)
+    for statement in SCHEMA:
+        await conn.execute(statement)
+    await conn.commit()
+    return SQLitePool(conn)
+
+
+class SQLiteStorage(SQLStorage):
+    """
+    SQLStorage поверх SQLitePool. Отличается только запросами, которых нет в SQLite:
+    блокировкой строк при архивации и вставкой пользователя с ON DUPLICATE KEY UPDATE.
+    """
+
+    # Запись в SQLite и так идёт в одной транзакции за раз
+    LOCK_ROWS = ""
+
+    async def upsert_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> bool:
+        # Результат как у MySQL: True, только если строка вставлена. ON CONFLICT DO UPDATE сообщает
+        # об одной изменённой строке в обоих случаях, поэтому обновление — отдельным запросом
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("INSERT OR IGNORE INTO users (tgteg, name, userscol) VALUES (%s, %s, %s)",
+                                  (tgteg, name, userscol))
+                created = cur.rowcount == 1
+                if not created and userscol is not None:
+                    await cur.execute("UPDATE users SET userscol = %s WHERE tgteg = %s", (userscol, tgteg))
+                await conn.commit()
+        return created
+
+
+async def open_sqlite_storage(path: str = ":memory:") -> SQLiteStorage:
+    """
+    Открывает хранилище в базе SQLite (см. create_sqlite_pool).
+
+    :param path: Путь к файлу базы или ":memory:" для базы в памяти.
+    """
+    return SQLiteStorage(await create_sqlite_pool(path))
@@ -0,0 +1,132 @@
+"""
+Хранилище данных бота.
+
+Функции crud принимают первым аргументом pool — объект хранилища с интерфейсом Storage и вызывают
+его методы; кэши, подписчики изменений и проверка колонок остаются в crud и одинаковы для всех хранилищ.
+Реализации:
+
+- "mysql"  — SQLStorage поверх пула aiomysql (основной вариант, см. sql_storage.py и connect_to_db);
+- "sqlite" — SQLiteStorage поверх файла или базы SQLite в памяти через aiosqlite (см. sqlite_pool.py):
+  те же запросы, что у SQLStorage, кроме запросов на диалекте MySQL (upsert_user, блокировка строк);
+- "memory" — MemoryStorage: словари в памяти процесса, без SQL и без внешних зависимостей.
+
+Новая операция с задачами или пользователями добавляется методом в Storage и в каждую реализацию.
+
+Хранилище выбирается параметром STORAGE_BACKEND в config.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+import config
+from queries import DeadlineRow, TaskGroupRow, TaskRow, TaskStateRow, UserRow
+
+BACKENDS = ("mysql", "sqlite", "memory")
+
+
+class Storage(Protocol):
+    """
+    Операции хранилища, которые вызывает crud. Строки задач передаются кортежами
+    (name, users_tgteg, date_end, time_end, prpgress, schedulecol), колонки в updates
+    уже проверены crud по TASK_UPDATE_COLUMNS.
+    """
+
+    # --- Задачи ---
+
+    async def insert_tasks(self, rows: Sequence[tuple]):
+        """Добавляет задачи одной транзакцией."""
+
+    async def select_tasks(self, users_tgteg: Optional[str] = None, after_id: Optional[int] = None,
+                           before_id: Optional[int] = None, limit: Optional[int] = None) -> List[TaskRow]:
+        """Задачи по возрастанию id с keyset-пагинацией (см. crud.read_tasks)."""
+
+    async def read_task(self, name: str, users_tgteg: str) -> Optional[TaskRow]:
+        """Задача пользователя с указанным названием (с наименьшим id) или None."""
+
+    async def read_task_names(self, users_tgteg: str) -> List[str]:
+        """Названия всех задач пользователя."""
+
+    async def read_task_states(self, users_tgteg: str) -> List[TaskStateRow]:
+        """Название, прогресс, дата срока и правило повтора каждой задачи пользователя."""
+
+    async def read_task_groups(self, users_tgteg: Optional[Sequence[str]] = None) -> List[TaskGroupRow]:
+        """Число задач по группам (пользователь, прогресс, дата срока, правило повтора)."""
+
+    async def read_deadlines(self, start: datetime, end: datetime) -> List[DeadlineRow]:
+        """Сроки незавершённых задач для напоминаний (см. crud.read_deadlines)."""
+
+    async def read_task_deadlines(self, users_tgteg: str, name: str) -> List[DeadlineRow]:
+        """Сроки незавершённых задач пользователя с указанным названием."""
+
+    async def set_next_occurrences(self, rows: Sequence[Tuple[int, Optional[datetime]]]):
+        """Сохраняет ближайшие повторения задач: пары (id задачи, next_at)."""
+
+    async def update_task(self, name: str, users_tgteg: str, updates: Dict) -> int:
+        """Изменяет задачи с указанным названием. Возвращает число изменённых задач."""
+
+    async def update_tasks(self, names: Sequence[str], users_tgteg: str, updates: Dict) -> int:
+        """Изменяет задачи с указанными названиями. Возвращает число изменённых задач."""
+
+    async def move_overdue_tasks(self, users_tgteg: str, updates: Dict, now: datetime) -> int:
+        """Изменяет незавершённые неповторяющиеся задачи пользователя со сроком раньше now."""
+
+    async def delete_task(self, name: str, users_tgteg: str) -> int:
+        """Удаляет задачи с указанным названием. Возвращает число удалённых задач."""
+
+    async def archive_tasks(self, statuses: Sequence[str], before: datetime, after_id: int,
+                            limit: int) -> List[tuple]:
+        """Переносит пачку задач в архив. Возвращает кортежи (id, users_tgteg, name, prpgress)."""
+
+    async def select_archived_tasks(self, users_tgteg: str, before_id: Optional[int] = None,
+                                    limit: Optional[int] = None, after_id: Optional[int] = None) -> List[TaskRow]:
+        """Архивные задачи пользователя по убыванию id (см. crud.read_archived_tasks)."""
+
+    # --- Пользователи ---
+
+    async def create_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None):
+        """Добавляет пользователя; если он уже есть — ошибка."""
+
+    async def upsert_user(self, tgteg: str, name: Optional[str] = None, userscol: Optional[str] = None) -> bool:
+        """Добавляет пользователя, если его нет. True — пользователь создан."""
+
+    async def read_user_chat(self, tgteg: str) -> Optional[int]:
+        """id чата пользователя или None."""
+
+    async def read_users(self, tgteg: Optional[str] = None, limit: Optional[int] = None,
+                         after: Optional[str] = None) -> List[UserRow]:
+        """Пользователи (все или один) по возрастанию tgteg, с keyset-пагинацией (tgteg > after)."""
+
+    async def delete_user(self, tgteg: str):
+        """Удаляет пользователя вместе с его задачами."""
+
+    # --- Состояние и закрытие ---
+
+    def stats(self) -> Dict:
+        """Состояние хранилища для лога."""
+
+    def close(self):
+        """Начинает закрытие хранилища."""
+
+    async def wait_closed(self):
+        """Дожидается закрытия хранилища."""
+
+
+async def open_storage(backend: Optional[str] = None) -> Storage:
+    """
+    Открывает хранилище, которое передаётся в обработчики и функции crud как pool.
+
+    :param backend: "mysql", "sqlite" или "memory". По умолчанию берётся STORAGE_BACKEND из config.
+    :return: SQLStorage, SQLiteStorage или MemoryStorage.
+    :raises ValueError: Если хранилище неизвестно.
+    """
+    backend = backend or getattr(config, "STORAGE_BACKEND", "mysql")
+    if backend == "mysql":
+        from crud import connect_to_db
+        from sql_storage import SQLStorage
+        return SQLStorage(await connect_to_db())
+    if backend == "sqlite":
+        from sqlite_pool import open_sqlite_storage
+        return await open_sqlite_storage(getattr(config, "SQLITE_PATH", "bot.sqlite3"))
+    if backend == "memory":
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище {backend!r}, ожидается одно из: {', '.join(BACKENDS)}")
@@ -0,0 +1,313 @@
+import csv
+import json
+import logging
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import config
+import crud
+from recurrence import format_rule, parse_rule
+
+# Колонки файла импорта/экспорта задач; repeat — правило повтора в виде schedulecol (см. recurrence.py)
+FILE_COLUMNS = ["name", "time", "date", "progress", "repeat"]
+
+# Самое длинное название задачи (ширина колонки task.name, см. migrations.py)
+TASK_NAME_MAX_LENGTH = 255
+
+# Допустимые значения прогресса задачи (колонка prpgress)
+PROGRESS_VALUES = tuple(getattr(config, "TASK_PROGRESS_VALUES", ("Pending", "In Progress", "Completed")))
+
+# Сколько ошибок по строкам import_tasks возвращает (остальные только считаются) и длина текста одной ошибки
+IMPORT_MAX_ERRORS = 20
+IMPORT_ERROR_LIMIT = 200
+
+
+# Шаблоны разбираются один раз при импорте модуля; принимают то же, что strptime с "%d.%m.%y" и "%H:%M"
+_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{2})")
+_TIME_RE = re.compile(r"(\d{1,2}):(\d{1,2})")
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date(raw: str) -> str:
+    """
+    Преобразует дату 'ДД.ММ.ГГ' в формат базы 'YYYY-MM-DD'.
+    Год ГГ трактуется как в strptime: 00–68 — 2000-е, 69–99 — 1900-е.
+
+    :raises ValueError: Если дата не в формате 'ДД.ММ.ГГ' или такого дня нет.
+    """
+    match = _DATE_RE.fullmatch(raw)
+    if match is None:
+        raise ValueError(f"Неверный формат даты: {raw!r}")
+    day, month, year = int(match[1]), int(match[2]), int(match[3])
+    year += 2000 if year < 69 else 1900
+    if not 1 <= month <= 12 or not 1 <= day <= _DAYS_IN_MONTH[month] \
+            or (month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0))):
+        raise ValueError(f"Несуществующая дата: {raw!r}")
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def parse_time(raw: str) -> str:
+    """
+    Преобразует время 'ЧЧ:ММ' в формат базы 'HH:MM:SS'.
+
+    :raises ValueError: Если время не в формате 'ЧЧ:ММ'.
+    """
+    match = _TIME_RE.fullmatch(raw)
+    if match is None:
+        raise ValueError(f"Неверный формат времени: {raw!r}")
+    hour, minute = int(match[1]), int(match[2])
+    if hour > 23 or minute > 59:
+        raise ValueError(f"Несуществующее время: {raw!r}")
+    return f"{hour:02d}:{minute:02d}:00"
+
+
+def parse_task_name(raw: str) -> str:
+    """
+    Проверяет название задачи, введённое пользователем.
+
+    :return: Название без пробелов по краям.
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
+    name = raw.strip()
+    if not name:
+        raise ValueError("Ошибка: Не указано название задачи.")
+    if len(name) > TASK_NAME_MAX_LENGTH:
+        raise ValueError(f"Ошибка: Название задачи длиннее {TASK_NAME_MAX_LENGTH} символов.")
+    return name
+
+
+def parse_task_fields(name: str, time_raw: str, date_raw: str) -> Tuple[str, str, str]:
+    """
+    Проверяет и преобразует поля задачи, введённые пользователем.
+
+    :return: Кортеж (название, дата 'YYYY-MM-DD', время 'HH:MM:SS').
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
+    name = parse_task_name(name)
+    try:
+        return name, parse_date(date_raw.strip()), parse_time(time_raw.strip())
+    except ValueError:
+        raise ValueError("Ошибка: Неверный формат даты или времени. Ожидается 'ДД.ММ.ГГ' и 'ЧЧ:ММ'.") from None
+
+
+def parse_progress(raw: str) -> str:
+    """
+    Проверяет прогресс задачи, введённый пользователем; регистр не важен.
+
+    :return: Значение из PROGRESS_VALUES.
+    :raises ValueError: С текстом ошибки для пользователя.
+    """
+    value = raw.strip().lower()
+    for progress in PROGRESS_VALUES:
+        if progress.lower() == value:
+            return progress
+    raise ValueError(f"Ошибка: Неизвестный прогресс {raw.strip()!r}. Допустимо: {', '.join(PROGRESS_VALUES)}.")
+
+
+def as_date(value) -> Optional[date]:
+    """Приводит дату из базы (date, datetime или 'YYYY-MM-DD') к date."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def as_datetime(value) -> Optional[datetime]:
+    """Приводит момент из базы (datetime или 'YYYY-MM-DD HH:MM:SS') к datetime."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def as_time(value) -> Optional[time]:
+    """Приводит время из базы (time, timedelta — так MySQL отдаёт TIME — или 'HH:MM:SS') к time."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, time):
+        return value
+    if isinstance(value, timedelta):
+        return (datetime.min + value).time()
+    return time.fromisoformat(str(value))
+
+
+def iter_csv_records(path: str) -> Iterator[Tuple[int, List[str], Optional[str]]]:
+    """
+    Построчно читает CSV-файл с колонками name, time, date[, progress[, repeat]]. Строка заголовка пропускается.
+    Строка, которую не удалось разобрать (например, слишком длинное поле), не прерывает чтение.
+
+    :return: Тройки (номер строки, значения колонок, ошибка разбора строки или None).
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, [], f"строка не разобрана: {e}"
+                continue
+            if reader.line_num == 1 and [cell.strip().lower() for cell in row[:3]] == FILE_COLUMNS[:3]:
+                continue
+            if not any(cell.strip() for cell in row):
+                continue
+            yield reader.line_num, row, None
+
+
+def iter_json_records(path: str, chunk_size: int = 65536) -> Iterator[Tuple[int, List[str], Optional[str]]]:
+    """
+    Читает задачи из JSON-массива объектов или из JSON Lines, не загружая файл целиком.
+    Объект задачи: {"name": ..., "time": "ЧЧ:ММ", "date": "ДД.ММ.ГГ", "progress": ..., "repeat": "weekly:mon"}.
+
+    :return: Тройки (номер объекта, значения колонок в порядке FILE_COLUMNS, ошибка или None).
+    :raises ValueError: Если файл дальше не разбирается как JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    number = 0
+    with open(path, encoding="utf-8-sig") as f:
+        eof = False
+        while True:
+            # Пропускаем разделители между объектами: пробелы, запятые и скобки массива
+            buffer = buffer.lstrip(" \t\r\n,[]")
+            if not buffer:
+                if eof:
+                    return
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"Ошибка: Некорректный JSON после объекта {number}.")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            buffer = buffer[end:]
+            number += 1
+            if not isinstance(obj, dict):
+                yield number, [], "ожидается объект задачи"
+                continue
+            yield number, [str(obj.get(column) or "") for column in FILE_COLUMNS], None
+
+
+class IncompleteImport(ValueError):
+    """Файл импорта прочитан не до конца. Содержит итог import_tasks по прочитанной части."""
+
+    def __init__(self, message: str, accepted: int, rejected: int, errors: List[str]):
+        super().__init__(message)
+        self.accepted = accepted
+        self.rejected = rejected
+        self.errors = errors
+
+
+async def import_tasks(pool, path: str, user_tgteg: str, file_format: str = "csv",
+                       chunk_size: int = 500, max_errors: int = IMPORT_MAX_ERRORS) -> Tuple[int, int, List[str]]:
+    """
+    Импортирует задачи из файла. Строки проверяются по тем же правилам, что и в /add_task и /update_task,
+    и записываются пачками по chunk_size строк, каждая пачка — одной транзакцией.
+
+    Строки пачки, которую не удалось записать, считаются отклонёнными, и импорт продолжается.
+    Если файл дальше не читается, уже прочитанные строки записываются, а итог передаётся в IncompleteImport.
+
+    :param pool: Хранилище (storage.Storage).
+    :param path: Путь к файлу.
+    :param user_tgteg: Идентификатор пользователя, владельца задач.
+    :param file_format: "csv" или "json".
+    :param chunk_size: Размер пачки строк для одной транзакции.
+    :param max_errors: Сколько первых ошибок сохранить; память и текст ответа не растут с размером файла.
+    :return: Число добавленных задач, число отклонённых строк и ошибки первых max_errors из них.
+    :raises IncompleteImport: Если файл прочитан не до конца (с итогом по прочитанной части).
+    """
+    accepted = 0
+    rejected = 0
+    errors: List[str] = []
+    chunk: List[tuple] = []
+    chunk_start = chunk_end = 0  # Номера первой и последней строк пачки — для текста ошибки записи
+
+    def add_error(error: str):
+        if len(errors) < max_errors:
+            errors.append(error[:IMPORT_ERROR_LIMIT])
+
+    async def write_chunk():
+        nonlocal accepted, rejected
+        try:
+            await crud.create_tasks(pool, chunk)
+        except Exception as e:
+            # Пачка откатывается целиком (см. create_tasks); следующие пачки пишутся как обычно
+            logger.exception("Import chunk of %d tasks for %s failed", len(chunk), user_tgteg)
+            rejected += len(chunk)
+            add_error(f"{chunk_start}-{chunk_end}: не удалось записать {len(chunk)} строк: {e}")
+        else:
+            accepted += len(chunk)
+
+    records = iter_json_records(path) if file_format == "json" else iter_csv_records(path)
+    number = 0
+    try:
+        for number, values, error in records:
+            if error is None and len(values) < 3:
+                error = "ожидается name, time, date"
+            if error is None:
+                try:
+                    name, date_end, time_end = parse_task_fields(values[0], values[1], values[2])
+                    raw_progress = values[3].strip() if len(values) > 3 else ""
+                    progress = parse_progress(raw_progress) if raw_progress else "Pending"
+                    repeat = values[4].strip() if len(values) > 4 else ""
+                    schedulecol = format_rule(parse_rule(repeat)) if repeat else None
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                rejected += 1
+                add_error(f"{number}: {error}")
+                continue
+            if not chunk:
+                chunk_start = number
+            chunk_end = number
+            chunk.append((name, user_tgteg, date_end, time_end, progress, schedulecol))
+            if len(chunk) >= chunk_size:
+                await write_chunk()
+                chunk = []
+    except (ValueError, UnicodeDecodeError) as e:
+        # Файл дальше не читается: уже прочитанные строки записываются, остальные не считаются
+        if chunk:
+            await write_chunk()
+        raise IncompleteImport(f"после строки {number}: {e}", accepted, rejected, errors) from e
+    if chunk:
+        await write_chunk()
+    return accepted, rejected, errors
+
+
+async def export_tasks(pool, user_tgteg: str, path: str) -> int:
+    """
+    Записывает задачи пользователя в CSV-файл в формате, пригодном для /import_tasks.
+    Задачи читаются из базы страницами и сразу пишутся в файл.
+
+    :return: Число выгруженных задач.
+    """
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(FILE_COLUMNS)
+        async for task in crud.iter_tasks(pool, user_tgteg):
+            day = as_date(task.date_end)
+            moment = as_time(task.time_end)
+            writer.writerow([
+                task.name,
+                moment.strftime("%H:%M") if moment else "",
+                day.strftime("%d.%m.%y") if day else "",
+                task.prpgress or "",
+                task.schedulecol or "",
+            ])
+            count += 1
+    return count
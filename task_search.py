@@ -0,0 +1,249 @@
+"""
+Поиск задач по названию: /find и исправление опечаток в названии задачи для /update_task.
+
+Для каждого пользователя в памяти строится индекс триграмм его названий задач: триграмма -> названия,
+в которых она встречается. Индекс строится при первом поиске одним запросом по индексу
+(users_tgteg, name) — без LIKE '%...%' по таблице — и дальше обновляется по событиям
+crud.task_listeners. Индексы пользователей, которые давно не искали, вытесняются.
+
+Поиск по подстроке проверяет только названия, содержащие все триграммы запроса; нечёткий поиск
+ранжирует названия по доле общих триграмм (коэффициент Дайса).
+"""
+import logging
+from collections import Counter
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import crud
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Минимальное сходство, при котором название предлагается как похожее
+SUGGEST_THRESHOLD = 0.3
+# Минимальное сходство, при котором опечатка исправляется автоматически
+RESOLVE_THRESHOLD = 0.5
+
+
+def normalize(text: str) -> str:
+    """Приводит название к виду для сравнения: нижний регистр, 'ё' -> 'е', одиночные пробелы."""
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """Триграммы нормализованной строки; начало и конец дополняются пробелами, как в pg_trgm."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _inner_trigrams(text: str) -> Set[str]:
+    """Триграммы без дополнения: они входят в trigrams() любого названия, содержащего text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class UserIndex:
+    """Индекс триграмм названий задач одного пользователя."""
+
+    __slots__ = ("names", "normalized", "sizes", "postings")
+
+    def __init__(self, names: List[str]):
+        self.names: Counter = Counter()  # Название -> число задач с таким названием
+        self.normalized: Dict[str, str] = {}
+        self.sizes: Dict[str, int] = {}  # Название -> число его триграмм (с дополнением)
+        self.postings: Dict[str, Set[str]] = {}  # Триграмма -> названия
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        self.names[name] += 1
+        if self.names[name] > 1:
+            return
+        text = normalize(name)
+        grams = trigrams(text)
+        self.normalized[name] = text
+        self.sizes[name] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        """Удаляет все задачи с этим названием (как DELETE ... WHERE name = ...)."""
+        if self.names.pop(name, None) is None:
+            return
+        text = self.normalized.pop(name)
+        del self.sizes[name]
+        for gram in trigrams(text):
+            names = self.postings[gram]
+            names.discard(name)
+            if not names:
+                del self.postings[gram]
+
+    def discard(self, name: str, count: int):
+        """Убирает count задач с этим названием; название остаётся, пока есть другие задачи с ним."""
+        if self.names.get(name, 0) > count:
+            self.names[name] -= count
+        else:
+            self.remove(name)
+
+    def rename(self, old: str, new: str):
+        count = self.names.get(old, 0)
+        if not count or old == new:
+            return
+        self.remove(old)
+        for _ in range(count):
+            self.add(new)
+
+    def _similarity(self, name: str, grams: Set[str]) -> float:
+        common = sum(1 for gram in grams if name in self.postings.get(gram, ()))
+        return 2 * common / (len(grams) + self.sizes[name])
+
+    def _candidates(self, text: str):
+        """Названия, которые могут содержать нормализованную строку text: в них есть все её триграммы."""
+        inner = _inner_trigrams(text)
+        if inner:
+            return set.intersection(*(self.postings.get(gram, set()) for gram in inner))
+        return self.normalized.keys()  # Запрос короче триграммы — названий у пользователя немного
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        Ищет названия, содержащие query, а если таких меньше limit — ещё и похожие на query.
+
+        :return: Пары (название, сходство): сначала совпадения по подстроке (сходство 1.0 — точное
+                 совпадение), затем похожие названия по убыванию сходства.
+        """
+        text = normalize(query)
+        if not text:
+            return []
+        grams = trigrams(text)
+        found = []
+        for name in self._candidates(text):
+            if text in self.normalized[name]:
+                score = 1.0 if self.normalized[name] == text else self._similarity(name, grams)
+                found.append((name, score))
+        found.sort(key=lambda item: (not self.normalized[item[0]].startswith(text), -item[1], item[0]))
+        if len(found) >= limit:
+            return found[:limit]
+
+        matched = {name for name, _ in found}
+        common: Counter = Counter()
+        for gram in grams:
+            for name in self.postings.get(gram, ()):
+                if name not in matched:
+                    common[name] += 1
+        similar = []
+        for name, shared in common.items():
+            score = 2 * shared / (len(grams) + self.sizes[name])
+            if score >= SUGGEST_THRESHOLD:
+                similar.append((name, score))
+        similar.sort(key=lambda item: (-item[1], item[0]))
+        return found + similar[:limit - len(found)]
+
+
+class TaskSearch:
+    """
+    Индексы названий задач по пользователям, обновляемые по изменениям задач.
+
+    Индексы хранятся для max_users пользователей; индекс пользователя, который не искал
+    idle_ttl секунд, вытесняется и будет построен заново при следующем поиске. Построение,
+    во время которого задачи пользователя изменились, в кэш не попадает — как в TaskStats.
+    """
+
+    def __init__(self, pool, max_users: int = 1000, idle_ttl: Optional[float] = 1800):
+        """
+        :param pool: Пул соединений с базой данных.
+        :param max_users: Для скольких пользователей держать индексы в памяти.
+        :param idle_ttl: (опционально) Через сколько секунд без поиска вытеснять индекс. None — не вытеснять.
+        """
+        self._pool = pool
+        self._users = LRUCache(maxsize=max_users, ttl=idle_ttl)
+        self._clock = 0  # Счётчик изменений задач
+        self._inflight = 0  # Сколько построений индекса сейчас выполняется
+        self._changed: Dict[Hashable, int] = {}  # Пользователь -> момент последнего изменения
+        self.builds = 0
+        self.searches = 0
+
+    def start(self):
+        """Подписывается на изменения задач."""
+        crud.task_listeners.append(self.on_task_change)
+
+    async def stop(self):
+        if self.on_task_change in crud.task_listeners:
+            crud.task_listeners.remove(self.on_task_change)
+
+    def on_task_change(self, event: str, users_tgteg: str, name: Optional[str], fields: Dict):
+        """Подписчик crud.task_listeners: обновляет индекс пользователя, если он построен."""
+        self._clock += 1
+        if self._inflight:
+            self._changed[users_tgteg] = self._clock
+        if users_tgteg not in self._users:
+            return
+        # get() не продлевает время жизни: изменения задач не считаются использованием индекса
+        index = self._users.get(users_tgteg)
+        if index is None:
+            return
+        if event == "create":
+            index.add(name)
+        elif event == "update":
+            if "name" in fields:
+                index.rename(name, fields["name"])
+        elif event == "delete":
+            if name is None:
+                self._users.pop(users_tgteg)
+            else:
+                index.remove(name)
+        elif event == "archive":
+            index.discard(name, fields["count"])
+
+    async def _index(self, users_tgteg: str) -> UserIndex:
+        index = self._users.get(users_tgteg)
+        if index is None:
+            self._inflight += 1
+            started = self._clock
+            try:
+                names = await crud.read_task_names(self._pool, users_tgteg)
+            finally:
+                self._inflight -= 1
+                fresh = self._changed.get(users_tgteg, 0) <= started
+                if self._inflight == 0:
+                    self._changed.clear()
+            self.builds += 1
+            index = UserIndex(names)
+            if not fresh:
+                return index
+        # Повторный set() продлевает время жизни: индекс вытесняется, только если им давно не пользовались
+        self._users.set(users_tgteg, index)
+        return index
+
+    async def search(self, users_tgteg: str, query: str, limit: int = 10) -> List[str]:
+        """Возвращает до limit названий задач пользователя, содержащих query или похожих на него."""
+        self.searches += 1
+        index = await self._index(users_tgteg)
+        return [name for name, _ in index.search(query, limit)]
+
+    async def resolve(self, users_tgteg: str, name: str, limit: int = 5) -> Tuple[Optional[str], List[str]]:
+        """
+        Находит задачу по названию, введённому пользователем, с точностью до регистра и опечаток.
+
+        :return: (название задачи или None, похожие названия). Название возвращается, если оно
+                 совпадает точно или однозначно определяется по введённому тексту.
+        """
+        index = await self._index(users_tgteg)
+        if name in index.names:
+            return name, []
+        found = index.search(name, limit)
+        if not found:
+            return None, []
+        text = normalize(name)
+        exact = [candidate for candidate, _ in found if index.normalized[candidate] == text]
+        if len(exact) == 1:
+            return exact[0], []
+        containing = [candidate for candidate, _ in found if text in index.normalized[candidate]]
+        if len(containing) == 1:
+            return containing[0], []
+        if not containing:
+            # Опечатка: исправляем, только если самое похожее название похоже сильнее остальных
+            runner_up = found[1][1] if len(found) > 1 else 0.0
+            if found[0][1] >= RESOLVE_THRESHOLD and found[0][1] > runner_up:
+                return found[0][0], []
+        return None, [candidate for candidate, _ in found]
+
+    def stats(self) -> Dict:
+        return {"users": len(self._users), "builds": self.builds, "searches": self.searches}
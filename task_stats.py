@@ -0,0 +1,398 @@
+"""
+Статистика задач пользователей для /stats и ежедневной сводки.
+
+Для пользователя один раз читаются название, прогресс и дата срока каждой задачи, дальше счётчики
+обновляются по событиям crud.task_listeners (create_task, update_task, update_tasks, delete_task ...),
+без запросов к базе. Чтение статистики — O(1): число задач по прогрессу, просроченные
+(незавершённые с датой срока раньше сегодняшней) и задачи со сроком сегодня.
+Повторяющиеся задачи (см. recurrence.py) не бывают просроченными и учитываются в задачах на сегодня,
+если у них есть повторение сегодня; для них чтение стоит O(число различных правил пользователя).
+
+Периодическая сверка и ежедневная сводка не читают задачи по одной: счётчики строятся из числа задач
+по группам (пользователь, прогресс, дата срока, правило) — один запрос GROUP BY на пачку пользователей
+(см. crud.read_task_groups и UserStats.from_groups). Сводка берёт готовые счётчики из кэша TaskStats
+и запрашивает группы только для пользователей, которых в кэше нет.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import crud
+from cache import LRUCache
+from queries import TaskGroupRow, TaskStateRow
+from recurrence import occurs_on, parse_rule
+from task_format import as_date
+
+logger = logging.getLogger(__name__)
+
+COMPLETED = "Completed"
+DEFAULT_PROGRESS = "Pending"  # Значение колонки prpgress по умолчанию (см. migrations.py)
+RECONCILE_BATCH = 500  # Сколько пользователей сверять одним запросом
+DIGEST_BATCH = 500  # Сколько пользователей читать за раз при отправке сводки
+
+
+class UserStats:
+    """Счётчики задач одного пользователя."""
+
+    __slots__ = ("tasks", "by_status", "open_by_day", "open_recurring", "total", "overdue", "as_of")
+
+    def __init__(self, rows: List[TaskStateRow], today: date):
+        # Название -> [(прогресс, дата срока, правило повтора)]
+        self.tasks: Dict[str, List[Tuple[str, Optional[date], Optional[str]]]] = {}
+        self.by_status: Counter = Counter()
+        self.open_by_day: Dict[date, int] = {}  # Дата срока -> число незавершённых задач
+        self.open_recurring: Counter = Counter()  # (правило, первый срок) -> число незавершённых задач
+        self.total = 0
+        self.overdue = 0  # Незавершённые задачи с датой срока раньше as_of
+        self.as_of = today
+        for row in rows:
+            self.add(row.name, row.prpgress, as_date(row.date_end), row.schedulecol)
+
+    @classmethod
+    def from_groups(cls, groups: Iterable[TaskGroupRow], today: date) -> "UserStats":
+        """
+        Счётчики из строк crud.read_task_groups одного пользователя. Названий задач в них нет,
+        поэтому такие счётчики годятся для snapshot и same_counts, но не для обновления по событиям.
+        """
+        stats = cls([], today)
+        for group in groups:
+            stats._count(group.prpgress or DEFAULT_PROGRESS, as_date(group.date_end), group.schedulecol, group.tasks)
+        return stats
+
+    def _count(self, status: str, day: Optional[date], rule: Optional[str], delta: int):
+        self.total += delta
+        self.by_status[status] += delta
+        if not self.by_status[status]:
+            del self.by_status[status]
+        if status == COMPLETED or day is None:
+            return
+        if rule:
+            self.open_recurring[(rule, day)] += delta
+            if not self.open_recurring[(rule, day)]:
+                del self.open_recurring[(rule, day)]
+            return
+        remaining = self.open_by_day.get(day, 0) + delta
+        if remaining:
+            self.open_by_day[day] = remaining
+        else:
+            self.open_by_day.pop(day, None)
+        if day < self.as_of:
+            self.overdue += delta
+
+    def add(self, name: str, status: Optional[str], day: Optional[date], rule: Optional[str] = None):
+        status = status or DEFAULT_PROGRESS
+        self.tasks.setdefault(name, []).append((status, day, rule))
+        self._count(status, day, rule, 1)
+
+    def remove(self, name: str):
+        for status, day, rule in self.tasks.pop(name, ()):
+            self._count(status, day, rule, -1)
+
+    def discard(self, name: str, status: str, count: int):
+        """Убирает count задач с этим названием и прогрессом (перенесённых в архив)."""
+        kept = []
+        for task in self.tasks.pop(name, ()):
+            if count and task[0] == status:
+                count -= 1
+                self._count(*task, -1)
+            else:
+                kept.append(task)
+        if kept:
+            self.tasks[name] = kept
+
+    def update(self, name: str, fields: Dict):
+        """Применяет изменение полей ко всем задачам с этим названием (как UPDATE ... WHERE name = ...)."""
+        old = self.tasks.get(name)
+        if not old:
+            return
+        self.remove(name)
+        new_name = fields.get("name", name)
+        for status, day, rule in old:
+            if "date_end" in fields:
+                day = as_date(fields["date_end"])
+            self.add(new_name, fields.get("prpgress", status), day, fields.get("schedulecol", rule))
+
+    def advance(self, today: date):
+        """Переносит границу просрочки на новый день: задачи со сроком в прошедшие дни становятся просроченными."""
+        if today <= self.as_of:
+            return
+        if (today - self.as_of).days > len(self.open_by_day):
+            # Пользователь давно не обращался — дешевле пересчитать по датам, чем идти по дням
+            self.overdue = sum(count for day, count in self.open_by_day.items() if day < today)
+        else:
+            day = self.as_of
+            while day < today:
+                self.overdue += self.open_by_day.get(day, 0)
+                day += timedelta(days=1)
+        self.as_of = today
+
+    def snapshot(self, today: date) -> Dict:
+        self.advance(today)
+        return {
+            "total": self.total,
+            "by_status": dict(self.by_status),
+            "overdue": self.overdue,
+            "due_today": self.open_by_day.get(today, 0) + self._recurring_on(today),
+        }
+
+    def _recurring_on(self, today: date) -> int:
+        count = 0
+        for (rule, anchor), tasks in self.open_recurring.items():
+            try:
+                if occurs_on(parse_rule(rule), anchor, today):
+                    count += tasks
+            except ValueError:
+                continue
+        return count
+
+    def same_counts(self, other: "UserStats") -> bool:
+        return (self.by_status == other.by_status and self.open_by_day == other.open_by_day
+                and self.open_recurring == other.open_recurring)
+
+
+class TaskStats:
+    """
+    Статистика задач по пользователям, обновляемая по изменениям задач.
+
+    Счётчики хранятся для max_users недавно запрошенных пользователей (LRU); остальные
+    загружаются из базы при первом запросе. Загрузка, во время которой задачи пользователя
+    изменились, в кэш не попадает — как в TaskListCache.
+    """
+
+    def __init__(self, pool, max_users: int = 10000, reconcile_interval: Optional[float] = 3600):
+        """
+        :param pool: Пул соединений с базой данных.
+        :param max_users: Для скольких пользователей держать счётчики в памяти.
+        :param reconcile_interval: (опционально) Период сверки счётчиков с базой, сек. None — без сверки.
+        """
+        self._pool = pool
+        self._users = LRUCache(maxsize=max_users)
+        self.reconcile_interval = reconcile_interval
+        self._clock = 0  # Счётчик изменений задач
+        self._inflight = 0  # Сколько загрузок из базы сейчас выполняется
+        self._changed: Dict[Hashable, int] = {}  # Пользователь -> момент последнего изменения
+        self._task: Optional[asyncio.Task] = None
+        self.loads = 0
+        self.corrections = 0  # Сколько раз сверка нашла расхождение
+
+    def start(self):
+        """Подписывается на изменения задач и запускает периодическую сверку."""
+        crud.task_listeners.append(self.on_task_change)
+        if self.reconcile_interval:
+            self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def stop(self):
+        if self.on_task_change in crud.task_listeners:
+            crud.task_listeners.remove(self.on_task_change)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def on_task_change(self, event: str, users_tgteg: str, name: Optional[str], fields: Dict):
+        """Подписчик crud.task_listeners: обновляет счётчики пользователя."""
+        self._clock += 1
+        if self._inflight:
+            self._changed[users_tgteg] = self._clock
+        if users_tgteg not in self._users:
+            return  # Счётчики не загружены — будут прочитаны из базы при запросе
+        entry = self._users.get(users_tgteg)
+        if name is None and event in ("update", "delete"):
+            # Изменены или удалены сразу несколько задач — счётчики будут перечитаны из базы
+            self._users.pop(users_tgteg)
+        elif event == "create":
+            entry.add(name, fields.get("prpgress"), as_date(fields.get("date_end")), fields.get("schedulecol"))
+        elif event == "update":
+            entry.update(name, fields)
+        elif event == "delete":
+            entry.remove(name)
+        elif event == "archive":
+            entry.discard(name, fields["prpgress"], fields["count"])
+
+    async def get(self, users_tgteg: str, today: Optional[date] = None) -> Dict:
+        """
+        Возвращает статистику пользователя.
+
+        :return: Словарь с total, by_status (прогресс -> число задач), overdue и due_today.
+        """
+        today = today or date.today()
+        entry = self._users.get(users_tgteg)
+        if entry is None:
+            entry = await self._load(users_tgteg, today)
+        return entry.snapshot(today)
+
+    async def get_many(self, users: List[str], today: Optional[date] = None) -> Dict[str, Dict]:
+        """
+        Возвращает статистику нескольких пользователей: загруженные берутся из счётчиков без запросов,
+        для остальных выполняется один запрос GROUP BY. Порядок вытеснения кэша не меняется,
+        и прочитанные из базы счётчики в кэш не попадают.
+
+        :return: Словарь users_tgteg -> статистика (как у get).
+        """
+        today = today or date.today()
+        result: Dict[str, Dict] = {}
+        missing = []
+        for users_tgteg in users:
+            entry = self._users.peek(users_tgteg)
+            if entry is None:
+                missing.append(users_tgteg)
+            else:
+                result[users_tgteg] = entry.snapshot(today)
+        if missing:
+            groups: Dict[str, List[TaskGroupRow]] = {}
+            for row in await crud.read_task_groups(self._pool, missing):
+                groups.setdefault(row.users_tgteg, []).append(row)
+            for users_tgteg in missing:
+                result[users_tgteg] = UserStats.from_groups(groups.get(users_tgteg, ()), today).snapshot(today)
+        return result
+
+    async def _load(self, users_tgteg: str, today: date) -> UserStats:
+        self._inflight += 1
+        started = self._clock
+        try:
+            rows = await crud.read_task_states(self._pool, users_tgteg)
+        finally:
+            self._inflight -= 1
+            fresh = self._changed.get(users_tgteg, 0) <= started
+            if self._inflight == 0:
+                self._changed.clear()
+        self.loads += 1
+        entry = UserStats(rows, today)
+        if fresh:
+            self._users.set(users_tgteg, entry)
+        return entry
+
+    async def reconcile(self) -> int:
+        """
+        Сверяет счётчики загруженных пользователей с базой: по одному запросу GROUP BY на RECONCILE_BATCH
+        пользователей. Разошедшиеся счётчики выбрасываются из кэша и будут перечитаны при следующем запросе.
+        Пользователи, чьи задачи изменились во время запроса, пропускаются до следующей сверки.
+
+        :return: Число пользователей, у которых счётчики разошлись с базой.
+        """
+        corrected = 0
+        today = date.today()
+        users = list(self._users.keys())
+        for start in range(0, len(users), RECONCILE_BATCH):
+            batch = users[start:start + RECONCILE_BATCH]
+            self._inflight += 1
+            started = self._clock
+            try:
+                rows = await crud.read_task_groups(self._pool, batch)
+            finally:
+                self._inflight -= 1
+                changed = {user for user, clock in self._changed.items() if clock > started}
+                if self._inflight == 0:
+                    self._changed.clear()
+            groups: Dict[str, List[TaskGroupRow]] = {}
+            for row in rows:
+                groups.setdefault(row.users_tgteg, []).append(row)
+            for users_tgteg in batch:
+                old = self._users.get(users_tgteg)
+                if old is None or users_tgteg in changed:
+                    continue
+                if not old.same_counts(UserStats.from_groups(groups.get(users_tgteg, ()), today)):
+                    self._users.pop(users_tgteg)
+                    corrected += 1
+        self.corrections += corrected
+        return corrected
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                corrected = await self.reconcile()
+            except Exception:
+                logger.exception("Не удалось сверить статистику задач")
+                continue
+            if corrected:
+                logger.warning("Сверка статистики: исправлены счётчики %d пользователей", corrected)
+
+    def stats(self) -> Dict:
+        return {"users": len(self._users), "loads": self.loads, "corrections": self.corrections}
+
+
+def format_stats(stats: Dict) -> str:
+    """Форматирует статистику пользователя для вывода."""
+    lines = [f"Всего задач: {stats['total']}"]
+    lines += [f"{status}: {count}" for status, count in sorted(stats["by_status"].items())]
+    lines.append(f"Просрочено: {stats['overdue']}")
+    lines.append(f"Срок сегодня: {stats['due_today']}")
+    return "\n".join(lines)
+
+
+class DailyDigest:
+    """
+    Ежедневная сводка: в заданное время каждому пользователю с незакрытыми задачами приходит его статистика.
+    Пользователи читаются пачками по batch_size (keyset по tgteg), статистика пачки берётся
+    из TaskStats.get_many: счётчики из кэша и один запрос GROUP BY только для пользователей не из кэша.
+    """
+
+    def __init__(self, pool, stats: TaskStats, send: Callable[[int, str], Awaitable[None]],
+                 at: dtime = dtime(9, 0), batch_size: int = DIGEST_BATCH):
+        """
+        :param pool: Хранилище (storage.Storage).
+        :param stats: Статистика задач, счётчики которой используются для сводки.
+        :param send: Корутина отправки сообщения: send(chat_id, text).
+        :param at: Время отправки сводки (местное).
+        :param batch_size: Сколько пользователей читать за раз.
+        """
+        self._pool = pool
+        self._stats = stats
+        self._send = send
+        self.at = at
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def send_all(self, today: Optional[date] = None) -> int:
+        """Отправляет сводку всем пользователям, у которых есть просроченные задачи или задачи на сегодня."""
+        today = today or date.today()
+        sent = 0
+        after = None
+        while True:
+            users = await crud.read_users(self._pool, limit=self.batch_size, after=after)
+            if not users:
+                break
+            after = users[-1].tgteg
+            chats: Dict[str, int] = {}
+            for user in users:
+                try:
+                    chats[user.tgteg] = int(user.userscol)
+                except (TypeError, ValueError):
+                    continue
+            batch = await self._stats.get_many(list(chats), today) if chats else {}
+            for users_tgteg, stats in batch.items():
+                if not stats["overdue"] and not stats["due_today"]:
+                    continue
+                try:
+                    await self._send(chats[users_tgteg], "Сводка по задачам\n" + format_stats(stats))
+                    sent += 1
+                except Exception:
+                    logger.exception("Не удалось отправить сводку пользователю %s", users_tgteg)
+            if len(users) < self.batch_size:
+                break
+        self.sent += sent
+        return sent
+
+    async def _run(self):
+        while True:
+            now = datetime.now()
+            next_run = datetime.combine(now.date(), self.at)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            try:
+                await self.send_all()
+            except Exception:
+                logger.exception("Не удалось отправить ежедневную сводку")
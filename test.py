@@ -1,13 +1,15 @@
+import asyncio
 import unittest
 from unittest.mock import AsyncMock, MagicMock
 import aiomysql
 from crud import *  # Измените 'your_module' на правильное имя вашего модуля
+from memory_storage import MemoryStorage
 
 class TestCreateTask(unittest.TestCase):
 
     def setUp(self):
         self.pool = MagicMock()
-        self.db = connect_to_db()  # Пул соединений
+        self.db = MemoryStorage()  # Хранилище в памяти: для тестов не нужен сервер MySQL
         self.name = "Task 1"
         self.users_tgteg = "user1"
         self.date_end = "2024-12-16"
@@ -43,7 +45,7 @@ class TestReadTasks(unittest.TestCase):
 
     def setUp(self):
         self.pool = MagicMock()
-        self.db = connect_to_db()  # Пул соединений
+        self.db = MemoryStorage()  # Хранилище в памяти: для тестов не нужен сервер MySQL
         self.users_tgteg = "user1"
 
     async def test_read_tasks_no_filter(self):
@@ -54,7 +56,7 @@ class TestReadTasks(unittest.TestCase):
         result = await read_tasks(self.pool)
 
         self.assertEqual(result, [{'id': 1, 'name': 'Task 1'}])
-        self.pool.acquire().cursor().execute.assert_called_once_with("SELECT * FROM task", [])
+        self.pool.acquire().cursor().execute.assert_called_once_with(f"SELECT {TASK_COLUMNS} FROM task ORDER BY id", [])
         self.pool.acquire().commit.assert_not_called()
 
     async def test_read_tasks_with_filter(self):
@@ -65,7 +67,7 @@ class TestReadTasks(unittest.TestCase):
         result = await read_tasks(self.pool, self.users_tgteg)
 
         self.assertEqual(result, [{'id': 1, 'name': 'Task 1'}])
-        self.pool.acquire().cursor().execute.assert_called_once_with("SELECT * FROM task WHERE users_tgteg = %s", [self.users_tgteg])
+        self.pool.acquire().cursor().execute.assert_called_once_with(f"SELECT {TASK_COLUMNS} FROM task WHERE users_tgteg = %s ORDER BY id", [self.users_tgteg])
         self.pool.acquire().commit.assert_not_called()
 
 # Additional tests for `update_task`, `delete_task`, `create_user`, `read_users`, and `delete_user`
@@ -75,7 +77,7 @@ class TestUpdateTask(unittest.TestCase):
 
     def setUp(self):
         self.pool = MagicMock()
-        self.db = connect_to_db()  # Пул соединений
+        self.db = MemoryStorage()  # Хранилище в памяти: для тестов не нужен сервер MySQL
         self.name = "Task 1"
         self.users_tgteg = "user1"
         self.updates = {"prpgress": "Completed"}
@@ -106,7 +108,7 @@ class TestUpdateTask(unittest.TestCase):
 
     def setUp(self):
         self.pool = MagicMock()
-        self.db = connect_to_db()  # Пул соединений
+        self.db = MemoryStorage()  # Хранилище в памяти: для тестов не нужен сервер MySQL
         self.name = "Task 1"
         self.users_tgteg = "user1"
         self.updates = {"prpgress": "Completed"}
@@ -138,7 +140,7 @@ class TestUserFunctions(unittest.TestCase):
 
     def setUp(self):
         self.pool = MagicMock()
-        self.db = connect_to_db()  # Пул соединений
+        self.db = MemoryStorage()  # Хранилище в памяти: для тестов не нужен сервер MySQL
         self.tgteg = "user1"
         self.name = "John Doe"
 
@@ -193,3 +195,1409 @@ class TestUserFunctions(unittest.TestCase):
             await delete_user(self.pool, "nonexistent_user")
 
 # Additional tests can be added similarly.
+
+
+class TestTimedPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_acquire_records_wait(self):
+        from db_pool import TimedPool
+
+        raw_pool = MagicMock()
+        raw_pool.acquire = AsyncMock(return_value="conn")
+        raw_pool.release = AsyncMock()
+        raw_pool.size, raw_pool.freesize, raw_pool.minsize, raw_pool.maxsize = 2, 1, 1, 10
+        pool = TimedPool(raw_pool)
+
+        async with pool.acquire() as conn:
+            self.assertEqual(conn, "conn")
+
+        raw_pool.release.assert_awaited_once_with("conn")
+        stats = pool.stats()
+        self.assertEqual(stats["acquire_count"], 1)
+        self.assertEqual(stats["used"], 1)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        from cache import LRUCache
+
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expired_entry_is_miss(self):
+        from cache import LRUCache
+
+        cache = LRUCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+class TestBatchWriter(unittest.IsolatedAsyncioTestCase):
+
+    async def test_flushes_when_full(self):
+        from batch_writer import BatchWriter
+
+        flush = AsyncMock()
+        writer = BatchWriter(flush, max_rows=2, max_delay=10)
+
+        await asyncio.gather(writer.submit((1,)), writer.submit((2,)))
+
+        flush.assert_awaited_once_with([(1,), (2,)])
+
+    async def test_failed_row_does_not_fail_others(self):
+        from batch_writer import BatchWriter
+
+        async def flush(rows):
+            if (2,) in rows:
+                raise ValueError("bad row")
+
+        writer = BatchWriter(flush, max_rows=10, max_delay=0.01)
+        results = await asyncio.gather(writer.submit((1,)), writer.submit((2,)), return_exceptions=True)
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], ValueError)
+
+    async def test_close_flushes_buffer(self):
+        from batch_writer import BatchWriter
+
+        flush = AsyncMock()
+        writer = BatchWriter(flush, max_rows=10, max_delay=10)
+        pending = asyncio.ensure_future(writer.submit((1,)))
+        await asyncio.sleep(0)
+
+        await writer.close()
+        await pending
+
+        flush.assert_awaited_once_with([(1,)])
+
+
+class TestViewTasksPage(unittest.IsolatedAsyncioTestCase):
+
+    async def test_first_page_has_next_button(self):
+        import hendlers
+        from unittest.mock import patch
+
+        rows = [TaskRow(i, f"Task {i}", "user1", None, None, "Pending", None) for i in range(1, 4)]
+        with patch.object(hendlers.config, "TASKS_PAGE_SIZE", 2, create=True), \
+                patch.object(hendlers, "read_tasks", AsyncMock(return_value=rows)):
+            text, keyboard = await hendlers.view_tasks_page(MagicMock(), "user1")
+
+        self.assertEqual(text.count("\n"), 1)
+        buttons = keyboard.inline_keyboard[0]
+        self.assertEqual(len(buttons), 1)
+        self.assertEqual(buttons[0].callback_data, hendlers.TaskPage(direction="next", cursor=2).pack())
+
+
+class TestTaskListCache(unittest.TestCase):
+
+    def test_invalidate_drops_user_pages(self):
+        from cache import TaskListCache
+
+        cache = TaskListCache(max_rows=10)
+        cache.finish("user1", "page1", [1, 2], cache.begin())
+        self.assertEqual(cache.get("user1", "page1"), [1, 2])
+
+        cache.invalidate("user1")
+
+        self.assertIsNone(cache.get("user1", "page1"))
+
+    def test_read_started_before_write_is_not_cached(self):
+        from cache import TaskListCache
+
+        cache = TaskListCache(max_rows=10)
+        started = cache.begin()
+        cache.invalidate("user1")
+        cache.finish("user1", "page1", [1], started)
+
+        self.assertIsNone(cache.get("user1", "page1"))
+
+    def test_evicts_by_row_count(self):
+        from cache import TaskListCache
+
+        cache = TaskListCache(max_rows=3)
+        cache.finish("user1", "page1", [1, 2], cache.begin())
+        cache.finish("user2", "page1", [1, 2], cache.begin())
+
+        self.assertIsNone(cache.get("user1", "page1"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class TestReminderScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_fires_due_reminder_and_skips_deleted(self):
+        import time as _time
+        from datetime import datetime as _datetime
+        from unittest.mock import patch
+        import reminders
+
+        sent = []
+
+        async def send(chat, text):
+            sent.append((chat, text))
+
+        soon = _datetime.fromtimestamp(_time.time() + 0.05)
+        with patch.object(reminders.crud, "read_deadlines", AsyncMock(return_value=[])):
+            scheduler = reminders.ReminderScheduler(MagicMock(), send, window=60, state_file=None)
+            await scheduler.start()
+            await asyncio.sleep(0)
+            scheduler.schedule(1, "user1", "Task 1", soon, chat=1)
+            scheduler.schedule(2, "user1", "Task 2", soon, chat=1)
+            scheduler.on_task_change("delete", "user1", "Task 2", {})
+            await asyncio.sleep(0.2)
+            await scheduler.stop()
+
+        self.assertEqual(len(sent), 1)
+        self.assertIn("Task 1", sent[0][1])
+
+
+class TestWebhook(unittest.IsolatedAsyncioTestCase):
+
+    async def test_post_update_is_acknowledged_and_processed(self):
+        from aiohttp.test_utils import TestClient, TestServer
+        from webhook import create_app
+
+        dispatcher = MagicMock(workflow_data={})
+        dispatcher.emit_startup = AsyncMock()
+        dispatcher.emit_shutdown = AsyncMock()
+        dispatcher.feed_raw_update = AsyncMock()
+        bot = MagicMock()
+        bot.session.close = AsyncMock()
+        update = {"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"},
+                                              "text": "/view_task"}}
+
+        async with TestClient(TestServer(create_app(dispatcher, bot, secret_token="s"))) as client:
+            rejected = await client.post("/webhook", json=update)
+            response = await client.post("/webhook", json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "s"})
+            await client.app["webhook_handler"].drain()
+
+        self.assertEqual(rejected.status, 401)
+        self.assertEqual(response.status, 200)
+        dispatcher.feed_raw_update.assert_awaited_once_with(bot, update)
+
+
+def make_pool(fetchall=None):
+    """Пул-заглушка: pool.acquire() и conn.cursor() работают как асинхронные контекстные менеджеры."""
+    cur = MagicMock()
+    cur.execute = AsyncMock()
+    cur.fetchall = AsyncMock(return_value=fetchall or [])
+    conn = MagicMock()
+    conn.cursor.return_value.__aenter__ = AsyncMock(return_value=cur)
+    conn.cursor.return_value.__aexit__ = AsyncMock(return_value=False)
+    conn.commit = AsyncMock()
+    pool = MagicMock()
+    pool.acquire.return_value.__aenter__ = AsyncMock(return_value=conn)
+    pool.acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+    return pool, conn, cur
+
+
+class TestCheckSchema(unittest.IsolatedAsyncioTestCase):
+
+    async def test_all_indexes_present(self):
+        from migrations import check_schema
+
+        pool, _, _ = make_pool([
+            ("users", "PRIMARY", 0, "tgteg"),
+            ("task", "idx_task_user_name", 1, "users_tgteg"),
+            ("task", "idx_task_user_name", 1, "name"),
+            ("task", "idx_task_deadline", 1, "deadline"),
+            ("task", "idx_task_next", 1, "next_at"),
+            ("task", "idx_task_progress", 1, "prpgress"),
+            ("task", "idx_task_progress", 1, "id"),
+            ("task_archive", "idx_archive_user", 1, "users_tgteg"),
+            ("task_archive", "idx_archive_user", 1, "id"),
+        ])
+
+        await check_schema(pool)
+
+    async def test_missing_index_fails(self):
+        from migrations import SchemaError, check_schema
+
+        pool, _, _ = make_pool([
+            ("users", "PRIMARY", 0, "tgteg"),
+            ("task", "idx_task_user", 1, "users_tgteg"),
+        ])
+
+        with self.assertRaises(SchemaError) as error:
+            await check_schema(pool)
+        self.assertIn("task(users_tgteg, name)", str(error.exception))
+        self.assertIn("task(deadline)", str(error.exception))
+
+    async def test_primary_key_on_tgteg_is_not_duplicated(self):
+        from migrations import _migration_2_access_path_indexes, _migration_7_drop_duplicate_user_index
+
+        _, _, cur = make_pool([("users", "PRIMARY", 0, "tgteg")])
+        cur.fetchone = AsyncMock(return_value=(1,))  # idx_task_user_name уже есть
+        await _migration_2_access_path_indexes(cur)
+        self.assertFalse([c for c in cur.execute.await_args_list if "ALTER TABLE users" in c.args[0]])
+
+        _, _, cur = make_pool([("users", "PRIMARY", 0, "tgteg"), ("users", "uq_users_tgteg", 0, "tgteg")])
+        await _migration_7_drop_duplicate_user_index(cur)
+        cur.execute.assert_awaited_with("ALTER TABLE users DROP INDEX uq_users_tgteg")
+
+
+class TestBenchmark(unittest.IsolatedAsyncioTestCase):
+
+    async def test_replays_all_commands(self):
+        from benchmark import COMMANDS, run_benchmark
+
+        result = await run_benchmark(users=3, rounds=2, concurrency=2)
+
+        self.assertEqual(result["updates"], 3 * 2 * len(COMMANDS))
+        self.assertEqual(result["bot_api_calls"], result["updates"])
+        for command in COMMANDS:
+            self.assertEqual(result["handlers"][command]["count"], 6)
+        self.assertEqual(result["handlers"]["view_task"]["queries_per_update"], 1.0)
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        from metrics import Histogram
+
+        histogram = Histogram("test_seconds", "test", buckets=(0.1, 1.0), label="handler")
+        histogram.observe("start", 0.05)
+        histogram.observe("start", 0.5)
+
+        text = "\n".join(histogram.render())
+        self.assertIn('test_seconds_bucket{handler="start",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{handler="start",le="1.0"} 2', text)
+        self.assertIn('test_seconds_count{handler="start"} 2', text)
+
+    async def test_instrumented_function_records_rows(self):
+        import types
+        import metrics
+
+        module = types.ModuleType("fake_crud")
+
+        async def read_things(pool):
+            return [1, 2, 3]
+
+        read_things.__module__ = module.__name__
+        module.read_things = read_things
+        importer = types.SimpleNamespace(read_things=read_things)
+
+        metrics.instrument_crud(module, importer)
+        self.assertEqual(await importer.read_things(None), [1, 2, 3])
+
+        self.assertIs(module.read_things, importer.read_things)
+        self.assertIn('bot_query_rows_count{query="read_things"} 1', metrics.registry.render())
+
+    async def test_nested_and_internal_calls_are_not_recorded(self):
+        import types
+        import metrics
+
+        module = types.ModuleType("fake_crud_nested")
+
+        async def _fetch(pool):
+            return [1]
+
+        async def write_things(pool):
+            return await module.read_more(pool)
+
+        async def read_more(pool):
+            return await module._fetch(pool)
+
+        for func in (_fetch, write_things, read_more):
+            func.__module__ = module.__name__
+            setattr(module, func.__name__, func)
+
+        metrics.instrument_crud(module)
+        await module.write_things(None)
+
+        self.assertIs(module._fetch, _fetch)
+        text = metrics.registry.render()
+        self.assertIn('bot_query_seconds_count{query="write_things"} 1', text)
+        self.assertNotIn('query="read_more"', text)
+
+    async def test_single_row_counts_as_one(self):
+        import types
+        import metrics
+
+        module = types.ModuleType("fake_crud_row")
+
+        async def read_one_row(pool):
+            return TaskRow(1, "Task 1", "user1", None, None, "Pending", None)
+
+        read_one_row.__module__ = module.__name__
+        module.read_one_row = read_one_row
+        metrics.instrument_crud(module)
+        await module.read_one_row(None)
+
+        self.assertIn('bot_query_rows_sum{query="read_one_row"} 1', metrics.registry.render())
+
+
+class TestImportExport(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        import tempfile
+        from sqlite_pool import open_sqlite_storage
+
+        self.pool = await open_sqlite_storage()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.pool.wait_closed()
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        import os
+
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    async def test_csv_import_reports_rejected_rows(self):
+        from task_format import import_tasks
+
+        path = self.write("tasks.csv", "name,time,date\nTask 1,12:00,25.12.30\nTask 2,25:00,25.12.30\nTask 3,09:30,01.01.31\n")
+
+        accepted, rejected, errors = await import_tasks(self.pool, path, "user1", chunk_size=1)
+
+        self.assertEqual((accepted, rejected), (2, 1))
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("3:"))
+
+    async def test_import_keeps_only_first_errors(self):
+        from task_format import import_tasks
+
+        path = self.write("bad.csv", "".join(f"Task {i},99:99,{'x' * 1000}\n" for i in range(500)))
+
+        accepted, rejected, errors = await import_tasks(self.pool, path, "user1", max_errors=3)
+
+        self.assertEqual((accepted, rejected, len(errors)), (0, 500, 3))
+        self.assertTrue(all(len(error) <= 200 for error in errors))
+
+    async def test_json_import_and_export_round_trip(self):
+        import csv
+        import os
+        from task_format import export_tasks, import_tasks
+
+        path = self.write("tasks.json", '[{"name": "Task 1", "time": "12:00", "date": "25.12.30"},\n'
+                                        ' {"name": "Task 2", "time": "08:15", "date": "01.01.31", "progress": "Completed"}]')
+        accepted, _, errors = await import_tasks(self.pool, path, "user1", "json")
+        export_path = os.path.join(self.tmp.name, "export.csv")
+        count = await export_tasks(self.pool, "user1", export_path)
+
+        self.assertEqual((accepted, errors, count), (2, [], 2))
+        with open(export_path, encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[2], ["Task 2", "08:15", "01.01.31", "Completed", ""])
+
+    async def test_import_survives_bad_rows_and_failed_chunks(self):
+        from unittest.mock import patch
+        import crud
+        from task_format import import_tasks
+
+        path = self.write("tasks.csv", "Task 1,12:00,25.12.30\n"
+                                       f"Huge,12:00,{'x' * 200000}\n"
+                                       "Task 2,12:00,25.12.30,Done\n"
+                                       f"{'N' * 300},12:00,25.12.30\n"
+                                       "Task 3,12:00,25.12.30,in progress\n"
+                                       "Task 4,12:00,25.12.30\n")
+        create_tasks = crud.create_tasks
+
+        async def fail_second_chunk(pool, rows):
+            if rows[0][0] == "Task 4":
+                raise RuntimeError("deadlock")
+            await create_tasks(pool, rows)
+
+        with patch.object(crud, "create_tasks", fail_second_chunk):
+            accepted, rejected, errors = await import_tasks(self.pool, path, "user1", chunk_size=2)
+
+        self.assertEqual((accepted, rejected), (2, 4))
+        self.assertEqual([error.split(":")[0] for error in errors], ["2", "3", "4", "6-6"])
+        self.assertEqual([(t.name, t.prpgress) for t in await read_tasks(self.pool, "user1")],
+                         [("Task 1", "Pending"), ("Task 3", "In Progress")])
+
+    async def test_unreadable_json_tail_keeps_counts(self):
+        from task_format import IncompleteImport, import_tasks
+
+        path = self.write("tasks.json", '{"name": "Task 1", "time": "12:00", "date": "25.12.30"}\n'
+                                        '{"name": "Task 2", "time": "12:00", "date": "99.12.30"}\n'
+                                        '{"name": "Task 3", "time": ')
+
+        with self.assertRaises(IncompleteImport) as caught:
+            await import_tasks(self.pool, path, "user1", "json")
+
+        self.assertEqual((caught.exception.accepted, caught.exception.rejected), (1, 1))
+        self.assertEqual([t.name for t in await read_tasks(self.pool, "user1")], ["Task 1"])
+
+    async def test_repeat_rule_survives_export_and_import(self):
+        import os
+        from task_format import export_tasks, import_tasks
+
+        path = self.write("tasks.json", '{"name": "Gym", "time": "07:00", "date": "01.01.30", "repeat": "weekly:thu,mon"}\n'
+                                        '{"name": "Bad", "time": "07:00", "date": "01.01.30", "repeat": "hourly"}\n')
+        accepted, rejected, _ = await import_tasks(self.pool, path, "user1", "json")
+        export_path = os.path.join(self.tmp.name, "export.csv")
+        await export_tasks(self.pool, "user1", export_path)
+        again, _, errors = await import_tasks(self.pool, export_path, "user2")
+
+        self.assertEqual((accepted, rejected, again, errors), (1, 1, 1, []))
+        self.assertEqual([task.schedulecol for task in await read_tasks(self.pool, "user2")], ["weekly:mon,thu"])
+
+
+class TestMemoryStorage(unittest.IsolatedAsyncioTestCase):
+
+    async def run_scenario(self, pool):
+        task_cache.clear()
+        await upsert_user(pool, "user1", userscol="100")
+        await create_tasks(pool, [(f"Task {i}", "user1", "2030-12-25", "12:00:00", "Pending", None) for i in range(5)])
+        await create_task(pool, "Other", "user2", "2030-12-25", "12:00:00", "Pending")
+        updated = await update_task(pool, "Task 1", "user1", {"prpgress": "Completed"})
+        await delete_task(pool, "Task 3", "user1")
+        page = await read_tasks(pool, "user1", after_id=1, limit=2)
+        previous = await read_tasks(pool, "user1", before_id=5, limit=2)
+        return updated, [t["name"] for t in page], [t["name"] for t in previous], \
+            (await read_task(pool, "Task 1", "user1"))["prpgress"], await read_user_chat(pool, "user1")
+
+    async def test_matches_sqlite_backend(self):
+        from sqlite_pool import open_sqlite_storage
+
+        sqlite = await open_sqlite_storage()
+        try:
+            expected = await self.run_scenario(sqlite)
+        finally:
+            await sqlite.wait_closed()
+
+        self.assertEqual(await self.run_scenario(MemoryStorage()), expected)
+        self.assertEqual(expected, (1, ["Task 1", "Task 2"], ["Task 1", "Task 2"], "Completed", 100))
+
+    async def test_deadline_index_follows_writes(self):
+        from datetime import datetime
+        from sqlite_pool import open_sqlite_storage
+
+        async def scenario(pool):
+            task_cache.clear()
+            await create_tasks(pool, [("A", "user1", "2030-01-01", "09:00:00", "Pending", None),
+                                      ("B", "user1", "2030-01-01", "18:00:00", "Pending", None),
+                                      ("C", "user1", "2030-01-02", None, "Pending", None),
+                                      ("D", "user1", "2020-01-01", None, "Pending", None),
+                                      ("R", "user2", "2024-01-01", "07:00:00", "Pending", "daily")])
+            await update_task(pool, "B", "user1", {"prpgress": "Completed"})
+            await update_task(pool, "C", "user1", {"date_end": "2030-01-01", "time_end": "12:00:00"})
+            await move_overdue_tasks(pool, "user1", "2030-01-01", "23:00:00", datetime(2025, 1, 1))
+            task = await read_task(pool, "R", "user2")
+            await set_next_occurrences(pool, [(task.id, datetime(2030, 1, 3, 7, 0))])
+            windows = []
+            for start, end in ((datetime(2030, 1, 1), datetime(2030, 1, 2)),
+                               (datetime(2030, 1, 1, 10), datetime(2030, 1, 4))):
+                windows.append(sorted(row.name for row in await read_deadlines(pool, start, end)))
+            await delete_task(pool, "A", "user1")
+            await delete_user(pool, "user2")
+            windows.append(sorted(row.name for row in await read_deadlines(pool, datetime(2030, 1, 1),
+                                                                               datetime(2030, 1, 4))))
+            return windows
+
+        sqlite = await open_sqlite_storage()
+        try:
+            expected = await scenario(sqlite)
+        finally:
+            await sqlite.wait_closed()
+        self.assertEqual(await scenario(MemoryStorage()), expected)
+        self.assertEqual(expected, [["A", "C", "D"], ["C", "D", "R"], ["C", "D"]])
+
+    async def test_sqlite_upsert_reports_existing_user(self):
+        from sqlite_pool import open_sqlite_storage
+
+        pool = await open_sqlite_storage()
+        try:
+            created = await upsert_user(pool, "user1", userscol="100")
+            known_users.clear()  # Пользователь вытеснен из кэша — следующий /start снова идёт в базу
+            again = await upsert_user(pool, "user1", userscol="200")
+            chat = await read_user_chat(pool, "user1")
+        finally:
+            await pool.wait_closed()
+
+        self.assertEqual((created, again, chat), (True, False, 200))
+
+    async def test_archive_batches_resume_after_last_id(self):
+        from datetime import datetime, timedelta
+
+        pool = MemoryStorage()
+        await create_tasks(pool, [(f"Task {i}", f"user{i % 2}", None, None, "Completed", None) for i in range(1, 9)])
+        await delete_task(pool, "Task 3", "user1")
+        later = datetime.now() + timedelta(days=1)
+
+        first = await pool.archive_tasks(["Completed"], later, 0, 3)
+        second = await pool.archive_tasks(["Completed"], later, first[-1][0], 3)
+
+        self.assertEqual([row[0] for row in first + second], [1, 2, 4, 5, 6, 7])
+        self.assertEqual(pool._task_ids, [8])
+        self.assertEqual([t.id for t in await read_archived_tasks(pool, "user1")], [7, 5, 1])
+        self.assertEqual([t.id for t in await read_archived_tasks(pool, "user0", before_id=6, limit=1)], [4])
+
+    async def test_delete_user_removes_tasks_on_every_backend(self):
+        from sqlite_pool import open_sqlite_storage
+        from task_search import TaskSearch
+
+        async def scenario(pool):
+            task_cache.clear()
+            search = TaskSearch(pool, idle_ttl=None)
+            search.start()
+            try:
+                await upsert_user(pool, "user1", userscol="100")
+                await create_tasks(pool, [("Task 1", "user1", "2030-12-25", "12:00:00", "Pending", None),
+                                          ("Task 2", "user2", "2030-12-25", "12:00:00", "Pending", None)])
+                await search.search("user1", "task")
+                await delete_user(pool, "user1")
+                return ([t.name for t in await read_tasks(pool, "user1")], [t.name for t in await read_tasks(pool)],
+                        await read_users(pool), await search.search("user1", "task"))
+            finally:
+                await search.stop()
+
+        sqlite = await open_sqlite_storage()
+        try:
+            expected = await scenario(sqlite)
+        finally:
+            await sqlite.wait_closed()
+
+        self.assertEqual(await scenario(MemoryStorage()), expected)
+        self.assertEqual(expected, ([], ["Task 2"], [], []))
+
+    async def test_open_storage_rejects_unknown_backend(self):
+        from storage import open_storage
+
+        self.assertIsInstance(await open_storage("memory"), MemoryStorage)
+        with self.assertRaises(ValueError):
+            await open_storage("redis")
+
+
+class TestAddTasks(unittest.IsolatedAsyncioTestCase):
+
+    def test_parse_date_and_time(self):
+        from task_format import parse_date, parse_time
+
+        self.assertEqual(parse_date("5.1.24"), "2024-01-05")
+        self.assertEqual(parse_date("29.02.24"), "2024-02-29")
+        self.assertEqual(parse_time("9:05"), "09:05:00")
+        for raw in ("29.02.23", "31.04.24", "01.13.24", "01.01.2024"):
+            with self.assertRaises(ValueError):
+                parse_date(raw)
+        with self.assertRaises(ValueError):
+            parse_time("24:00")
+
+    async def test_multi_line_add_writes_valid_lines_at_once(self):
+        from unittest.mock import patch
+        import hendlers
+
+        pool = MemoryStorage()
+        known_users.clear()
+        task_cache.clear()
+        command = "/add_task Task 1, 12:00, 25.12.30\nTask 2, 25:00, 25.12.30\n\nTask 3, 09:30, 01.01.31\nTask 4"
+        with patch.object(hendlers, "create_tasks", wraps=hendlers.create_tasks) as create:
+            result = await hendlers.parse_and_add_task(pool, command, "user1")
+
+        create.assert_awaited_once()
+        self.assertTrue(result.startswith("Добавлено задач: 2 из 4."))
+        self.assertIn("Строка 2:", result)
+        self.assertIn("Строка 5:", result)
+        self.assertEqual([t["name"] for t in await read_tasks(pool, "user1")], ["Task 1", "Task 3"])
+
+
+class TestChatQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_serial_per_chat_and_capped_overall(self):
+        from chat_queue import ChatQueue
+
+        queue = ChatQueue(max_in_flight=2, max_pending=100)
+        order = []
+        running = [0, 0]  # сейчас, максимум
+
+        async def job(chat, number):
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.01 if number == 0 else 0)
+            order.append((chat, number))
+            running[0] -= 1
+
+        for number in range(3):
+            for chat in (1, 2, 3):
+                await queue.submit(chat, lambda chat=chat, number=number: job(chat, number))
+        await queue.drain()
+
+        for chat in (1, 2, 3):
+            self.assertEqual([n for c, n in order if c == chat], [0, 1, 2])
+        self.assertEqual(running[1], 2)
+        self.assertEqual(queue.stats(), {"chats": 0, "pending": 0, "in_flight": 0})
+
+    async def test_submit_waits_when_full(self):
+        from chat_queue import ChatQueue
+
+        queue = ChatQueue(max_in_flight=1, max_pending=1)
+        release = asyncio.Event()
+        await queue.submit(1, release.wait)
+        blocked = asyncio.create_task(queue.submit(2, release.wait))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+
+        release.set()
+        await asyncio.wait_for(blocked, 1)
+        await queue.drain()
+
+    async def test_cancel_drops_unfinished_jobs(self):
+        from chat_queue import ChatQueue
+
+        queue = ChatQueue(max_in_flight=1, max_pending=10)
+        started = []
+
+        async def job(number):
+            started.append(number)
+            await asyncio.Event().wait()
+
+        for number in range(3):
+            await queue.submit(number % 2, lambda number=number: job(number))
+        await asyncio.sleep(0.01)
+        await queue.drain(timeout=0.01)
+        await queue.cancel()
+
+        self.assertEqual(started, [0])
+        self.assertEqual(queue.stats(), {"chats": 0, "pending": 0, "in_flight": 0})
+
+
+class TestBulkUpdates(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        from sqlite_pool import open_sqlite_storage
+
+        task_cache.clear()
+        self.pool = await open_sqlite_storage()
+        await create_tasks(self.pool, [
+            ("Task 1", "user1", "2020-01-01", "10:00:00", "Pending", None),
+            ("Task 2", "user1", "2020-01-02", "10:00:00", "Pending", None),
+            ("Task 3", "user1", "2030-01-01", "10:00:00", "Pending", None),
+            ("Task 4", "user1", "2020-01-01", "10:00:00", "Completed", None),
+        ])
+
+    async def asyncTearDown(self):
+        await self.pool.wait_closed()
+
+    async def progress(self):
+        return {t["name"]: (t["prpgress"], str(t["date_end"])) for t in await read_tasks(self.pool, "user1")}
+
+    async def test_update_tasks_rejects_unknown_column(self):
+        with self.assertRaises(ValueError):
+            await update_tasks(self.pool, ["Task 1"], "user1", {"users_tgteg = 'x', name": "y"})
+
+    async def test_multi_field_update_and_done(self):
+        import hendlers
+
+        result = await hendlers.update_task_fields(self.pool, ["Task 1"], "user1",
+                                                   [("прогресс", "In Progress"), ("дата", "25.12.30")])
+        self.assertTrue(result.startswith("Обновлено задач: 1."))
+        result = await hendlers.update_task_fields(self.pool, ["Task 2", "Task 3", "Missing"], "user1",
+                                                   [("прогресс", "Completed")])
+        self.assertTrue(result.startswith("Обновлено задач: 2."))
+
+        progress = await self.progress()
+        self.assertEqual(progress["Task 1"], ("In Progress", "2030-12-25"))
+        self.assertEqual(progress["Task 2"][0], "Completed")
+        self.assertEqual(progress["Task 3"][0], "Completed")
+
+    async def test_missing_tasks_are_not_reported_as_changed(self):
+        events = []
+        task_listeners.append(lambda *event: events.append(event))
+        try:
+            await read_tasks(self.pool, "user1")
+            updated = await update_task(self.pool, "Missing", "user1", {"prpgress": "Completed"})
+            updated += await update_tasks(self.pool, ["Missing", "Other"], "user1", {"prpgress": "Completed"})
+            deleted = await delete_task(self.pool, "Missing", "user1")
+        finally:
+            task_listeners.pop()
+
+        self.assertEqual((updated, deleted, events), (0, 0, []))
+        self.assertIsNotNone(task_cache.get("user1", (None, None, None)))  # Кэш списка не сброшен
+
+    async def test_move_overdue_tasks(self):
+        from datetime import datetime
+
+        moved = await move_overdue_tasks(self.pool, "user1", "2030-06-01", None, datetime(2025, 1, 1))
+
+        self.assertEqual(moved, 2)
+        progress = await self.progress()
+        self.assertEqual(progress["Task 1"][1], "2030-06-01")
+        self.assertEqual(progress["Task 2"][1], "2030-06-01")
+        self.assertEqual(progress["Task 4"][1], "2020-01-01")
+
+    async def test_move_overdue_tasks_skips_same_named_tasks(self):
+        from datetime import date, datetime
+        from task_stats import TaskStats
+
+        async def scenario(pool):
+            task_cache.clear()
+            await create_tasks(pool, [
+                ("Dup", "user2", "2020-01-01", "10:00:00", "Pending", None),
+                ("Dup", "user2", "2031-01-01", "10:00:00", "Pending", None),
+                ("Dup", "user2", "2020-01-01", "10:00:00", "Completed", None),
+            ])
+            stats = TaskStats(pool, reconcile_interval=None)
+            stats.start()
+            try:
+                self.assertEqual((await stats.get("user2", date(2025, 1, 1)))["overdue"], 1)
+                moved = await move_overdue_tasks(pool, "user2", "2030-06-01", None, datetime(2025, 1, 1))
+                overdue = (await stats.get("user2", date(2025, 1, 1)))["overdue"]
+            finally:
+                await stats.stop()
+            tasks = await read_tasks(pool, "user2")
+            return moved, overdue, [(str(t.date_end), t.prpgress) for t in tasks]
+
+        expected = (1, 0, [("2030-06-01", "Pending"), ("2031-01-01", "Pending"), ("2020-01-01", "Completed")])
+        self.assertEqual(await scenario(self.pool), expected)
+        self.assertEqual(await scenario(MemoryStorage()), expected)
+
+
+class TestTaskStats(unittest.IsolatedAsyncioTestCase):
+
+    async def test_incremental_counters_match_reload(self):
+        from datetime import date
+        from task_stats import TaskStats
+
+        pool = MemoryStorage()
+        stats = TaskStats(pool, reconcile_interval=None)
+        stats.start()
+        try:
+            await create_task(pool, "Old", "user1", "2020-01-01", "10:00:00", "Pending")
+            self.assertEqual(await stats.get("user1", date(2025, 1, 1)),
+                             {"total": 1, "by_status": {"Pending": 1}, "overdue": 1, "due_today": 0})
+
+            await create_tasks(pool, [("Today", "user1", "2025-01-01", None, "Pending", None),
+                                      ("Later", "user1", "2025-01-03", None, "In Progress", None)])
+            await update_task(pool, "Old", "user1", {"prpgress": "Completed"})
+            await update_tasks(pool, ["Later"], "user1", {"date_end": "2025-01-02"})
+            await delete_task(pool, "Missing", "user1")
+
+            self.assertEqual(stats.loads, 1)
+            self.assertEqual(await stats.get("user1", date(2025, 1, 1)),
+                             {"total": 3, "by_status": {"Completed": 1, "Pending": 1, "In Progress": 1},
+                              "overdue": 0, "due_today": 1})
+            self.assertEqual((await stats.get("user1", date(2025, 1, 3)))["overdue"], 2)
+            self.assertEqual(await stats.reconcile(), 0)
+        finally:
+            await stats.stop()
+
+    async def test_reconcile_drops_diverged_counters(self):
+        from datetime import date
+        from unittest.mock import patch
+        from task_stats import TaskStats
+
+        pool = MemoryStorage()
+        await create_task(pool, "A", "user1", "2020-01-01", None, "Pending")
+        await create_task(pool, "B", "user2", "2020-01-01", None, "Pending")
+        stats = TaskStats(pool, reconcile_interval=None)
+        await stats.get("user1", date(2025, 1, 1))
+        await stats.get("user2", date(2025, 1, 1))
+        await pool.update_task("A", "user1", {"prpgress": "Completed"})  # Мимо task_listeners
+
+        with patch("crud.read_task_states", AsyncMock(side_effect=AssertionError)):
+            self.assertEqual(await stats.reconcile(), 1)
+        self.assertEqual((await stats.get("user1", date(2025, 1, 1)))["overdue"], 0)
+        self.assertEqual(stats.loads, 3)
+
+    async def test_digest_uses_grouped_counts(self):
+        from datetime import date
+        from unittest.mock import patch
+        from sqlite_pool import open_sqlite_storage
+        from task_stats import DailyDigest, TaskStats
+
+        async def scenario(pool):
+            await create_user(pool, "user1", userscol="100")
+            await create_user(pool, "user2", userscol="200")
+            await create_user(pool, "user3")
+            await create_user(pool, "user4", userscol="400")
+            await create_tasks(pool, [
+                ("Old", "user1", "2020-01-01", None, "Pending", None),
+                ("Today", "user1", "2025-01-01", None, "Pending", None),
+                ("Done", "user2", "2020-01-01", None, "Completed", None),
+                ("Old", "user3", "2020-01-01", None, "Pending", None),
+                ("Today", "user4", "2025-01-01", None, "Pending", None),
+            ])
+            stats = TaskStats(pool, reconcile_interval=None)
+            await stats.get("user4", date(2025, 1, 1))  # Счётчики user4 уже в кэше
+            send = AsyncMock()
+            read_groups = AsyncMock(wraps=read_task_groups)
+            with patch("crud.read_task_states", AsyncMock(side_effect=AssertionError)), \
+                    patch("crud.read_task_groups", read_groups):
+                sent = await DailyDigest(pool, stats, send, batch_size=2).send_all(date(2025, 1, 1))
+            # Группы читаются только для пачек пользователей не из кэша, а не по всей таблице
+            self.assertEqual([call.args[1] for call in read_groups.await_args_list], [["user1", "user2"]])
+            return sent, [call.args for call in send.await_args_list]
+
+        sqlite = await open_sqlite_storage()
+        try:
+            expected = await scenario(sqlite)
+        finally:
+            await sqlite.wait_closed()
+        known_users.clear()
+        self.assertEqual(await scenario(MemoryStorage()), expected)
+        self.assertEqual(expected[0], 2)
+        self.assertEqual([args[0] for args in expected[1]], [100, 400])
+        self.assertIn("Просрочено: 1", expected[1][0][1])
+        self.assertIn("Срок сегодня: 1", expected[1][0][1])
+        self.assertIn("Срок сегодня: 1", expected[1][1][1])
+
+
+class TestRecurrence(unittest.TestCase):
+
+    def test_weekly_occurrences_in_window(self):
+        from datetime import datetime
+        from recurrence import occurrences, parse_repeat, parse_rule
+
+        rule = parse_rule(parse_repeat("пн, чт"))
+        anchor = datetime(2024, 1, 1, 9, 0)  # понедельник
+
+        result = list(occurrences(rule, anchor, datetime(2030, 1, 1), datetime(2030, 1, 8)))
+
+        self.assertEqual(result, [datetime(2030, 1, 3, 9, 0), datetime(2030, 1, 7, 9, 0)])
+
+    def test_daily_and_monthly_rules(self):
+        from datetime import date, datetime
+        from recurrence import format_rule, next_occurrence, occurs_on, parse_rule
+
+        rule = parse_rule("daily/2;until=2024-01-10")
+        self.assertEqual(format_rule(rule), "daily/2;until=2024-01-10")
+        self.assertTrue(occurs_on(rule, date(2024, 1, 1), date(2024, 1, 9)))
+        self.assertFalse(occurs_on(rule, date(2024, 1, 1), date(2024, 1, 10)))
+        self.assertIsNone(next_occurrence(rule, datetime(2024, 1, 1), datetime(2024, 1, 10)))
+
+        monthly = parse_rule("monthly")
+        self.assertEqual(next_occurrence(monthly, datetime(2024, 1, 31, 8, 0), datetime(2024, 2, 1)),
+                         datetime(2024, 2, 29, 8, 0))
+        with self.assertRaises(ValueError):
+            parse_rule("hourly")
+
+    def test_recurring_task_is_added_and_scheduled(self):
+        import time as _time
+        import hendlers
+        import reminders
+
+        async def scenario():
+            pool = MemoryStorage()
+            task_cache.clear()
+            result = await hendlers.parse_and_add_task(pool, "/add_task Зарядка, 07:00, 01.01.24, ежедневно", "user1")
+            task = (await read_tasks(pool, "user1"))[0]
+            scheduler = reminders.ReminderScheduler(pool, AsyncMock(), window=2 * 86400, state_file=None)
+            scheduler._loaded_until = _time.time() + scheduler.window
+            scheduler.schedule_task(task["id"], "user1", task["name"], task["date_end"], task["time_end"],
+                                    task["schedulecol"])
+            return result, task, hendlers.format_task(task), len(scheduler)
+
+        result, task, text, scheduled = asyncio.run(scenario())
+        self.assertIn("Повтор: ежедневно", result)
+        self.assertEqual(task["schedulecol"], "daily")
+        self.assertIn("Ближайший срок:", text)
+        self.assertEqual(scheduled, 1)
+
+    def test_windows_read_only_due_recurring_tasks(self):
+        from datetime import datetime
+        import reminders
+        from sqlite_pool import open_sqlite_storage
+
+        async def deadlines(pool, start, end):
+            return sorted(row.name for row in await read_deadlines(pool, start, end))
+
+        async def run(pool):
+            await create_user(pool, "user1", userscol="100")
+            await create_tasks(pool, [("Ended", "user1", "2024-01-01", "07:00:00", "Pending", "daily;until=2024-02-01"),
+                                      ("Running", "user1", "2024-01-01", "07:00:00", "Pending",
+                                       "daily;until=2030-12-31"),
+                                      ("Forever", "user1", "2024-01-01", "07:00:00", "Pending", "weekly"),
+                                      ("Twice", "user1", "2024-01-01", "07:00:00", "Pending", "daily"),
+                                      ("Twice", "user1", "2024-01-01", "19:00:00", "Pending", "daily")])
+            day, next_day = datetime(2030, 1, 1), datetime(2030, 1, 2)
+            # Ближайшие повторения новых задач ещё не вычислены
+            steps = [await deadlines(pool, day, next_day)]
+            send = AsyncMock()
+            scheduler = reminders.ReminderScheduler(pool, send, window=86400, state_file=None)
+            scheduler._fired_until = scheduler._loaded_until = day.timestamp()
+            await scheduler._load_next_window()
+            steps.append(await deadlines(pool, day, next_day))
+            steps.append((len(scheduler), len(scheduler._rules)))
+            await scheduler._fire_due(next_day.timestamp() - 1)
+            steps.append(await deadlines(pool, day, next_day))
+            steps.append((len(scheduler), len(scheduler._rules), send.await_count))
+            # Изменение срока снова требует вычислить повторение, завершение убирает задачу из окон
+            await update_task(pool, "Running", "user1", {"time_end": "08:00:00"})
+            steps.append(await deadlines(pool, day, next_day))
+            await update_task(pool, "Running", "user1", {"prpgress": "Completed"})
+            await update_task(pool, "Running", "user1", {"prpgress": "Pending"})
+            await update_task(pool, "Twice", "user1", {"schedulecol": None})
+            steps.append(await deadlines(pool, day, next_day))
+            return steps
+
+        async def scenario():
+            sqlite = await open_sqlite_storage()
+            try:
+                from_sqlite = await run(sqlite)
+            finally:
+                await sqlite.wait_closed()
+            known_users.clear()
+            return from_sqlite, await run(MemoryStorage())
+
+        from_sqlite, from_memory = asyncio.run(scenario())
+        self.assertEqual(from_memory, from_sqlite)
+        before, loaded, scheduled, fired, after, changed, reopened = from_sqlite
+        self.assertEqual(before, ["Ended", "Forever", "Running", "Twice", "Twice"])
+        # Закончившиеся и недельные повторения не попадают в окно, задачи с одним названием — обе
+        self.assertEqual(loaded, ["Running", "Twice", "Twice"])
+        self.assertEqual(scheduled, (3, 3))
+        # После отправки next_at сдвинут на следующий день, правила за пределами окна не хранятся
+        self.assertEqual(fired, [])
+        self.assertEqual(after, (0, 0, 3))
+        self.assertEqual(changed, ["Running"])
+        self.assertEqual(reopened, ["Running"])
+
+
+class TestTaskSearch(unittest.IsolatedAsyncioTestCase):
+
+    async def test_index_follows_writes_and_fixes_typos(self):
+        import hendlers
+        from task_search import TaskSearch, normalize
+
+        pool = MemoryStorage()
+        task_cache.clear()
+        search = TaskSearch(pool, idle_ttl=None)
+        search.start()
+        try:
+            await create_tasks(pool, [("Сделать уроки", "user1", None, None, None, None),
+                                      ("Купить хлеб", "user1", None, None, None, None)])
+            self.assertEqual(await search.search("user1", "урок"), ["Сделать уроки"])
+            self.assertEqual(search.builds, 1)
+
+            await create_task(pool, "Купить молоко", "user1")
+            await update_task(pool, "Купить хлеб", "user1", {"name": "Купить батон"})
+            await delete_task(pool, "Сделать уроки", "user1")
+            self.assertEqual(await search.search("user1", "купить"), ["Купить батон", "Купить молоко"])
+            self.assertEqual(await search.search("user1", "урок"), [])
+            self.assertEqual(search.builds, 1)  # Индекс обновлялся по событиям, без повторного чтения
+
+            result = await hendlers.update_task_field(pool, "купить малоко", "user1", "прогресс", "Completed",
+                                                      task_search=search)
+            self.assertIn("'Купить молоко'", result)
+            result = await hendlers.update_task_field(pool, "купить", "user1", "прогресс", "Completed",
+                                                      task_search=search)
+            self.assertIn("Возможно, вы имели в виду", result)
+
+            # Подстрока проверяется только у названий со всеми триграммами запроса, а не у всех 5002
+            await create_tasks(pool, [(f"Задача номер {i}", "user1", None, None, None, None) for i in range(5000)])
+            self.assertEqual((await search.search("user1", "купить молок"))[0], "Купить молоко")
+            index = search._users.get("user1")
+            self.assertEqual(len(index.names), 5002)
+            self.assertEqual(index._candidates(normalize("купить молок")), {"Купить молоко"})
+            self.assertEqual(len(index._candidates(normalize("номер 12"))), 111)
+            self.assertEqual(search.builds, 1)
+        finally:
+            await search.stop()
+
+
+class TestLifecycle(unittest.IsolatedAsyncioTestCase):
+
+    async def test_warm_up_fills_known_users(self):
+        from sqlite_pool import open_sqlite_storage
+        import lifecycle
+
+        pool = await open_sqlite_storage()
+        try:
+            await create_user(pool, "user1", userscol="42")
+            known_users.clear()
+            result = await lifecycle.warm_up(pool, connections=5, users=10)
+        finally:
+            await pool.wait_closed()
+
+        self.assertEqual(result["connections"], 1)  # Не больше размера пула
+        self.assertEqual(result["users"], 1)
+        self.assertEqual(known_users.get("user1"), "42")
+
+    async def test_warm_up_limits_users_in_query(self):
+        from unittest.mock import patch
+        import lifecycle
+
+        pool = MemoryStorage()
+        for i in range(5):
+            await create_user(pool, f"user{i}")
+        known_users.clear()
+        with patch("crud.read_users", wraps=read_users) as spy:
+            result = await lifecycle.warm_up(pool, connections=0, users=2)
+
+        self.assertEqual(result["users"], 2)
+        spy.assert_awaited_once_with(pool, limit=2)
+        self.assertEqual(len(await read_users(pool, limit=3)), 3)
+
+    async def test_warm_up_fails_when_connection_fails(self):
+        from contextlib import asynccontextmanager
+        from types import SimpleNamespace
+        import lifecycle
+
+        attempts = []
+        held = []
+
+        @asynccontextmanager
+        async def acquire():
+            attempts.append(1)
+            if len(attempts) == 2:
+                raise ConnectionError("no connection")
+            cursor = AsyncMock()
+            cursor.__aenter__.return_value = cursor
+            held.append(1)
+            try:
+                yield SimpleNamespace(cursor=lambda: cursor)
+            finally:
+                held.pop()
+
+        pool = SimpleNamespace(maxsize=3, acquire=acquire)
+        with self.assertRaises(ConnectionError):
+            await asyncio.wait_for(lifecycle.warm_up(pool, connections=3), 1)
+        self.assertEqual(held, [])  # Остальные соединения возвращены, а не ждут вечно
+
+    async def test_only_processed_updates_are_confirmed(self):
+        from types import SimpleNamespace
+        from chat_queue import ChatOrderingMiddleware, ChatQueue
+        import lifecycle
+
+        tracker = lifecycle.UpdateTracker()
+        middleware = ChatOrderingMiddleware(ChatQueue(max_in_flight=2), tracker)
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            if event.update_id == 11:
+                await release.wait()
+
+        for update_id, chat in ((10, 1), (11, 2), (12, 1)):
+            await middleware(handler, SimpleNamespace(update_id=update_id),
+                             {"event_chat": SimpleNamespace(id=chat)})
+        await asyncio.sleep(0.01)
+        self.assertEqual(tracker.offset(), 11)  # 12 обработано, но 11 ещё нет
+
+        bot = AsyncMock()
+        await lifecycle.confirm_updates(bot, tracker)
+        bot.get_updates.assert_awaited_once_with(offset=11, limit=1, timeout=0)
+
+        # Telegram присылает 11 и 12 снова: 12 уже обработано и пропускается
+        calls = []
+
+        async def redelivered(event, data):
+            calls.append(event.update_id)
+
+        await middleware(redelivered, SimpleNamespace(update_id=12), {"event_chat": SimpleNamespace(id=1)})
+        await middleware(redelivered, SimpleNamespace(update_id=11), {"event_chat": SimpleNamespace(id=2)})
+        await middleware.queue.drain(timeout=0.01)
+        self.assertEqual(calls, [])  # 11 ещё в обработке
+
+        release.set()
+        await middleware.queue.drain()
+        self.assertEqual(tracker.offset(), 13)
+
+    async def test_processed_updates_are_skipped_after_restart(self):
+        import os
+        import tempfile
+        import lifecycle
+
+        state_file = os.path.join(tempfile.mkdtemp(), "updates.json")
+        tracker = lifecycle.UpdateTracker(state_file=state_file)
+        for update_id in (10, 11, 12):
+            self.assertTrue(tracker.begin(update_id))
+        tracker.end(10)
+        tracker.end(12)
+        await lifecycle.confirm_updates(AsyncMock(), tracker)
+
+        restarted = lifecycle.UpdateTracker(state_file=state_file)
+        self.assertEqual(restarted.offset(), 11)
+        self.assertFalse(restarted.begin(10))
+        self.assertTrue(restarted.begin(11))
+        self.assertFalse(restarted.begin(12))
+        self.assertTrue(restarted.begin(13))
+
+    async def test_get_updates_offset_follows_unfinished(self):
+        from types import SimpleNamespace
+        from aiogram.methods import GetUpdates, SendMessage
+        import lifecycle
+
+        tracker = lifecycle.UpdateTracker()
+        middleware = lifecycle.UpdateOffsetMiddleware(tracker)
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method)
+            return [SimpleNamespace(update_id=11), SimpleNamespace(update_id=12)]
+
+        tracker.begin(11)
+        tracker.begin(12)
+        tracker.end(12)
+        await middleware(make_request, None, GetUpdates(offset=13, timeout=0))
+        self.assertEqual(sent[-1].offset, 11)  # 11 не обработано и не подтверждается
+        self.assertTrue(tracker.stalled)  # Telegram вернул только уже принятые обновления
+
+        tracker.end(11)
+        await middleware(make_request, None, GetUpdates(offset=13, timeout=1))
+        self.assertEqual(sent[-1].offset, 13)
+        self.assertFalse(tracker.seen(14))
+        self.assertTrue(tracker.seen(12))
+
+        await middleware(make_request, None, SendMessage(chat_id=1, text="x"))
+        self.assertIsInstance(sent[-1], SendMessage)
+
+
+class FakeBotAPI:
+    """Локальный сервер Bot API: запоминает sendMessage и отвечает 429 на первые flood_replies запросов."""
+
+    def __init__(self, flood_replies: int = 0):
+        self.messages = []
+        self.documents = []
+        self.flood_replies = flood_replies
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        data = dict(await request.post())
+        if self.flood_replies:
+            self.flood_replies -= 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}})
+        self.messages.append((int(data["chat_id"]), data["text"]))
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.messages), "date": 0, "text": data["text"],
+            "chat": {"id": int(data["chat_id"]), "type": "private"},
+        }})
+
+    async def handle_document(self, request):
+        from aiohttp import web
+
+        data = await request.post()
+        document = data[data["document"].removeprefix("attach://")]  # Файл передаётся отдельной частью формы
+        self.documents.append((int(data["chat_id"]), document.filename, document.file.read().decode("utf-8"),
+                               data.get("caption")))
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.documents), "date": 0,
+            "chat": {"id": int(data["chat_id"]), "type": "private"},
+        }})
+
+    async def __aenter__(self):
+        from aiohttp import web
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/sendMessage", self.handle)
+        app.router.add_post("/bot{token}/sendDocument", self.handle_document)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+        self.bot = Bot("123456:TEST", session=session)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.bot.session.close()
+        await self.runner.cleanup()
+
+
+class TestSendQueue(unittest.IsolatedAsyncioTestCase):
+
+    def test_split_text(self):
+        from send_queue import split_text
+
+        parts = split_text("\n".join(["x" * 3000, "y" * 3000, "z" * 9000]), limit=4096)
+
+        self.assertEqual([len(part) for part in parts], [3000, 3000, 4096, 4096, 808])
+
+    async def test_priorities_retry_after_and_splitting(self):
+        from send_queue import BULK, SendQueue
+
+        async with FakeBotAPI(flood_replies=1) as api:
+            queue = SendQueue(api.bot, global_rate=100, chat_rate=100, chat_burst=100, max_concurrency=1)
+            await queue.send(1, "рассылка", priority=BULK)
+            done = await queue.send(2, "a" * 5000)
+            queue.start()
+            message = await asyncio.wait_for(done, 5)
+            await queue.stop(timeout=5)
+
+        self.assertEqual(message.text, "a" * 904)
+        # Первая часть получила 429 и была повторена после паузы чата, порядок частей сохранён
+        self.assertEqual([text for chat, text in api.messages if chat == 2], ["a" * 4096, "a" * 904])
+        self.assertEqual(queue.stats()["retries"], 1)
+        self.assertEqual(queue.stats()["sent"], 3)
+
+    async def test_replies_go_ahead_of_bulk(self):
+        from send_queue import BULK, SendQueue
+
+        async with FakeBotAPI() as api:
+            queue = SendQueue(api.bot, global_rate=100, chat_rate=100, chat_burst=100, max_concurrency=1)
+            for chat in (1, 2):
+                await queue.send(chat, "рассылка", priority=BULK)
+            await queue.send(3, "ответ")
+            queue.start()
+            await queue.stop(timeout=5)
+
+        self.assertEqual(api.messages, [(3, "ответ"), (1, "рассылка"), (2, "рассылка")])
+
+    async def test_export_goes_through_queue(self):
+        import os
+        import tempfile
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from send_queue import SendQueue
+        import hendlers
+
+        pool = MemoryStorage()
+        await create_task(pool, "Task 1", "user1", "2030-12-25", "12:00:00", "Pending")
+        message = AsyncMock(chat=SimpleNamespace(id=5, username="user1"))
+        async with FakeBotAPI() as api:
+            queue = SendQueue(api.bot, global_rate=100, chat_rate=100, chat_burst=100)
+            tmp_dir = tempfile.mkdtemp()
+            with patch("tempfile.mkdtemp", return_value=tmp_dir):
+                await hendlers.export_tasks_handler(message, pool, send_queue=queue)
+            self.assertEqual(queue.stats()["queued"], 1)
+            self.assertTrue(os.path.exists(tmp_dir))  # Файл нужен очереди до отправки
+            queue.start()
+            await queue.stop(timeout=5)
+
+        message.answer_document.assert_not_called()
+        [(chat, filename, text, caption)] = api.documents
+        self.assertEqual((chat, filename, caption), (5, "tasks.csv", "Задач: 1"))
+        self.assertIn("Task 1", text)
+        self.assertFalse(os.path.exists(tmp_dir))
+
+
+class TestArchiver(unittest.IsolatedAsyncioTestCase):
+
+    async def check_backend(self, pool):
+        from datetime import date, datetime, timedelta
+        from archiver import TaskArchiver
+        from task_stats import TaskStats
+
+        task_cache.clear()
+        await create_tasks(pool, [(f"Task {i}", "user1", "2030-01-01", "10:00:00", "Pending", None) for i in range(5)])
+        await update_tasks(pool, ["Task 0", "Task 2", "Task 3"], "user1", {"prpgress": "Completed"})
+        stats = TaskStats(pool, reconcile_interval=None)
+        stats.start()
+        try:
+            self.assertEqual((await stats.get("user1", date(2025, 1, 1)))["total"], 5)
+            archiver = TaskArchiver(pool, age=86400, batch_size=2, pause=0)
+
+            self.assertEqual(await archiver.run_once(), 0)  # Задачи изменены только что
+            self.assertEqual(await archiver.run_once(datetime.now() + timedelta(days=2)), 3)
+
+            self.assertEqual(archiver.batches, 3)  # Пустой проход и две пачки по keyset
+            self.assertEqual([t["name"] for t in await read_tasks(pool, "user1")], ["Task 1", "Task 4"])
+            archived = await read_archived_tasks(pool, "user1")
+            self.assertEqual([t["name"] for t in archived], ["Task 3", "Task 2", "Task 0"])
+            self.assertEqual([t["name"] for t in await read_archived_tasks(pool, "user1", archived[0]["id"], 1)],
+                             ["Task 2"])
+            self.assertEqual([t.name for t in await read_archived_tasks(pool, "user1", limit=1,
+                                                                        after_id=archived[2].id)], ["Task 2"])
+            await self.check_archive_pages(pool, archived)
+            self.assertEqual(await stats.get("user1", date(2025, 1, 1)),
+                             {"total": 2, "by_status": {"Pending": 2}, "overdue": 0, "due_today": 0})
+            self.assertEqual(await stats.reconcile(), 0)
+        finally:
+            await stats.stop()
+
+    async def check_archive_pages(self, pool, archived):
+        from unittest.mock import patch
+        import hendlers
+
+        def names(text):
+            return [line.split(",")[0][len("Задача: "):] for line in text.split("\n")]
+
+        def buttons(keyboard):
+            return [hendlers.ArchivePage.unpack(button.callback_data) for button in keyboard.inline_keyboard[0]]
+
+        with patch.object(hendlers.config, "TASKS_PAGE_SIZE", 2, create=True):
+            text, keyboard = await hendlers.view_archive_page(pool, "user1")
+            self.assertEqual(names(text), ["Task 3", "Task 2"])
+            self.assertEqual(buttons(keyboard), [hendlers.ArchivePage(direction="next", cursor=archived[1].id)])
+
+            text, keyboard = await hendlers.view_archive_page(pool, "user1", "next", archived[1].id)
+            self.assertEqual(names(text), ["Task 0"])
+            self.assertEqual(buttons(keyboard), [hendlers.ArchivePage(direction="prev", cursor=archived[2].id)])
+
+            text, keyboard = await hendlers.view_archive_page(pool, "user1", "prev", archived[2].id)
+            self.assertEqual(names(text), ["Task 3", "Task 2"])
+            self.assertEqual(buttons(keyboard), [hendlers.ArchivePage(direction="next", cursor=archived[1].id)])
+
+    async def test_memory_storage(self):
+        await self.check_backend(MemoryStorage())
+
+    async def test_sqlite(self):
+        from sqlite_pool import open_sqlite_storage
+
+        pool = await open_sqlite_storage()
+        try:
+            await self.check_backend(pool)
+        finally:
+            await pool.wait_closed()
+
+
+class TestQueries(unittest.IsolatedAsyncioTestCase):
+
+    def test_row_supports_mapping_access(self):
+        import sys
+        from queries import TaskRow
+
+        row = TaskRow(1, "Task", "user1", "2030-12-25", None, "Pending", None)
+        self.assertEqual((row.name, row["name"], row[1], row.get("schedulecol", "-"), row.get("x", "-")),
+                         ("Task", "Task", "Task", None, "-"))
+        self.assertEqual(dict(row)["prpgress"], "Pending")
+        with self.assertRaises(KeyError):
+            row["x"]
+        self.assertLess(sys.getsizeof(row), sys.getsizeof(dict(row)))
+
+    def test_update_statement_is_cached_and_checked(self):
+        from queries import update_statement
+
+        first = update_statement(("prpgress", "date_end"), 3)
+        self.assertIs(update_statement(("prpgress", "date_end"), 3), first)
+        self.assertEqual(first, "UPDATE task SET prpgress = %s, date_end = %s WHERE users_tgteg = %s "
+                                "AND name IN (%s, %s, %s)")
+        with self.assertRaises(ValueError):
+            update_statement(("id",))
+        with self.assertRaises(ValueError):
+            update_statement(())
+
+    def test_bulk_statements_are_cached(self):
+        from queries import (archive_move_statements, archive_select_statement, move_overdue_statement,
+                             task_groups_statement)
+
+        self.assertIs(move_overdue_statement(("date_end",)), move_overdue_statement(("date_end",)))
+        self.assertIs(task_groups_statement(2), task_groups_statement(2))
+        self.assertIn("IN (%s, %s)", task_groups_statement(2))
+        self.assertNotIn("WHERE", task_groups_statement(None))
+        self.assertTrue(archive_select_statement(2, " FOR UPDATE").endswith("LIMIT %s FOR UPDATE"))
+        self.assertIs(archive_move_statements(3), archive_move_statements(3))
+        with self.assertRaises(ValueError):
+            move_overdue_statement(("id",))
+
+    async def test_backends_return_rows(self):
+        from sqlite_pool import open_sqlite_storage
+
+        async def scenario(pool):
+            task_cache.clear()
+            await upsert_user(pool, "user1", userscol="100")
+            await create_tasks(pool, [(f"Task {i}", "user1", "2030-12-25", "12:00:00", "Pending", None) for i in range(3)])
+            await update_task(pool, "Task 0", "user1", {"prpgress": "Completed", "time_end": "13:00:00"})
+            tasks = await read_tasks(pool, "user1")
+            return [type(row).__name__ for row in (tasks[0], (await read_task_states(pool, "user1"))[0],
+                                                   (await read_users(pool))[0])], \
+                [(t.id, t.name, t.prpgress, str(t.time_end)) for t in tasks]
+
+        sqlite = await open_sqlite_storage()
+        try:
+            expected = await scenario(sqlite)
+        finally:
+            await sqlite.wait_closed()
+        self.assertEqual(await scenario(MemoryStorage()), expected)
+        self.assertEqual(expected[0], ["TaskRow", "TaskStateRow", "UserRow"])
+        self.assertEqual(expected[1][0], (1, "Task 0", "Completed", "13:00:00"))
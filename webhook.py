@@ -0,0 +1,144 @@
+"""
+Режим webhook: HTTP-сервер, принимающий обновления от Telegram и передающий их в тот же Dispatcher.
+
+Запуск: python bot.py --mode webhook --port 8080
+Локальная проверка: curl -X POST -H 'Content-Type: application/json' -d @update.json http://localhost:8080/webhook
+
+Обновления принимает один процесс. Кэш списков задач, счётчики /stats, индексы /find, подписчики
+crud.task_listeners и напоминания живут в памяти процесса: изменение задачи в одном процессе
+не дошло бы до остальных, поэтому настройки числа процессов нет. Нагрузку одного процесса
+ограничивает max_in_flight (WEBHOOK_MAX_IN_FLIGHT).
+"""
+import asyncio
+import logging
+from typing import Callable, Optional, Set
+
+import config
+import lifecycle
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from config import BOT_TOKEN
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """
+    Принимает обновление, сразу отвечает 200 и обрабатывает его в фоне.
+
+    Число одновременно обрабатываемых обновлений ограничено max_in_flight: когда все места заняты,
+    ответ на новый запрос задерживается, и Telegram не присылает следующие обновления быстрее,
+    чем бот успевает их обрабатывать.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int = 100,
+                 secret_token: Optional[str] = None):
+        """
+        :param dispatcher: Диспетчер с обработчиками бота.
+        :param bot: Экземпляр бота.
+        :param max_in_flight: Максимальное число обновлений в обработке.
+        :param secret_token: (опционально) Секрет, который Telegram передаёт в заголовке запроса.
+        """
+        self._dispatcher = dispatcher
+        self._bot = bot
+        self._secret_token = secret_token
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._secret_token and request.headers.get(SECRET_HEADER) != self._secret_token:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: dict):
+        try:
+            await self._dispatcher.feed_raw_update(self._bot, update)
+        except Exception:
+            logger.exception("Ошибка при обработке обновления %s", update.get("update_id"))
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Дожидается завершения обновлений, которые уже приняты в обработку."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, path: str = "/webhook", max_in_flight: int = 100,
+               secret_token: Optional[str] = None) -> web.Application:
+    """
+    Создаёт aiohttp-приложение, которое передаёт обновления в диспетчер.
+    Хуки запуска и остановки диспетчера вызываются вместе с запуском и остановкой приложения.
+    """
+    handler = WebhookHandler(dispatcher, bot, max_in_flight=max_in_flight, secret_token=secret_token)
+    app = web.Application()
+    app["webhook_handler"] = handler
+    app.router.add_post(path, handler.handle)
+
+    async def on_startup(_app: web.Application):
+        await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+
+    async def on_shutdown(_app: web.Application):
+        await handler.drain(timeout=getattr(config, "WEBHOOK_DRAIN_TIMEOUT", 10))
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def _serve(dispatcher_factory: Callable[[], Dispatcher], host: str, port: int):
+    lifecycle.mark_started()
+    dispatcher = dispatcher_factory()
+    app = create_app(
+        dispatcher,
+        Bot(BOT_TOKEN),
+        path=getattr(config, "WEBHOOK_PATH", "/webhook"),
+        max_in_flight=getattr(config, "WEBHOOK_MAX_IN_FLIGHT", 100),
+        secret_token=getattr(config, "WEBHOOK_SECRET", None),
+    )
+    web.run_app(app, host=host, port=port, print=None)
+
+
+async def _set_webhook():
+    # Регистрируем адрес webhook до запуска HTTP-сервера
+    url = getattr(config, "WEBHOOK_URL", None)
+    if not url:
+        logger.info("WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+        return
+    bot = Bot(BOT_TOKEN)
+    try:
+        # Обновления, накопившиеся за время перезапуска, Telegram пришлёт после регистрации
+        await bot.set_webhook(url, secret_token=getattr(config, "WEBHOOK_SECRET", None),
+                              drop_pending_updates=getattr(config, "DROP_PENDING_UPDATES", False))
+    finally:
+        await bot.session.close()
+
+
+def run_webhook(dispatcher_factory: Callable[[], Dispatcher], host: str = "0.0.0.0", port: int = 8080):
+    """
+    Запускает бота в режиме webhook в текущем процессе.
+
+    :param dispatcher_factory: Функция, создающая диспетчер.
+    :param host: Адрес HTTP-сервера.
+    :param port: Порт HTTP-сервера.
+    """
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_set_webhook())
+    _serve(dispatcher_factory, host, port)